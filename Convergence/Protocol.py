@@ -15,17 +15,19 @@ class Protocol(Perspectives.Protocol):
 
     _str = "Convergence"
 
-    def get_url(self):
-        """Return the URL to use to query for the given service"""
-        url = "https://%s:%d/target/%s+%d" % (
-            self.notary.hostname,
-            self.notary.port,
+    scheme = "https"
+
+    def get_path(self):
+        """Return the path of the URL for the given service"""
+        path = "/target/%s+%d" % (
             self.service.hostname,
             self.service.port)
-        return url
+        return path
+
+    def parse_response(self, data, verify=True):
+        """Parse response data, returning NotaryResponse instance
 
-    def parse_response(self, data):
-        """Parse response data, returning NotaryResponse instance"""
+        If verify is False, the signature is not verified."""
         d = json.loads(data)
         key_list = d["fingerprintList"]
         keys = [self._parse_key(key) for key in key_list]
@@ -39,7 +41,8 @@ class Protocol(Perspectives.Protocol):
                                   sig_type,
                                   sig,
                                   data)
-        self.verify_response(response)
+        if verify:
+            self.verify_response(response)
         return response
 
     def _parse_key(self, d):
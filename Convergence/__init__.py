@@ -11,6 +11,7 @@ from Perspectives import NotaryResponseException
 from Perspectives import NotaryUnknownServiceException
 from Perspectives import NotaryResponseBadSignature
 from Perspectives import Fingerprint
+from Perspectives import NegativeCache
 from Perspectives import Notary
 from Perspectives import Notaries
 from Perspectives import NotaryResponse
@@ -19,3 +20,6 @@ from Perspectives import NotaryResponseTimeSpan
 from Perspectives import ServiceKey
 from Perspectives import NotaryResponses
 from Perspectives import Service, ServiceType
+from Perspectives import DiskResponseCache
+from Perspectives import ResponseCache
+from Perspectives import VerificationCache
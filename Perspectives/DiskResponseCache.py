@@ -0,0 +1,202 @@
+"""DiskResponseCache: Notary responses cached on disk across processes"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+class DiskResponseCache:
+    """Cache of notary responses in an SQLite database
+
+    The raw reply of each response is stored along with the notary's
+    hostname, port and a digest of its public key, the service, the
+    time it was fetched and whether its signature was verified. The
+    database uses write-ahead logging, so many processes may read and
+    write it at once, letting new worker processes start with the
+    responses fetched by others.
+
+    Responses are rebuilt from the raw reply when loaded. If verify is
+    True, the signature is verified again, otherwise the recorded
+    verification result is trusted, which is only as safe as the
+    database file. Entries for a notary whose public key has since
+    changed are ignored.
+
+    Freshness is as for ResponseCache. hits and misses count lookups
+    that did and did not find a fresh response in this process."""
+
+    _schema = """CREATE TABLE IF NOT EXISTS responses (
+        notary_hostname TEXT NOT NULL,
+        notary_port INTEGER NOT NULL,
+        service_hostname TEXT NOT NULL,
+        service_port INTEGER NOT NULL,
+        service_type INTEGER NOT NULL,
+        notary_key BLOB NOT NULL,
+        raw_response BLOB NOT NULL,
+        fetched REAL NOT NULL,
+        expires REAL NOT NULL,
+        verified INTEGER NOT NULL,
+        PRIMARY KEY (notary_hostname, notary_port,
+                     service_hostname, service_port, service_type))"""
+
+    def __init__(self, path, ttl=3600, min_ttl=60, verify=True, timeout=10):
+        """Create a DiskResponseCache using the database at path
+
+        ttl and min_ttl are as for ResponseCache.
+
+        verify, if True, verifies signatures when loading responses.
+
+        timeout is how long in seconds to wait for another process
+        holding a lock on the database."""
+        self.logger = logging.getLogger("Perspectives.DiskResponseCache")
+        self.path = path
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.verify = verify
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (hostname, port) -> (public key, digest) of notaries seen
+        self._notary_keys = {}
+        # sqlite3 connections may not be shared between threads, nor
+        # used in a child process after fork, so keep one per thread
+        # and note which process opened it.
+        self._local = threading.local()
+        self._connect()
+
+    def _connect(self):
+        """Return database connection for this thread and process"""
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) == pid:
+            return self._local.connection
+        self.logger.debug("Opening %s" % self.path)
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute(self._schema)
+        self._local.connection = connection
+        self._local.pid = pid
+        return connection
+
+    @staticmethod
+    def make_key(notary, service):
+        """Return cache key for notary's response regarding service"""
+        return (notary.hostname, notary.port,
+                service.hostname, service.port, service.type)
+
+    def _notary_key(self, notary):
+        """Return digest identifying notary's public key
+
+        Digests are remembered for as long as the notary has the same
+        public key object, saving a PEM export and hash per lookup."""
+        address = (notary.hostname, notary.port)
+        with self._lock:
+            entry = self._notary_keys.get(address)
+        if (entry is not None) and (entry[0] is notary.public_key):
+            return entry[1]
+        digest = sqlite3.Binary(
+            hashlib.sha1(notary.get_public_key_pem()).digest())
+        with self._lock:
+            self._notary_keys[address] = (notary.public_key, digest)
+        return digest
+
+    def _count(self, hit):
+        """Count a lookup that did or did not find a response"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, notary, service):
+        """Return fresh cached response of notary regarding service or None
+
+        Responses failing verification are removed."""
+        row = self._connect().execute(
+            "SELECT notary_key, raw_response, verified FROM responses"
+            " WHERE notary_hostname=? AND notary_port=?"
+            " AND service_hostname=? AND service_port=? AND service_type=?"
+            " AND expires >= ?",
+            self.make_key(notary, service) + (time.time(),)).fetchone()
+        if (row is None) or (bytes(row[0]) != bytes(self._notary_key(notary))):
+            self._count(False)
+            return None
+        raw_response, verified = bytes(row[1]), row[2]
+        protocol = notary.get_protocol(service)
+        try:
+            response = protocol.parse_response(
+                raw_response, verify=self.verify or not verified)
+        except Exception as e:
+            self.logger.info("Dropping cached response from %s: %s" % (
+                    notary, e))
+            self.delete(notary, service)
+            self._count(False)
+            return None
+        self._count(True)
+        return response
+
+    def put(self, notary, service, response, verified=True):
+        """Store response of notary regarding service
+
+        verified records whether response's signature has been verified,
+        as it has for responses from Notaries.query()."""
+        now = time.time()
+        expiration = max(now + self.min_ttl,
+                         (response.last_timestamp() or 0) + self.ttl)
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES"
+                " (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self.make_key(notary, service) + (
+                    self._notary_key(notary),
+                    sqlite3.Binary(response.raw_response),
+                    now,
+                    expiration,
+                    1 if verified else 0))
+
+    def delete(self, notary, service):
+        """Remove any response of notary regarding service"""
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "DELETE FROM responses"
+                " WHERE notary_hostname=? AND notary_port=?"
+                " AND service_hostname=? AND service_port=?"
+                " AND service_type=?",
+                self.make_key(notary, service))
+
+    def purge(self):
+        """Remove expired responses, returning how many were removed"""
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "DELETE FROM responses WHERE expires < ?", (time.time(),))
+        return cursor.rowcount
+
+    def clear(self):
+        """Remove all responses and reset counters"""
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM responses")
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """Close this thread's database connection"""
+        if getattr(self._local, "pid", None) == os.getpid():
+            self._local.connection.close()
+        self._local.pid = None
+        self._local.connection = None
+
+    def __len__(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def __str__(self):
+        return "DiskResponseCache %s: %d responses, %d hits, %d misses" % (
+            self.path, len(self), self.hits, self.misses)
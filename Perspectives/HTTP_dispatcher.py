@@ -1,19 +1,22 @@
 """HTTP_dispatcher: asyncore.dispatcher with HTTP/HTTPS support"""
 
 # For some sites (e.g., https://githib.com) it can take a long time
-# for the connection to be recognized as closed. I'm not sure if that
-# is because the site isn't closing the connection and the
-# HTTP_dispatcher needs to key off of the content being done, or the
-# close just isn't percolating up.
+# for the connection to be recognized as closed, so responses are
+# parsed as they arrive and the dispatcher finishes as soon as the
+# response is complete, see HTTP_response_parser.
 
+import errno
 import httplib
 import logging
+import os
 import socket
 import StringIO
 import sys
 import urlparse
 
-from ssl_dispatcher import ssl_dispatcher
+from Resolver import default_resolver
+from connection_race import connection_race
+from ssl_dispatcher import ssl_dispatcher, SSL_STATE
 
 class StringBuffer(StringIO.StringIO):
     def makefile(self, *args, **kw):
@@ -21,88 +24,571 @@ class StringBuffer(StringIO.StringIO):
     def sendall(self, arg):
         self.write(arg)
 
+def parse_url(url):
+    """Parse url, returning (scheme, hostname, port, path)
+
+    path includes any parameters, query and fragment."""
+    parsed_url = urlparse.urlparse(url)
+    if parsed_url.netloc.find(":") == -1:
+        hostname = parsed_url.netloc
+        port = 443 if parsed_url.scheme == "https" else 80
+    else:
+        hostname, port_str = parsed_url.netloc.split(":")
+        port = int(port_str)
+    path = urlparse.urlunparse((None, # Scheme
+                                None, # netloc
+                                parsed_url.path,
+                                parsed_url.params,
+                                parsed_url.query,
+                                parsed_url.fragment))
+    return (parsed_url.scheme, hostname, port, path)
+
+def build_request(hostname, method, path, post_data=None):
+    """Return HTTP request for path on hostname as a string"""
+    http_conn = httplib.HTTPConnection(hostname)
+    http_conn.sock = StringBuffer()
+    http_conn.request(method,
+                      path,
+                      post_data
+                      )
+    return http_conn.sock.getvalue()
+
+def parse_response(data):
+    """Parse HTTP response in data, returning httplib.HTTPResponse"""
+    response = httplib.HTTPResponse(StringBuffer(data))
+    response.begin()  # Process the response
+    return response
+
+# Enum for HTTP_response_parser state
+PARSER_STATE = type('ParserState', (), {
+    "HEADERS":0,
+    "BODY":1,  # Reading body of known length
+    "CHUNK_SIZE":2,
+    "CHUNK_DATA":3,
+    "CHUNK_END":4,  # Reading CRLF after chunk data
+    "TRAILER":5,
+    "UNTIL_CLOSE":6,  # Reading body ending when connection closes
+    "COMPLETE":7,
+    })
+
+class HTTP_response_parser:
+    """Parse an HTTP response as its data arrives
+
+    Once the status line and headers have been fed in, status, reason,
+    version, msg and will_close are set as for httplib.HTTPResponse.
+    complete is set once the whole body is in, as given by the
+    Content-Length, the terminal chunk of a chunked body, or, for a
+    response with neither, the connection closing.
+
+    Has status, getheader() and read() like httplib.HTTPResponse, so
+    can be used in its place."""
+
+    def __init__(self):
+        self.state = PARSER_STATE.HEADERS
+        self.status = None
+        self.reason = None
+        self.version = None
+        self.msg = None
+        self.will_close = True
+        self.complete = False
+        # Exception raised parsing response, if any
+        self.error = None
+        self._body = bytearray()
+        # Bytes left in body or current chunk
+        self._remaining = 0
+        # Unparsed data waiting for the rest of a line
+        self._buffer = None
+
+    def feed(self, data, start=0, end=None):
+        """Parse data[start:end], returning the number of bytes used
+
+        data may be a string or bytearray, it is not copied except for
+        the body, so a read buffer can be passed in directly. Only data
+        after the end of the response is not used, so it can be fed to
+        the parser for the next response.
+
+        Raises httplib.HTTPException if the response is malformed."""
+        if end is None:
+            end = len(data)
+        buffered = 0
+        if self._buffer is not None:
+            # Rare case of a line split between reads
+            buffered = len(self._buffer)
+            self._buffer += data[start:end]
+            data, start, end = self._buffer, 0, len(self._buffer)
+            self._buffer = None
+        try:
+            offset = self._parse(data, start, end)
+        except httplib.HTTPException as e:
+            self.error = e
+            raise
+        return offset - start - buffered
+
+    def connection_closed(self):
+        """Note connection has closed, completing a body without a length"""
+        if self.state == PARSER_STATE.UNTIL_CLOSE:
+            self._set_complete()
+
+    def getheader(self, name, default=None):
+        if self.msg is None:
+            raise httplib.ResponseNotReady()
+        return self.msg.getheader(name, default)
+
+    def read(self):
+        """Return the body
+
+        Raises the error that stopped parsing if there was one,
+        otherwise httplib.IncompleteRead if the response is not
+        complete."""
+        if self.error is not None:
+            raise self.error
+        if not self.complete:
+            raise httplib.IncompleteRead(str(self._body))
+        return str(self._body)
+
+    def _parse(self, data, offset, end):
+        """Parse data[offset:end], returning offset of the end of data used"""
+        view = memoryview(data)
+        while not self.complete:
+            if self.state == PARSER_STATE.HEADERS:
+                header_end = data.find("\r\n\r\n", offset, end)
+                if header_end == -1:
+                    break
+                self._parse_headers(str(data[offset:header_end + 4]))
+                offset = header_end + 4
+            elif self.state in (PARSER_STATE.BODY, PARSER_STATE.CHUNK_DATA):
+                amount = min(self._remaining, end - offset)
+                if amount == 0:
+                    return offset
+                self._body += view[offset:offset + amount]
+                self._remaining -= amount
+                offset += amount
+                if self._remaining > 0:
+                    return offset
+                if self.state == PARSER_STATE.BODY:
+                    self._set_complete()
+                else:
+                    self.state = PARSER_STATE.CHUNK_END
+            elif self.state == PARSER_STATE.CHUNK_SIZE:
+                line_end = data.find("\r\n", offset, end)
+                if line_end == -1:
+                    break
+                size = str(data[offset:line_end]).split(";")[0].strip()
+                offset = line_end + 2
+                try:
+                    self._remaining = int(size, 16)
+                except ValueError:
+                    raise httplib.HTTPException("Bad chunk size: %s" % size)
+                if self._remaining == 0:
+                    self.state = PARSER_STATE.TRAILER
+                else:
+                    self.state = PARSER_STATE.CHUNK_DATA
+            elif self.state == PARSER_STATE.CHUNK_END:
+                if end - offset < 2:
+                    break
+                offset += 2
+                self.state = PARSER_STATE.CHUNK_SIZE
+            elif self.state == PARSER_STATE.TRAILER:
+                line_end = data.find("\r\n", offset, end)
+                if line_end == -1:
+                    break
+                if line_end == offset:
+                    self._set_complete()
+                offset = line_end + 2
+            elif self.state == PARSER_STATE.UNTIL_CLOSE:
+                self._body += view[offset:end]
+                return end
+        if (not self.complete) and (offset < end):
+            # Keep partial line until more data arrives
+            self._buffer = bytearray(view[offset:end])
+            offset = end
+        return offset
+
+    def _parse_headers(self, data):
+        """Parse status line and headers in data"""
+        response = parse_response(data)
+        if response.version == 9:
+            # httplib takes anything without a status line as HTTP/0.9
+            raise httplib.BadStatusLine(data.split("\r\n")[0])
+        self.status = response.status
+        self.reason = response.reason
+        self.version = response.version
+        self.msg = response.msg
+        self.will_close = response.will_close
+        if response.chunked:
+            self.state = PARSER_STATE.CHUNK_SIZE
+        elif response.length is None:
+            self.state = PARSER_STATE.UNTIL_CLOSE
+        elif response.length == 0:
+            self._set_complete()
+        else:
+            self._remaining = response.length
+            self.state = PARSER_STATE.BODY
+
+    def _set_complete(self):
+        self.state = PARSER_STATE.COMPLETE
+        self.complete = True
+
 class HTTP_dispatcher(ssl_dispatcher):
     """asyncore.dispatcher with HTTP/HTTPS support"""
 
-    def __init__(self, url, method="GET", post_data=None, map=None):
+    # Default size of read buffer, the most read from the socket at once
+    read_size = 8192
+
+    # Seconds to wait for a connection before also trying the next
+    # address of a host with several, see connection_race
+    connection_attempt_delay = 0.25
+
+    def __init__(self, url, method="GET", post_data=None, map=None,
+                 resolver=None, pool=None, read_size=None, request=None,
+                 timers=None, connect_timeout=None, first_byte_timeout=None,
+                 request_timeout=None, ssl_sessions=None):
+        """Create dispatcher and start connecting
+
+        request, if given, is the complete HTTP request to send, and
+        url may then be a (scheme, hostname, port) tuple, saving the
+        work of parsing url and building the request.
+
+        resolver is the Resolver instance whose cache has the addresses
+        of the host in url, None for Resolver.default_resolver. The
+        dispatcher does not block on lookups: unless the host is a
+        numeric address, it must have been resolved already, e.g. with
+        Resolver.resolve_many(), or socket.error is raised.
+
+        pool, if given, is a connection_pool. An idle connection from
+        it is used if there is one, and the connection is returned to
+        it once a complete response has been received, if the server
+        allows keep-alive.
+
+        read_size, if given, overrides the class's read_size.
+
+        timers, if given, is the timed_asyncore.Timers instance of the
+        loop running the dispatcher, used for the deadlines:
+        connect_timeout is the most seconds to connect (including any
+        SSL handshake) and send the request, first_byte_timeout the
+        most seconds from then to the start of the response and
+        request_timeout the most seconds for the whole request. A
+        dispatcher missing a deadline is aborted, and timed_out set to
+        "connect", "first_byte" or "request". If connecting fails,
+        connect_error is set to the socket.error, an ETIMEDOUT one if
+        the connect deadline was missed.
+
+        ssl_sessions, if given, is an ssl_session_cache providing the
+        SSL context for https and a session to resume.
+
+        If the host has several addresses, connections to them are
+        raced, see connection_race."""
         self.logger = logging.getLogger("Perspectives.HTTP_dispatcher")
         ssl_dispatcher.__init__(self, map=map)
         self.write_buffer = ""
-        self.read_buffer = StringBuffer()
+        # Offset in write_buffer of data not yet sent
+        self.write_offset = 0
+        if read_size is not None:
+            self.read_size = read_size
+        # Data is read into one buffer that is reused for each read
+        self.read_buffer = bytearray(self.read_size)
+        self._read_view = memoryview(self.read_buffer)
+        self.parser = HTTP_response_parser()
         self.amount_read = 0
+        # Set when we are done with the connection, successfully or not
+        self.finished = False
+        self.pool = pool
+        # Set if connection came from pool
+        self.reused_connection = False
+        self.timers = timers
+        self.ssl_sessions = ssl_sessions
+        # connection_race while connecting to a host with several
+        # addresses
+        self._race = None
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        # Name of deadline missed, if any
+        self.timed_out = None
+        # socket.error if we could not connect
+        self.connect_error = None
+        # Deadline name -> timer
+        self._deadlines = {}
 
         self.url = url
-        self.parsed_url = urlparse.urlparse(url)
-        if self.parsed_url.netloc.find(":") == -1:
-            self.hostname = self.parsed_url.netloc
-            self.port = 443 if self.parsed_url.scheme == "https" else 80
+        if request is None:
+            scheme, self.hostname, self.port, path = parse_url(url)
+            request = build_request(self.hostname, method, path, post_data)
+        elif isinstance(url, tuple):
+            scheme, self.hostname, self.port = url
         else:
-            self.hostname, port_str = self.parsed_url.netloc.split(":")
-            self.port = int(port_str)
-        address = (self.hostname, self.port)
+            scheme, self.hostname, self.port, path = parse_url(url)
+        self.scheme = scheme
+        resolver = resolver if resolver is not None else default_resolver
+        self._addresses = [
+            (family, address) for family, socktype, proto, canonname, address
+            in self._get_addresses(resolver)]
         self.logger.debug('connecting to %s:%d' % (self.hostname,
                                                    self.port))
-        
-        path = urlparse.urlunparse((None, # Scheme
-                                    None, # netloc
-                                    self.parsed_url.path,
-                                    self.parsed_url.params,
-                                    self.parsed_url.query,
-                                    self.parsed_url.fragment))
-        http_conn = httplib.HTTPConnection(self.hostname)
-        http_conn.sock = StringBuffer()
-        http_conn.request(method,
-                          path,
-                          post_data
-                          )
-        request = http_conn.sock.getvalue()
-        self.write_buffer = request
-        self.logger.debug("%s: %s %s" % (self.hostname, method, path))
-
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.connect(address)
+
+        self.request = request
+        self.write_buffer = self.request
+        self.logger.debug("%s: %s" % (self.hostname,
+                                      request[:request.find("\r\n")]))
+
+        self.pool_key = (scheme, self.hostname, self.port)
+        sock = self.pool.get(self.pool_key) if self.pool is not None else None
+        self._start_deadline("request", request_timeout)
+        if sock is not None:
+            self._use_connection(sock)
+        else:
+            self._open_connection()
         self.logger.debug("%s: initialized" % self.hostname)
 
+    def _get_addresses(self, resolver):
+        """Return cached addresses of our host from resolver
+
+        Raises socket.error if the host has not been resolved."""
+        addresses = resolver.get_cached(self.hostname, self.port)
+        if addresses is not None:
+            return addresses
+        try:
+            # Numeric addresses need no DNS lookup
+            return socket.getaddrinfo(self.hostname, self.port,
+                                      resolver.family, socket.SOCK_STREAM,
+                                      0, socket.AI_NUMERICHOST)
+        except socket.gaierror:
+            raise socket.error("%s has not been resolved" % self.hostname)
+
+    def _open_connection(self):
+        """Open a new connection to our host"""
+        self._start_deadline("connect", self.connect_timeout)
+        if len(self._addresses) == 1:
+            family, address = self._addresses[0]
+            self.create_socket(family, socket.SOCK_STREAM)
+            self.connect(address)
+            return
+        self._race = connection_race(self._addresses, self._map,
+                                     self._race_done, timers=self.timers,
+                                     delay=self.connection_attempt_delay)
+        self._race.start()
+
+    def _race_done(self, sock, error):
+        """Handle end of connection_race, sock is None if it failed"""
+        self._race = None
+        if sock is None:
+            self.logger.error("%s: Error connecting: %s" % (self.hostname,
+                                                            error))
+            self.connect_error = error
+            self.finished = True
+            self.close()
+            return
+        self.set_socket(sock)
+        self.connected = True
+        self.connecting = False
+        try:
+            self.handle_connect()
+        except Exception:
+            self.handle_error()
+
+    def _use_connection(self, sock):
+        """Use already connected socket from pool"""
+        self.logger.debug("%s: Using pooled connection" % self.hostname)
+        self.reused_connection = True
+        self._start_deadline("connect", self.connect_timeout)
+        self.set_socket(sock)
+        self.connected = True
+        if self.scheme == "https":
+            self._state = SSL_STATE.ESTABLISHED
+
+    def _retry_connection(self):
+        """Retry request on a new connection if a pooled one failed
+
+        Returns True if retrying."""
+        if (not self.reused_connection) or (self.amount_read > 0):
+            return False
+        self.logger.debug("%s: Pooled connection failed, reconnecting" %
+                          self.hostname)
+        self.reused_connection = False
+        ssl_dispatcher.abort(self)
+        self.write_buffer = self.request
+        self.write_offset = 0
+        self._open_connection()
+        return True
+
+    def _start_deadline(self, name, timeout):
+        """Start deadline with given name, replacing any running
+
+        Does nothing if timeout is None or there are no timers."""
+        if (timeout is None) or (self.timers is None):
+            return
+        self._cancel_deadline(name)
+        self._deadlines[name] = self.timers.add(
+            timeout, lambda: self.handle_timeout(name))
+
+    def _cancel_deadline(self, name):
+        """Cancel deadline with given name, if running"""
+        timer = self._deadlines.pop(name, None)
+        if timer is not None:
+            self.timers.cancel(timer)
+
+    def _cancel_deadlines(self):
+        """Cancel all running deadlines"""
+        for name in self._deadlines.keys():
+            self._cancel_deadline(name)
+
+    def handle_timeout(self, name):
+        """Handle missing the deadline with given name by aborting"""
+        self.logger.error("%s: %s deadline passed" % (self.hostname, name))
+        self._deadlines.pop(name, None)
+        self.timed_out = name
+        if name == "connect":
+            self.connect_error = socket.error(errno.ETIMEDOUT,
+                                              "connect deadline passed")
+        self.abort()
+
+    def _parse(self, amount):
+        """Feed amount bytes in read_buffer to parser
+
+        Finishes once response is complete."""
+        used = self.parser.feed(self.read_buffer, 0, amount)
+        if self.parser.complete:
+            self._response_complete(amount - used)
+
+    def _response_complete(self, extra):
+        """Finish now response is complete
+
+        extra is the amount of data read after the response. If there
+        is none and the connection can be kept alive, it is returned to
+        the pool."""
+        self.logger.debug("%s: Response complete" % self.hostname)
+        self.finished = True
+        if (self.ssl_sessions is not None) and \
+                (self._state == SSL_STATE.ESTABLISHED):
+            self.ssl_sessions.save_session((self.hostname, self.port),
+                                           self.socket)
+        if (self.pool is not None) and (not self.parser.will_close) and \
+                (extra == 0):
+            self._release_connection()
+        else:
+            self.close()
+
+    def _release_connection(self):
+        """Return our connection to the pool"""
+        self.logger.debug("%s: Returning connection to pool" % self.hostname)
+        self._cancel_deadlines()
+        sock = self.socket
+        self.del_channel()
+        self.socket = None
+        self.connected = False
+        self._state = SSL_STATE.DISCONNECTED
+        self.pool.put(self.pool_key, sock)
+
     def handle_connect(self):
         self.logger.debug("%s: Connected" % self.hostname)
-        if self.parsed_url.scheme == "https":
+        if self.scheme == "https":
             self.logger.debug("%s: Starting SSL handshake" % self.hostname)
-            self.start_ssl()
-        
+            if self.ssl_sessions is None:
+                self.start_ssl()
+            else:
+                key = (self.hostname, self.port)
+                self.start_ssl(context=self.ssl_sessions.get_context(key),
+                               session=self.ssl_sessions.get_session(key),
+                               server_hostname=self.hostname)
+
+    def handle_ssl_established(self):
+        self.logger.debug("%s: SSL handshake done" % self.hostname)
+        if self.ssl_sessions is not None:
+            self.ssl_sessions.handshake_done((self.hostname, self.port),
+                                             self.socket)
+
     def writable(self):
-        return (len(self.write_buffer) > 0)
+        return (len(self.write_buffer) > self.write_offset)
 
     def handle_write(self):
-        sent = self.send(self.write_buffer)
+        sent = self.send(buffer(self.write_buffer, self.write_offset))
         self.logger.debug("%s: wrote %d bytes" % (self.hostname, sent))
-        self.write_buffer = self.write_buffer[sent:]
+        self.write_offset += sent
+        if self.write_offset == len(self.write_buffer):
+            self.write_buffer = ""
+            self.write_offset = 0
+            if "connect" in self._deadlines:
+                self._cancel_deadline("connect")
+                if self.amount_read == 0:
+                    self._start_deadline("first_byte",
+                                         self.first_byte_timeout)
 
     def handle_read(self):
-        data = self.recv(8192)
-        self.read_buffer.write(data)
-        self.amount_read += len(data)
-        self.logger.debug("%s: read %d bytes" % (self.hostname, len(data)))
+        while True:
+            amount = self.recv_into(self._read_view)
+            self.amount_read += amount
+            self.logger.debug("%s: read %d bytes" % (self.hostname, amount))
+            if (amount == 0) or self.finished:
+                break
+            if "first_byte" in self._deadlines:
+                self._cancel_deadline("first_byte")
+            self._parse(amount)
+            # Data already decrypted by SSL will not wake up select()
+            if self.finished or (self.pending() == 0):
+                break
 
     def handle_close(self):
+        if self._retry_connection():
+            return
         self.logger.debug("%s: Closing" % self.hostname)
+        if (not self.connected) and (self.socket is not None):
+            error = self.socket.getsockopt(socket.SOL_SOCKET,
+                                           socket.SO_ERROR)
+            self.connect_error = socket.error(
+                error, os.strerror(error) if error else
+                "Connection closed while connecting")
+        self.parser.connection_closed()
+        self.finished = True
         self.close()
 
+    def close(self):
+        self._cancel_deadlines()
+        if self._race is not None:
+            self._race.cancel()
+            self._race = None
+        if self.socket is None:
+            return  # Connection returned to pool
+        ssl_dispatcher.close(self)
+
+    def abort(self):
+        """Stop processing, closing the connection immediately."""
+        self.logger.debug("%s: Aborting" % self.hostname)
+        self.finished = True
+        self._cancel_deadlines()
+        if self._race is not None:
+            self._race.cancel()
+            self._race = None
+        if self.socket is not None:
+            ssl_dispatcher.abort(self)
+
     def get_response(self):
-        """Return the HTTPResponse
+        """Return the HTTP_response_parser holding the response
 
-        Raises EOFError if no response received."""
-        self.read_buffer.seek(0)
+        Raises connect_error if we could not connect, socket.timeout if
+        a later deadline was missed, EOFError if no response received.
+        Its read() raises httplib.IncompleteRead if the response is not
+        complete."""
+        if self.connect_error is not None:
+            raise self.connect_error
+        if self.timed_out is not None:
+            raise socket.timeout("%s deadline passed" % self.timed_out)
         if self.amount_read == 0:
             raise EOFError("Read zero bytes")
+        if self.parser.error is not None:
+            raise self.parser.error
+        if self.parser.status is None:
+            raise httplib.IncompleteRead("")
         self.logger.debug(
             "%s: Processing response of %d bytes" % (self.hostname,
                                                      self.amount_read))
-        response = httplib.HTTPResponse(self.read_buffer)
-        response.begin()  # Process the response
-        return response
+        return self.parser
 
     def handle_error(self):
         type, value = sys.exc_info()[0:2]
-        self.logger.error("%s: Error: %s" % (self.hostname, value))
         sys.exc_clear()
+        if self._retry_connection():
+            return
+        self.logger.error("%s: Error: %s" % (self.hostname, value))
+        if (not self.connected) and isinstance(value, socket.error):
+            self.connect_error = value
+        self.finished = True
         self.close()
@@ -0,0 +1,114 @@
+"""NegativeCache: Cache of failed notary queries"""
+
+import socket
+import threading
+import time
+
+from Exceptions import NotaryResponseBadSignature
+from Exceptions import NotaryUnknownServiceException
+
+class NegativeCache:
+    """Cache of failed notary queries, so they are not repeated at once
+
+    Three kinds of failure are remembered, each for its own time:
+    a notary not knowing about a service, a notary being unreachable
+    and a notary's response having a bad signature. Being unreachable
+    applies to all services, the others only to the service queried.
+
+    Perspectives notaries start scanning a service they are asked
+    about, so unknown_service_ttl should be short."""
+
+    UNKNOWN_SERVICE = "unknown service"
+    UNREACHABLE = "unreachable"
+    BAD_SIGNATURE = "bad signature"
+
+    def __init__(self, unknown_service_ttl=60, unreachable_ttl=30,
+                 bad_signature_ttl=300, max_size=4096):
+        """Create a NegativeCache
+
+        The ttl arguments are how long in seconds to remember each kind
+        of failure. max_size is the most failures to remember, those
+        expiring soonest being forgotten first."""
+        self.ttls = {
+            self.UNKNOWN_SERVICE : unknown_service_ttl,
+            self.UNREACHABLE : unreachable_ttl,
+            self.BAD_SIGNATURE : bad_signature_ttl,
+            }
+        self.max_size = max_size
+        # key -> (expiration time, failure)
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def failure_for_error(error):
+        """Return kind of failure error represents, None if not cached
+
+        A notary is unreachable if connecting to it failed, raising
+        socket.error. A socket.timeout, from a slow response, or an
+        EOFError, from a query cut short by the caller's timeout, may
+        be due to the service queried and is not held against it."""
+        if isinstance(error, NotaryUnknownServiceException):
+            return NegativeCache.UNKNOWN_SERVICE
+        if isinstance(error, NotaryResponseBadSignature):
+            return NegativeCache.BAD_SIGNATURE
+        if isinstance(error, socket.timeout):
+            return None
+        if isinstance(error, socket.error):
+            return NegativeCache.UNREACHABLE
+        return None
+
+    @staticmethod
+    def _keys(notary, service):
+        """Return (notary key, notary and service key)"""
+        notary_key = (notary.hostname, notary.port)
+        return (notary_key,
+                notary_key + (service.hostname, service.port, service.type))
+
+    def get(self, notary, service):
+        """Return remembered failure of notary regarding service or None"""
+        now = time.time()
+        with self._lock:
+            for key in self._keys(notary, service):
+                entry = self._failures.get(key)
+                if entry is None:
+                    continue
+                expiration, failure = entry
+                if expiration < now:
+                    del self._failures[key]
+                    continue
+                return failure
+        return None
+
+    def put(self, notary, service, failure):
+        """Remember failure, one of the class constants, of notary"""
+        notary_key, service_key = self._keys(notary, service)
+        key = notary_key if failure == self.UNREACHABLE else service_key
+        expiration = time.time() + self.ttls[failure]
+        with self._lock:
+            self._failures[key] = (expiration, failure)
+            if len(self._failures) > self.max_size:
+                self._expire()
+
+    def _expire(self):
+        """Remove expired failures, then those expiring soonest over max_size
+
+        Must be called with lock held."""
+        now = time.time()
+        entries = sorted([(expiration, key) for key, (expiration, failure)
+                          in self._failures.items()])
+        excess = len(entries) - self.max_size
+        for index, (expiration, key) in enumerate(entries):
+            if (expiration >= now) and (index >= excess):
+                break
+            del self._failures[key]
+
+    def clear(self):
+        """Forget all failures"""
+        with self._lock:
+            self._failures.clear()
+
+    def __len__(self):
+        return len(self._failures)
+
+    def __str__(self):
+        return "NegativeCache: %d failures" % len(self)
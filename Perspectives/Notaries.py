@@ -1,23 +1,76 @@
 """Notaries: List of Notary instances"""
+import collections
+import functools
 import httplib
 import logging
 import pkgutil
 import random
+import socket
 import StringIO
+import sys
+import threading
+import time
 
 from Notary import Notary
 from Exceptions import NotaryException
 from NotaryResponses import NotaryResponses
-import timed_asyncore
+from Resolver import default_resolver
+from ssl_session_cache import default_ssl_sessions
+from Notary_pipeline_dispatcher import no_pipelining_set
+from dispatcher_scheduler import dispatcher_scheduler
 
 class Notaries(list):
     """Class for representing the set of trusted Notaries"""
 
     NotaryClass = Notary
 
+    # Resolver used to look up notary hostnames
+    resolver = default_resolver
+
+    # ResponseCache of verified responses, None for no caching
+    response_cache = None
+
+    # Coalesce concurrent calls to query() regarding the same service
+    coalesce_queries = True
+
+    # Seconds after its newest timestamp that an expired response in
+    # response_cache may still be returned while it is refreshed, if
+    # no policy is given. None to not return expired responses.
+    stale_limit = None
+
+    # NegativeCache of failed queries, whose notaries are skipped until
+    # the failures expire, None to always query every notary
+    negative_cache = None
+
+    # ssl_session_cache used to resume SSL sessions with notaries,
+    # None for a full handshake on each connection
+    ssl_sessions = default_ssl_sessions
+
+    # connection_pool used to keep connections to notaries open
+    # between queries, None to use a new connection for each query
+    connection_pool = None
+
+    # Deadlines in seconds for each notary query, None for no limit
+    # other than the timeout for all queries. See HTTP_dispatcher.
+    connect_timeout = None
+    first_byte_timeout = None
+    request_timeout = None
+
+    # Seconds to wait for each response to queries pipelined by
+    # query_many() before sending the rest one at a time, None to wait
+    # until the timeout for all queries
+    pipeline_timeout = 5
+
     def __init__(self):
         self.logger = logging.getLogger("Perspectives.Notary")
         list.__init__(self)
+        # Queries in progress by query(), key -> _InFlightQuery
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # Calls to query() that waited for another's query
+        self.coalesced_queries = 0
+        # Notaries found not to support pipelining by query_many()
+        self.no_pipelining = no_pipelining_set()
 
     @staticmethod
     def from_file(path):
@@ -37,7 +90,9 @@ class Notaries(list):
         data = pkgutil.get_data("Perspectives", "conf/http_notary_list.txt")
         return parser.parse_stream(StringIO.StringIO(data))
 
-    def query(self, service, num=0, timeout=10):
+    def query(self, service, num=0, timeout=10, executor=None,
+              policy=None, fingerprint=None, max_concurrency=None,
+              use_cache=True):
         """Query Notaries and return NotaryResponses instance
 
         For any Notary not responding, a None will be in the array.
@@ -45,43 +100,494 @@ class Notaries(list):
         num specifies the number of Notaries to query. If 0, all notaries
         are queried.
 
-        timeout is the timeout in seconds"""
-        if num == 0:
-            to_query = self
+        timeout is the timeout in seconds
+
+        executor, if given, is used to parse and verify the responses
+        in parallel once they have all been received. It may be any
+        object with a map() method, e.g. a multiprocessing.Pool, a
+        multiprocessing.pool.ThreadPool or a concurrent.futures
+        executor. Raw response data and notary public keys are passed
+        to it, so process pools may be used.
+
+        policy and fingerprint, if given, are a Policy instance and the
+        Fingerprint of the service's certificate. Responses are then
+        parsed as they arrive and the query stops as soon as too few
+        notaries remain for the policy's quorum to be reached. Notaries
+        that have not responded by then have a None in the array.
+
+        max_concurrency, if not None, is the most notaries to have
+        connections open to at once; the rest wait for a connection
+        to finish.
+
+        If response_cache is set, notaries with a fresh cached response
+        are not queried, and new responses are cached. use_cache=False
+        bypasses the cache for this query, querying every notary, but
+        still caches the responses.
+
+        Expired cached responses are still returned while within the
+        policy's stale_limit, or stale_limit if no policy is given, and
+        the notaries are queried again in the background to refresh
+        them. Hot responses about to expire are refreshed likewise.
+
+        If negative_cache is set, notaries that recently failed to
+        answer regarding the service are skipped, having a None in the
+        array, and are the last to be chosen if num is given. use_cache
+        also controls this.
+
+        Concurrent calls to query() regarding the same service, with the
+        same num, policy, fingerprint and use_cache, are coalesced if
+        coalesce_queries is True: the first does the query and the rest
+        wait for it and get a copy of its NotaryResponses, holding the
+        same NotaryResponse instances, or its error. They share its
+        timeout, executor and max_concurrency, which only affect how
+        the query is made."""
+        if not self.coalesce_queries:
+            return self._query(service, num, timeout, executor, policy,
+                               fingerprint, max_concurrency, use_cache)
+        key = self._query_key(service, num, policy, fingerprint, use_cache)
+        with self._in_flight_lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = _InFlightQuery()
+                self._in_flight[key] = in_flight
+            else:
+                self.coalesced_queries += 1
+        if not leader:
+            self.logger.debug("Waiting for query regarding %s in progress" %
+                              service)
+            in_flight.done.wait()
+            if in_flight.exc_info is not None:
+                raise in_flight.exc_info[0], in_flight.exc_info[1], \
+                    in_flight.exc_info[2]
+            return NotaryResponses(in_flight.responses)
+        try:
+            in_flight.responses = self._query(service, num, timeout,
+                                              executor, policy, fingerprint,
+                                              max_concurrency, use_cache)
+            return in_flight.responses
+        except Exception:
+            in_flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    @staticmethod
+    def _query_key(service, num, policy, fingerprint, use_cache):
+        """Return key identifying equivalent calls to query()"""
+        policy_key = None if policy is None else \
+            (policy.quorum, policy.quorum_duration, policy.stale_limit)
+        return (service.hostname, service.port, service.type, num,
+                policy_key, None if fingerprint is None else str(fingerprint),
+                bool(use_cache))
+
+    def _query(self, service, num, timeout, executor, policy, fingerprint,
+               max_concurrency, use_cache):
+        """Query Notaries and return NotaryResponses instance
+
+        See query(), which coalesces concurrent calls to this."""
+        to_query = self._select_notaries(num, service, use_cache)
+        if (policy is not None) and (fingerprint is None):
+            raise ValueError("policy requires fingerprint")
+        if (policy is not None) and (executor is not None):
+            raise ValueError("policy and executor may not be used together")
+        cache = self.response_cache
+        responses = NotaryResponses([None] * len(to_query))
+        if (cache is not None) and use_cache:
+            stale_limit = policy.stale_limit if policy is not None \
+                else self.stale_limit
+            to_refresh = []
+            for index, notary in enumerate(to_query):
+                responses[index], refresh = cache.lookup(notary, service,
+                                                         stale_limit)
+                if refresh:
+                    to_refresh.append(notary)
+            if to_refresh:
+                self._refresh_in_background(service, to_refresh, timeout)
+        pending = [index for index, response in enumerate(responses)
+                   if (response is None) and
+                   not (use_cache and self._has_failed(to_query[index],
+                                                       service))]
+        if len(pending) == 0:
+            return responses
+        # Use own map here for thread safety
+        scheduler = dispatcher_scheduler(max_open=max_concurrency)
+        if policy is not None:
+            self._query_with_policy(service, to_query, responses, pending,
+                                    scheduler, timeout, policy, fingerprint)
         else:
-            if num > len(self):
-                raise ValueError("Too many notaries requested (%s > %s)" % (num, len(self)))
-            to_query = random.sample(self, num)
-        responses = NotaryResponses()
-        dispatchers = []
+            timeout = self._prewarm([to_query[index] for index in pending],
+                                    timeout)
+            fetched = self._fetch_responses(
+                service, [to_query[index] for index in pending], scheduler,
+                timeout, executor)
+            for index, response in zip(pending, fetched):
+                responses[index] = response
+        if cache is not None:
+            for index in pending:
+                if responses[index] is not None:
+                    cache.put(to_query[index], service, responses[index])
+        return responses
+
+    def query_many(self, services, num=0, timeout=10, max_concurrency=None,
+                   max_per_notary=None, callback=None, pipeline=0,
+                   use_cache=True):
+        """Query Notaries regarding many services at once
+
+        All queries share a single event loop, so the set of queries
+        takes at most timeout seconds in total.
+
+        Returns a dictionary mapping each service to a NotaryResponses
+        instance as returned by query(). Services must be distinct.
+
+        num specifies the number of Notaries to query for each service,
+        chosen separately for each. If 0, all notaries are queried.
+
+        timeout is the timeout in seconds for all queries.
+
+        max_concurrency, if not None, is the most queries to have in
+        progress at once; the rest wait for one to finish. Queries not
+        started before timeout have a None response.
+
+        max_per_notary, if not None, is the most queries to have in
+        progress at once to any one notary.
+
+        callback, if given, is called as callback(service, responses)
+        as soon as all of a service's queries are done, allowing
+        results to be used before all services are complete.
+
+        pipeline, if non-zero, is the most queries to send to a notary
+        at once on a single connection using HTTP pipelining, see
+        Notary_pipeline_dispatcher. With pipelining, max_concurrency
+        and max_per_notary limit connections rather than queries.
+
+        response_cache, stale_limit, negative_cache and use_cache are as
+        for query()."""
+        results = {}
+        outstanding = {}
+        # Queries for each notary as (service, index into responses)
+        queries = collections.OrderedDict()
+        jobs = []  # (notary, queries, job)
         # Use own map here for thread safety
-        map = {}
-        for notary in to_query:
-            self.logger.debug("Querying %s about %s..." % (notary, service))
-            dispatchers.append((notary, notary.get_dispatcher(service, map)))
+        scheduler = dispatcher_scheduler(max_open=max_concurrency,
+                                         max_open_per_host=max_per_notary)
+        cache = self.response_cache
+
+        def _done(notary, job_queries, job):
+            for i, (service, index) in enumerate(job_queries):
+                if pipeline:
+                    response = self._get_dispatcher_response(
+                        notary, service, job.dispatcher, i)
+                else:
+                    response = self._get_dispatcher_response(
+                        notary, service, job.dispatcher)
+                results[service][index] = response
+                if (cache is not None) and (response is not None):
+                    cache.put(notary, service, response)
+                outstanding[service] -= 1
+                if (outstanding[service] == 0) and (callback is not None):
+                    callback(service, results[service])
+
+        for service in services:
+            to_query = self._select_notaries(num, service, use_cache)
+            results[service] = NotaryResponses([None] * len(to_query))
+            outstanding[service] = len(to_query)
+            to_refresh = []
+            for index, notary in enumerate(to_query):
+                if (cache is not None) and use_cache:
+                    response, refresh = cache.lookup(notary, service,
+                                                     self.stale_limit)
+                    if refresh:
+                        to_refresh.append(notary)
+                    if response is not None:
+                        results[service][index] = response
+                        outstanding[service] -= 1
+                        continue
+                if use_cache and self._has_failed(notary, service):
+                    outstanding[service] -= 1
+                    continue
+                queries.setdefault(notary, []).append((service, index))
+            if to_refresh:
+                self._refresh_in_background(service, to_refresh, timeout)
+        for notary, notary_queries in queries.items():
+            if pipeline:
+                batches = [notary_queries[i:i + pipeline]
+                           for i in range(0, len(notary_queries), pipeline)]
+                for batch in batches:
+                    job = self._add_pipelined_query(
+                        scheduler, notary, [service for service, index
+                                            in batch],
+                        functools.partial(_done, notary, batch))
+                    jobs.append((notary, batch, job))
+            else:
+                for service, index in notary_queries:
+                    job = self._add_query(
+                        scheduler, notary, service,
+                        functools.partial(_done, notary, [(service, index)]))
+                    jobs.append((notary, [(service, index)], job))
+        timeout = self._prewarm(queries.keys(), timeout)
+        if callback is not None:
+            for service in services:
+                if outstanding[service] == 0:
+                    callback(service, results[service])
         self.logger.debug("Calling asyncore.loop()")
-        timed_asyncore.loop_with_timeout(timeout=timeout, map=map)
+        scheduler.run(timeout)
         self.logger.debug("asyncore.loop() done.")
-        for notary, dispatcher in dispatchers:
+        for notary, job_queries, job in jobs:
+            if not job.done:
+                _done(notary, job_queries, job)
+        scheduler.abort()
+        return results
+
+    def _fetch_responses(self, service, notaries, scheduler, timeout,
+                         executor=None):
+        """Query notaries regarding service using scheduler
+
+        Returns list of responses, with None for any failure."""
+        jobs = [self._add_query(scheduler, notary, service)
+                for notary in notaries]
+        self.logger.debug("Calling asyncore.loop()")
+        scheduler.run(timeout)
+        self.logger.debug("asyncore.loop() done.")
+        dispatchers = [(notary, job.dispatcher)
+                       for notary, job in zip(notaries, jobs)]
+        if executor is None:
+            responses = [self._get_dispatcher_response(notary, service,
+                                                       dispatcher)
+                         for notary, dispatcher in dispatchers]
+        else:
+            responses = self._parse_responses(service, dispatchers, executor)
+        scheduler.abort()
+        return responses
+
+    def _refresh_in_background(self, service, notaries, timeout):
+        """Start thread querying notaries to refresh response_cache
+
+        Returns the thread."""
+        cache = self.response_cache
+
+        def _refresh():
+            responses = [None] * len(notaries)
             try:
-                self.logger.debug("Parsing response from %s" % notary)
-                response = dispatcher.get_response()
-                self.logger.debug("Response from %s parsed" % notary)
-                responses.append(response)
-            except EOFError as e:
-                self.logger.error("Failed to get response from %s: %s" % (notary, str(e)))
-                responses.append(None)
-            except httplib.BadStatusLine as e:
-                self.logger.error("Failed to parse response from %s, bad status: %s" % (notary, e))
-                responses.append(None)
-            except NotaryException as e:
-                self.logger.error("Error validating response from %s: %s" % (notary, e))
-                responses.append(None)
+                remaining = self._prewarm(notaries, timeout)
+                responses = self._fetch_responses(service, notaries,
+                                                  dispatcher_scheduler(),
+                                                  remaining)
             except Exception as e:
-                self.logger.exception("Unknown error handling response from %s: %s" % (notary, e))
+                self.logger.exception("Error refreshing %s: %s" % (service,
+                                                                   e))
+            finally:
+                for notary, response in zip(notaries, responses):
+                    if response is not None:
+                        cache.put(notary, service, response)
+                    else:
+                        cache.refresh_failed(notary, service)
+
+        self.logger.debug("Refreshing %d responses regarding %s" % (
+                len(notaries), service))
+        thread = threading.Thread(target=_refresh,
+                                  name="Refresh %s" % service)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _query_with_policy(self, service, to_query, responses, pending,
+                           scheduler, timeout, policy, fingerprint):
+        """Query notaries until policy is decided
+
+        responses is a NotaryResponses with an entry for each of
+        to_query. The notaries at the indexes in pending are queried
+        and their entries filled in, unless the responses already there
+        decide the policy. See query() for details."""
+        state = { "outstanding" : len(pending),
+                  "changed" : True,
+                  "decided" : False }
+
+        def _done(index, notary, job):
+            responses[index] = self._get_dispatcher_response(
+                notary, service, job.dispatcher)
+            state["outstanding"] -= 1
+            state["changed"] = True
+
+        def _policy_decided():
+            if state["changed"]:
+                state["changed"] = False
+                state["decided"] = self._is_policy_decided(
+                    policy, fingerprint, responses, state["outstanding"])
+            return state["decided"]
+
+        if _policy_decided():
+            return
+        timeout = self._prewarm([to_query[index] for index in pending],
+                                timeout)
+        jobs = [self._add_query(scheduler, to_query[index], service,
+                                functools.partial(_done, index,
+                                                  to_query[index]))
+                for index in pending]
+        self.logger.debug("Calling asyncore.loop()")
+        scheduler.run(timeout, until=_policy_decided)
+        self.logger.debug("asyncore.loop() done.")
+        if not state["decided"]:
+            # Timed out, use what responses we have
+            for index, job in zip(pending, jobs):
+                if not job.done:
+                    _done(index, to_query[index], job)
+        scheduler.abort()
+
+    def _add_query(self, scheduler, notary, service, callback=None):
+        """Add query of notary regarding service to dispatcher_scheduler
+
+        Returns dispatcher_job."""
+        self.logger.debug("Querying %s about %s..." % (notary, service))
+        def _get_dispatcher(map):
+            return notary.get_dispatcher(
+                service, map, **self._dispatcher_kwargs(scheduler))
+        return scheduler.add(_get_dispatcher,
+                             host=(notary.hostname, notary.port),
+                             callback=callback)
+
+    def _add_pipelined_query(self, scheduler, notary, services,
+                             callback=None):
+        """Add pipelined query of notary regarding services to scheduler
+
+        Returns dispatcher_job."""
+        self.logger.debug("Querying %s about %d services..." % (
+                notary, len(services)))
+        def _get_dispatcher(map):
+            return notary.get_pipeline_dispatcher(
+                services, map, no_pipelining=self.no_pipelining,
+                pipeline_timeout=self.pipeline_timeout,
+                **self._dispatcher_kwargs(scheduler))
+        return scheduler.add(_get_dispatcher,
+                             host=(notary.hostname, notary.port),
+                             callback=callback)
+
+    def _dispatcher_kwargs(self, scheduler):
+        """Return keyword arguments for dispatchers run by scheduler"""
+        return dict(resolver=self.resolver,
+                    pool=self.connection_pool,
+                    ssl_sessions=self.ssl_sessions,
+                    timers=scheduler.timers,
+                    connect_timeout=self.connect_timeout,
+                    first_byte_timeout=self.first_byte_timeout,
+                    request_timeout=self.request_timeout)
+
+    def _get_dispatcher_response(self, notary, service, dispatcher, *args):
+        """Return NotaryResponse from dispatcher or None on error
+
+        dispatcher may be None if the query was never started. Any
+        args are passed to the dispatcher's get_response()."""
+        if dispatcher is None:
+            self.logger.error("No response from %s: not queried" % notary)
+            return None
+        return self._get_response(
+            notary, functools.partial(dispatcher.get_response, *args),
+            service)
+
+    def _is_policy_decided(self, policy, fingerprint, responses, outstanding):
+        """Can policy check be decided with outstanding responses missing?
+
+        Returns True if none are outstanding, or if the notaries
+        agreeing with fingerprint plus those outstanding are too few
+        to make quorum, as each response adds at most one agreeing
+        notary. Responses satisfying policy do not decide it, as a
+        further response can shorten the quorum duration, e.g. one
+        whose key was last seen before the others' keys were first."""
+        if outstanding == 0:
+            return True
+        agreement_count = responses.key_agreement_count(fingerprint)
+        if agreement_count + outstanding < policy.quorum:
+            self.logger.debug("Policy cannot be satisfied: %d agree, "
+                              "%d outstanding" % (agreement_count,
+                                                  outstanding))
+            return True
+        return False
+
+    def _parse_responses(self, service, dispatchers, executor):
+        """Parse and verify responses from dispatchers using executor
+
+        Returns NotaryResponses instance."""
+        data = [self._get_response(notary, dispatcher.get_response_data,
+                                   service)
+                if dispatcher is not None else None
+                for notary, dispatcher in dispatchers]
+        jobs = [(notary.protocol_class,
+                 notary.hostname,
+                 notary.port,
+                 notary.get_public_key_pem(),
+                 service,
+                 d)
+                for (notary, dispatcher), d in zip(dispatchers, data)
+                if d is not None]
+        self.logger.debug("Parsing %d responses with %s" % (len(jobs),
+                                                            executor))
+        results = iter(executor.map(_parse_and_verify, jobs))
+        responses = NotaryResponses()
+        for (notary, dispatcher), d in zip(dispatchers, data):
+            if d is None:
                 responses.append(None)
+                continue
+            response = self._get_response(
+                notary, functools.partial(_unpack_result, next(results)),
+                service)
+            if response is not None:
+                response.notary = notary
+            responses.append(response)
         return responses
 
+    def _get_response(self, notary, get_response, service=None):
+        """Return result of calling get_response for given notary
+
+        Returns None if get_response raises an error, logging it and,
+        if service is given, recording it in negative_cache."""
+        try:
+            self.logger.debug("Parsing response from %s" % notary)
+            response = get_response()
+            self.logger.debug("Response from %s parsed" % notary)
+            return response
+        except EOFError as e:
+            self.logger.error("Failed to get response from %s: %s" % (notary, str(e)))
+        except socket.timeout as e:
+            self.logger.error("Timed out querying %s: %s" % (notary, e))
+        except socket.error as e:
+            self.logger.error("Failed to connect to %s: %s" % (notary, e))
+            self._record_failure(notary, service, e)
+        except httplib.BadStatusLine as e:
+            self.logger.error("Failed to parse response from %s, bad status: %s" % (notary, e))
+        except httplib.IncompleteRead as e:
+            self.logger.error("Incomplete response from %s: %d bytes read" % (notary, len(e.partial)))
+        except NotaryException as e:
+            self.logger.error("Error validating response from %s: %s" % (notary, e))
+            self._record_failure(notary, service, e)
+        except Exception as e:
+            self.logger.exception("Unknown error handling response from %s: %s" % (notary, e))
+        return None
+
+    def async_query(self, service, num=0, timeout=10, loop=None):
+        """Query Notaries from an asyncio event loop.
+
+        Returns an asyncio Future whose result is a NotaryResponses
+        instance, with a None for any Notary not responding. Requires
+        asyncio (or trollius with Python 2).
+
+        num specifies the number of Notaries to query. If 0, all notaries
+        are queried.
+
+        timeout is the timeout in seconds for each Notary.
+
+        loop is the event loop to use, None for the default loop.
+
+        https connections use the SSL context of ssl_sessions."""
+        from asyncio_query import query_notaries
+        to_query = self._select_notaries(num)
+        return query_notaries(to_query, service,
+                              functools.partial(self._get_response,
+                                                service=service),
+                              timeout=timeout, loop=loop,
+                              ssl_sessions=self.ssl_sessions)
+
     def deferred_query(self, service, num=0):
         """Make a deferred twisted query for each protocol returning a list of Deferred.
 
@@ -90,13 +596,7 @@ class Notaries(list):
 
         Returns a list of Deferred instead of a DeferredList to allow for timeouts.
 """
-        if num == 0:
-            to_query = self
-        else:
-            if num > len(self):
-                raise ValueError(
-                    "Too many notaries requested (%s > %s)" % (num, len(self)))
-            to_query = random.sample(self, num)
+        to_query = self._select_notaries(num)
         deferreds = [n.defered_query(service) for n in to_query]
         return deferreds
 
@@ -108,6 +608,38 @@ class Notaries(list):
                 responses.append(response)
         return responses
 
+    def _select_notaries(self, num=0, service=None, use_cache=True):
+        """Return list of num randomly selected notaries.
+
+        If num is 0, return all notaries. If service is given, notaries
+        that have recently failed regarding it are chosen last."""
+        if num == 0:
+            return self
+        if num > len(self):
+            raise ValueError(
+                "Too many notaries requested (%s > %s)" % (num, len(self)))
+        if (service is None) or (self.negative_cache is None) or \
+                not use_cache:
+            return random.sample(self, num)
+        notaries = random.sample(self, len(self))
+        # Stable sort keeps the order random within each group
+        notaries.sort(key=lambda notary: self._has_failed(notary, service))
+        return notaries[:num]
+
+    def prewarm_resolver(self, timeout=None):
+        """Look up and cache the addresses of all notaries
+
+        timeout, if not None, is the most seconds to wait."""
+        self.resolver.prewarm(self, timeout)
+
+    def _prewarm(self, notaries, timeout):
+        """Look up addresses of notaries for a query of timeout seconds
+
+        Returns the seconds of timeout remaining."""
+        start = time.time()
+        self.resolver.prewarm(notaries, timeout)
+        return max(0, timeout - (time.time() - start))
+
     def find_notary(self, hostname, port=None):
         """Find notary inlist.
 
@@ -123,5 +655,58 @@ class Notaries(list):
         # Failure
         return None
 
+    def _record_failure(self, notary, service, error):
+        """Record error from notary regarding service in negative_cache"""
+        cache = self.negative_cache
+        if (cache is None) or (service is None):
+            return
+        failure = cache.failure_for_error(error)
+        if failure is not None:
+            self.logger.debug("Remembering %s as %s" % (notary, failure))
+            cache.put(notary, service, failure)
+
+    def _has_failed(self, notary, service):
+        """Has notary recently failed regarding service?"""
+        cache = self.negative_cache
+        return (cache is not None) and \
+            (cache.get(notary, service) is not None)
+
     def __str__(self):
         return "[" + ",".join([str(n) for n in self]) + "]"
+
+class _InFlightQuery:
+    """A call to Notaries.query() that others are waiting on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.responses = None
+        # sys.exc_info() of any error raised by the query
+        self.exc_info = None
+
+def _parse_and_verify(job):
+    """Parse and verify raw notary response data
+
+    Used by Notaries.query() with an executor, so job contains only
+    picklable data: (protocol class, notary hostname, notary port,
+    notary public key as PEM, service, response data)
+
+    Returns (NotaryResponse, None) on success, with the notary attribute
+    of the response set to None, or (None, exception) on failure."""
+    from NotaryParser import NotaryParser  # Avoid import loop
+    protocol_class, hostname, port, key_pem, service, data = job
+    try:
+        public_key = NotaryParser._public_key_from_lines([key_pem])
+        notary = Notary(hostname, port, public_key,
+                        protocol_class=protocol_class)
+        response = notary.get_protocol(service).parse_response(data)
+        response.notary = None
+        return (response, None)
+    except Exception as e:
+        return (None, e)
+
+def _unpack_result(result):
+    """Return response from _parse_and_verify() result or raise its error"""
+    response, error = result
+    if error is not None:
+        raise error
+    return response
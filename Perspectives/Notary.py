@@ -3,9 +3,11 @@
 import logging
 import urllib
 
+import M2Crypto
+
 from Exceptions import NotaryException
-from Exceptions import NotaryUnknownServiceException
 from Notary_dispatcher import Notary_dispatcher
+from Notary_pipeline_dispatcher import Notary_pipeline_dispatcher
 from Protocol import Protocol
 
 class Notary:
@@ -31,6 +33,7 @@ class Notary:
         self.logger = logging.getLogger("Perspectives.Notary")
         self.protocol_class = protocol_class
         self.dispatcher_class = dispatcher_class
+        self._request_template = None
 
     def __str__(self):
         return "%s notary at %s port %s" % (self.protocol_class.get_name(),
@@ -45,10 +48,7 @@ class Notary:
             stream = urllib.urlopen(url)
         except IOError as e:
             raise NotaryException("Error connecting to Notary %s: %s" % (self, str(e)))
-        if stream.getcode() == 404:
-            raise NotaryUnknownServiceException()
-        elif stream.getcode() != 200:
-            raise NotaryException("Got bad http response code (%s) from %s for %s" % (stream.getcode(), self, service))
+        protocol.check_status(stream.getcode())
         response = "".join(stream.readlines())
         stream.close()
         return protocol.parse_response(response)
@@ -73,9 +73,54 @@ class Notary:
         d.addErrback(_augment_failure)
         return d
 
-    def get_dispatcher(self, service, dispatcher_map=None):
-        """Return Notary_dispatcher to query Notary for given service"""
-        return self.dispatcher_class(self, service, dispatcher_map)
+    def async_query(self, service, timeout=10, loop=None, ssl_sessions=None):
+        """Query Notary from an asyncio event loop.
+
+        Returns an asyncio Future whose result is a NotaryResponse
+        instance. Requires asyncio (or trollius with Python 2).
+
+        timeout is the timeout in seconds, after which the Future's
+        exception is socket.timeout.
+
+        loop is the event loop to use, None for the default loop.
+
+        ssl_sessions is the ssl_session_cache providing the SSL context
+        for https, None for default_ssl_sessions."""
+        from asyncio_query import query_notary
+        return query_notary(self, service, timeout=timeout, loop=loop,
+                            ssl_sessions=ssl_sessions)
+
+    def get_dispatcher(self, service, dispatcher_map=None, **kwargs):
+        """Return Notary_dispatcher to query Notary for given service
+
+        Other keyword arguments are passed to the dispatcher class."""
+        return self.dispatcher_class(self, service, dispatcher_map, **kwargs)
+
+    def get_pipeline_dispatcher(self, services, dispatcher_map=None,
+                                **kwargs):
+        """Return Notary_pipeline_dispatcher to query Notary for services
+
+        Other keyword arguments are passed to the dispatcher class."""
+        return Notary_pipeline_dispatcher(self, services, dispatcher_map,
+                                          **kwargs)
+
+    def get_public_key_pem(self):
+        """Return public key in PEM format"""
+        bio = M2Crypto.BIO.MemoryBuffer()
+        self.public_key.get_rsa().save_pub_key_bio(bio)
+        return bio.read()
+
+    def get_request_template(self):
+        """Return template for GET requests to the Notary
+
+        The template is a format string taking the path, built once and
+        giving the same request as HTTP_dispatcher.build_request()."""
+        if self._request_template is None:
+            self._request_template = \
+                "GET %%s HTTP/1.1\r\nHost: %s\r\n" \
+                "Accept-Encoding: identity\r\n\r\n" % (
+                self.hostname.replace("%", "%%"))
+        return self._request_template
 
     def get_protocol(self, service):
         """Return Protocol instance to query regarding service"""
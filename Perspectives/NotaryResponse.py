@@ -1,13 +1,20 @@
 """NotaryResponse: Response from a Notary"""
 
+from array import array
 import base64
+import bisect
+import heapq
 import struct
+import sys
 import time
 import xml.dom.minidom
 
 from Exceptions import NotaryResponseException
 from Fingerprint import Fingerprint
 
+# array typecode for 32-bit unsigned timestamps
+TIMESTAMP_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
 class NotaryResponse:
     """Response from a Notary"""
 
@@ -26,6 +33,61 @@ class NotaryResponse:
             if self.SIG_TYPE_MAPPINGS.has_key(sig_type) else sig_type
         self.sig = sig
         self.raw_response = raw_response
+        # (key, starts, ends) for each key when index was built, None
+        # if not built yet
+        self._index_source = None
+
+    def _check_index(self):
+        """Build index if not built, or keys have changed since
+
+        Keys count as changed if the list of keys, or the starts and
+        ends arrays of any key, have been replaced, as assigning
+        NotaryResponseKey.timespans does."""
+        source = self._index_source
+        if (source is not None) and (len(source) == len(self.keys)) and \
+                all([(key is k) and (key.starts is s) and (key.ends is e)
+                     for key, (k, s, e) in zip(self.keys, source)]):
+            return
+        self._build_index()
+        self._index_source = [(key, key.starts, key.ends)
+                              for key in self.keys]
+
+    def _build_index(self):
+        """Build index used by key_at_time() and last_key_seen()
+
+        The timespans of all keys are broken into elementary intervals
+        at each distinct start and end time. For each such time we
+        record the index of the key seen at that time and the index
+        of the key seen between it and the next time (-1 if none),
+        allowing key_at_time() to use a binary search. If timespans
+        of different keys overlap, the first key wins, as with a
+        linear scan of keys."""
+        spans = [(start, end, index)
+                 for index, key in enumerate(self.keys)
+                 for start, end in zip(key.starts, key.ends)]
+        spans.sort()
+        self._index_times = array(TIMESTAMP_TYPECODE,
+                                  sorted(set([s[0] for s in spans] +
+                                             [s[1] for s in spans])))
+        self._index_at = array("i")
+        self._index_after = array("i")
+        # Heap of (key index, end) for timespans started so far. Those
+        # that have ended are removed lazily when they reach the top.
+        active = []
+        next_span = 0
+        for t in self._index_times:
+            while next_span < len(spans) and spans[next_span][0] <= t:
+                start, end, index = spans[next_span]
+                heapq.heappush(active, (index, end))
+                next_span += 1
+            while active and active[0][1] < t:
+                heapq.heappop(active)
+            self._index_at.append(active[0][0] if active else -1)
+            while active and active[0][1] <= t:
+                heapq.heappop(active)
+            self._index_after.append(active[0][0] if active else -1)
+        self._last_key_seen = max(self.keys, key=lambda k: k.last_timestamp()) \
+            if self.keys else None
 
     def bytes(self):
         """Return as bytes for signature verification
@@ -39,18 +101,32 @@ class NotaryResponse:
         return data
 
     def last_key_seen(self):
-        """Return most recently seen key"""
-        return max(self.keys, key=lambda k: k.last_timestamp())
+        """Return most recently seen key
+
+        Returns None if response contains no keys."""
+        self._check_index()
+        return self._last_key_seen
+
+    def last_timestamp(self):
+        """Return the newest timestamp in response
+
+        Returns None if response contains no keys."""
+        key = self.last_key_seen()
+        return key.last_timestamp() if key is not None else None
 
     def key_at_time(self, time):
         """Get key seen at time (expressed in seconds)
 
         Returns None if no key known at given time."""
-        for key in self.keys:
-            for span in key.timespans:
-                if (span.start <= time) and (span.end >= time):
-                    return key
-        return None
+        self._check_index()
+        i = bisect.bisect_left(self._index_times, time)
+        if (i < len(self._index_times)) and (self._index_times[i] == time):
+            index = self._index_at[i]
+        elif i == 0:
+            return None
+        else:
+            index = self._index_after[i - 1]
+        return self.keys[index] if index != -1 else None
 
     def key_change_times(self):
         """Return list of all times the key changed"""
@@ -66,7 +142,7 @@ class NotaryResponse:
             s += str(key)
         return s
 
-class ServiceKey:
+class ServiceKey(object):
     """Representation of a service's key"""
     def __init__(self, type, fingerprint):
         """Create a instance of a service key with given type and fingerprint.
@@ -92,12 +168,39 @@ class ServiceKey:
         return s
      
 class NotaryResponseKey(ServiceKey):
-    """Representation of a Key in a Notary Response"""
+    """Representation of a Key in a Notary Response
+
+    Timespans are stored as two arrays of 32-bit start and end times
+    (starts and ends), NotaryResponseTimeSpan instances are only
+    created when the timespans attribute is accessed. Assigning
+    timespans rebuilds the arrays."""
 
     def __init__(self, type, fingerprint, timespans):
         ServiceKey.__init__(self, type, fingerprint)
         self.timespans = timespans
 
+    @classmethod
+    def from_arrays(cls, type, fingerprint, starts, ends):
+        """Create a NotaryResponseKey from arrays of start and end times"""
+        key = cls(type, fingerprint, [])
+        key.starts = array(TIMESTAMP_TYPECODE, starts)
+        key.ends = array(TIMESTAMP_TYPECODE, ends)
+        if len(key.starts) != len(key.ends):
+            raise NotaryResponseException(
+                "Mismatched number of start and end times")
+        return key
+
+    @property
+    def timespans(self):
+        """List of NotaryResponseTimeSpan instances for key"""
+        return [NotaryResponseTimeSpan(start, end)
+                for start, end in zip(self.starts, self.ends)]
+
+    @timespans.setter
+    def timespans(self, timespans):
+        self.starts = array(TIMESTAMP_TYPECODE, [t.start for t in timespans])
+        self.ends = array(TIMESTAMP_TYPECODE, [t.end for t in timespans])
+
     def bytes(self):
         """Return as bytes for signature verification
 
@@ -108,21 +211,28 @@ class NotaryResponseKey(ServiceKey):
             Data for each timespan
         """
         data = bytearray(struct.pack("BB",
-                                     (len(self.timespans) >> 8) & 255,
-                                     len(self.timespans) & 255))
+                                     (len(self.starts) >> 8) & 255,
+                                     len(self.starts) & 255))
         # I don't know what these three values are
         data.extend(struct.pack("BBB", 0, 16, 3))
         data.extend(self.fingerprint.data)
-        data.extend(b"".join([t.bytes() for t in self.timespans]))
+        # Timespans are start and end times as interleaved big-endian
+        # 4 byte values.
+        times = array(TIMESTAMP_TYPECODE, self.starts) * 2
+        times[0::2] = self.starts
+        times[1::2] = self.ends
+        if sys.byteorder == "little":
+            times.byteswap()
+        data.extend(times.tostring())
         return data
 
     def change_times(self):
         """Return an list of all timespan end times"""
-        return [t.end for t in self.timespans] + [t.start for t in self.timespans]
+        return self.ends.tolist() + self.starts.tolist()
 
     def last_timestamp(self):
         """Return the last time we saw this key"""
-        return max([ts.end for ts in self.timespans])
+        return max(self.ends)
 
     def __str__(self):
         s = ServiceKey.__str__(self)
@@ -142,17 +252,7 @@ class NotaryResponseTimeSpan:
         """Return as bytes for signature verification
 
         Data is start as 4 byte value concatenated with end as 4 byte value"""
-        start_bytes = struct.pack("BBBB",
-                                  (self.start >> 24) & 255,
-                                  (self.start >> 16) & 255,
-                                  (self.start >> 8) & 255,
-                                  self.start & 255)                    
-        end_bytes = struct.pack("BBBB",
-                                (self.end >> 24) & 255,
-                                (self.end >> 16) & 255,
-                                (self.end >> 8) & 255,
-                                self.end & 255)                    
-        return b"".join([start_bytes, end_bytes])
+        return struct.pack(">II", self.start & 0xffffffff, self.end & 0xffffffff)
 
     def __str__(self):
         return "%s - %s" % (time.ctime(self.start), time.ctime(self.end))
@@ -1,5 +1,6 @@
 """NotaryResponses: List of NotaryResponse instances"""
 
+import heapq
 import logging
 import time
 
@@ -37,23 +38,17 @@ class NotaryResponses(list):
         oldest_response_time = min(non_stale_response_times)
         self.logger.debug("Oldest response time is %s" % (time.ctime(oldest_response_time)))
 
-        # Get list of all times we had a key change
-        key_change_times = reduce(lambda a,b: a + b,
-                                  [r.key_change_times()
-                                   for r in valid_responses])
-        # We ignore all key_change_times after the oldest_response_time
-        key_change_times = filter(lambda t: t <= oldest_response_time,
-                                  key_change_times)
-
-        # Make list of change times go from newest to oldest
-        key_change_times.sort()
-        key_change_times.reverse()
+        # Get list of all times we had a key change. We ignore all
+        # key_change_times after the oldest_response_time.
+        key_change_times = set([t for r in valid_responses
+                                for t in r.key_change_times()
+                                if t <= oldest_response_time])
 
         first_valid_time = None
-        for change_time in key_change_times:
+        for change_time, agreement_count in \
+                self._key_agreement_sweep(cert_fingerprint,
+                                          key_change_times):
             self.logger.debug("Checking time %s" % (time.ctime(change_time)))
-            agreement_count = self.key_agreement_count(cert_fingerprint,
-                                                       change_time)
             if agreement_count >= quorum:
                 first_valid_time = change_time
                 self.logger.debug("Quorum made with %s notaries" % (agreement_count))
@@ -64,6 +59,69 @@ class NotaryResponses(list):
             return 0  # No quorum_duration
         return now - first_valid_time
 
+    def _key_agreement_sweep(self, cert_fingerprint, check_times):
+        """Generate (time, agreement count) for check_times, newest first.
+
+        Equivalent to calling key_agreement_count() for each time, but
+        all timespans are sorted once and we walk backwards in time
+        keeping a running count, so the total cost is O(N log N) in
+        the number of timespans instead of O(times * timespans).
+
+        A response agrees at a given time if the first of its keys
+        seen at that time (see NotaryResponse.key_at_time()) has the
+        given fingerprint. To preserve that ordering when keys have
+        overlapping timespans, each response keeps a heap of the key
+        indexes it has active."""
+        valid_responses = [r for r in self if r is not None]
+        # Timespans ordered by end time and start time, newest first.
+        # Entries are (time, response index, key index).
+        by_end = []
+        by_start = []
+        for r_index, response in enumerate(valid_responses):
+            for k_index, key in enumerate(response.keys):
+                for start, end in zip(key.starts, key.ends):
+                    by_end.append((end, r_index, k_index))
+                    by_start.append((start, r_index, k_index))
+        by_end.sort(reverse=True)
+        by_start.sort(reverse=True)
+        agrees = [[key.fingerprint == cert_fingerprint for key in r.keys]
+                  for r in valid_responses]
+        # Per response: count of active timespans for each key index
+        # and a heap of key indexes (which may include stale indexes
+        # whose count has dropped to zero, removed lazily).
+        active = [{} for r in valid_responses]
+        heaps = [[] for r in valid_responses]
+        agreeing = [False] * len(valid_responses)
+        count = 0
+        end_index = 0
+        start_index = 0
+        for check_time in sorted(check_times, reverse=True):
+            touched = set()
+            # Timespans ending at or after check_time become active...
+            while end_index < len(by_end) and \
+                    by_end[end_index][0] >= check_time:
+                t, r_index, k_index = by_end[end_index]
+                active[r_index][k_index] = active[r_index].get(k_index, 0) + 1
+                heapq.heappush(heaps[r_index], k_index)
+                touched.add(r_index)
+                end_index += 1
+            # ...and those starting after check_time are no longer active.
+            while start_index < len(by_start) and \
+                    by_start[start_index][0] > check_time:
+                t, r_index, k_index = by_start[start_index]
+                active[r_index][k_index] -= 1
+                touched.add(r_index)
+                start_index += 1
+            for r_index in touched:
+                heap = heaps[r_index]
+                while heap and active[r_index][heap[0]] == 0:
+                    heapq.heappop(heap)
+                now_agrees = bool(heap) and agrees[r_index][heap[0]]
+                if now_agrees != agreeing[r_index]:
+                    agreeing[r_index] = now_agrees
+                    count += 1 if now_agrees else -1
+            yield check_time, count
+
     def key_agreement_count(self, cert_fingerprint, check_time=None):
         """How many notaries agree given certificate was valid at given time?
 
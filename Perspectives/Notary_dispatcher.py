@@ -4,13 +4,26 @@ from HTTP_dispatcher import HTTP_dispatcher
 
 class Notary_dispatcher(HTTP_dispatcher):
 
-    def __init__(self, notary, service, map=None):
+    def __init__(self, notary, service, map=None, **kwargs):
+        """Create dispatcher to query notary regarding service
+
+        Other keyword arguments are passed to HTTP_dispatcher."""
         self.protocol = notary.get_protocol(service)
-        HTTP_dispatcher.__init__(self, self.protocol.get_url(), map=map)
+        HTTP_dispatcher.__init__(self, self.protocol.get_address(), map=map,
+                                 request=self.protocol.get_request(),
+                                 **kwargs)
 
     def get_response(self):
         """Return NotaryResponse instance"""
-        response_fd = HTTP_dispatcher.get_response(self)
-        data = response_fd.read()
+        data = self.get_response_data()
         response = self.protocol.parse_response(data)
         return response
+
+    def get_response_data(self):
+        """Return raw response data without parsing it
+
+        Raises NotaryUnknownServiceException if the notary knows nothing
+        about the service."""
+        response_fd = HTTP_dispatcher.get_response(self)
+        self.protocol.check_status(response_fd.status)
+        return response_fd.read()
@@ -0,0 +1,214 @@
+"""Asyncore dispatcher for pipelined Notary queries"""
+
+import socket
+import threading
+import time
+
+from HTTP_dispatcher import HTTP_dispatcher
+from HTTP_dispatcher import HTTP_response_parser
+from ssl_dispatcher import ssl_dispatcher
+
+class no_pipelining_set:
+    """Notaries found not to support pipelining
+
+    Each notary, as (hostname, port), is remembered for ttl seconds,
+    in case it was a passing problem or the server is upgraded."""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        # (hostname, port) -> expiration time
+        self._expirations = {}
+        self._lock = threading.Lock()
+
+    def add(self, address):
+        with self._lock:
+            self._expirations[address] = time.time() + self.ttl
+
+    def __contains__(self, address):
+        with self._lock:
+            expiration = self._expirations.get(address)
+            if expiration is None:
+                return False
+            if expiration < time.time():
+                del self._expirations[address]
+                return False
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._expirations.clear()
+
+    def __len__(self):
+        return len(self._expirations)
+
+class Notary_pipeline_dispatcher(HTTP_dispatcher):
+    """Query a Notary regarding several services on one connection
+
+    The requests are written back to back (HTTP/1.1 pipelining) and the
+    responses are matched to the services in order, which requires the
+    notary to send a Content-Length or chunked body with each response.
+
+    If the connection closes before all the responses arrive, or the
+    next response does not start within pipeline_timeout, the remaining
+    requests are sent on a new connection one at a time, and the notary
+    is added to no_pipelining so later dispatchers for it do the same."""
+
+    def __init__(self, notary, services, map=None, no_pipelining=None,
+                 pipeline_timeout=None, **kwargs):
+        """Create dispatcher to query notary regarding all of services
+
+        no_pipelining, if given, is the no_pipelining_set of notaries
+        not to pipeline requests to, shared with other dispatchers.
+
+        pipeline_timeout, if not None, is the most seconds to wait for
+        each response on a connection with several requests pipelined,
+        for servers that neither answer them nor close the connection.
+        It needs timers.
+
+        Other keyword arguments are passed to HTTP_dispatcher."""
+        self.protocols = [notary.get_protocol(service)
+                          for service in services]
+        self.notary_address = (notary.hostname, notary.port)
+        self.no_pipelining = no_pipelining
+        self.pipelining = (no_pipelining is None) or \
+            (self.notary_address not in no_pipelining)
+        self.pipeline_timeout = pipeline_timeout
+        # HTTP_response_parser for each response received so far, in order
+        self.responses = []
+        # Number of requests written to the current connection's buffer
+        self._sent = 0
+        # Number of responses received before the current connection
+        self._connection_start = 0
+        self.requests = [protocol.get_request()
+                         for protocol in self.protocols]
+        HTTP_dispatcher.__init__(self, self.protocols[0].get_address(),
+                                 map=map, request=self.requests[0], **kwargs)
+        self.write_buffer = ""
+        self._send_requests()
+
+    def _send_requests(self):
+        """Queue the requests the current connection should send next
+
+        All of them if pipelining, otherwise the next one once the
+        previous response is in."""
+        if self.pipelining:
+            self.write_buffer += "".join(self.requests[self._sent:])
+            self._sent = len(self.requests)
+        elif (self._sent == len(self.responses)) and \
+                (self._sent < len(self.requests)):
+            self.write_buffer += self.requests[self._sent]
+            self._sent += 1
+
+    def handle_write(self):
+        HTTP_dispatcher.handle_write(self)
+        if len(self.write_buffer) == 0:
+            self._start_pipeline_deadline()
+
+    def _parse(self, amount):
+        """Feed amount bytes in read_buffer to parsers
+
+        Finishes once all responses are in, returning the connection to
+        the pool if it can be kept alive."""
+        offset = 0
+        while offset < amount:
+            if self.parser.will_close and self.parser.complete:
+                return  # Ignore anything after a final response
+            offset += self.parser.feed(self.read_buffer, offset, amount)
+            if not self.parser.complete:
+                return
+            self.responses.append(self.parser)
+            if len(self.responses) == len(self.requests):
+                break
+            self._start_pipeline_deadline()
+            if not self.parser.will_close:
+                self.parser = HTTP_response_parser()
+                self._send_requests()
+        if len(self.responses) == len(self.requests):
+            self.logger.debug("%s: All %d responses complete" % (
+                    self.hostname, len(self.requests)))
+            self._response_complete(amount - offset)
+
+    def _retry_connection(self):
+        """Send unanswered requests on a new connection
+
+        Called when the connection closes or fails. Gives up if the
+        connection was new and no response was received on it.
+        Returns True if retrying."""
+        if not self.parser.complete:
+            self.parser.connection_closed()
+            if self.parser.complete:
+                self.responses.append(self.parser)
+        if len(self.responses) == len(self.requests):
+            return False
+        if (len(self.responses) == self._connection_start) and \
+                not (self.reused_connection and (self.amount_read == 0)):
+            return False
+        if self.pipelining and \
+                (len(self.responses) > self._connection_start):
+            self.logger.debug("%s: Pipelining failed, sending requests "
+                              "one at a time" % self.hostname)
+            self._stop_pipelining()
+        self._reconnect()
+        return True
+
+    def _start_pipeline_deadline(self):
+        """(Re)start deadline for next response, if it was pipelined"""
+        if self.pipelining and \
+                (self._sent - self._connection_start > 1) and \
+                (len(self.responses) < self._sent):
+            self._start_deadline("pipeline", self.pipeline_timeout)
+
+    def handle_timeout(self, name):
+        """Stop pipelining if a pipelined response has not arrived"""
+        if name != "pipeline":
+            HTTP_dispatcher.handle_timeout(self, name)
+            return
+        self._deadlines.pop(name, None)
+        self.logger.debug("%s: No response to pipelined requests, sending "
+                          "them one at a time" % self.hostname)
+        self._stop_pipelining()
+        self._reconnect()
+
+    def _stop_pipelining(self):
+        """Send requests one at a time from now on"""
+        self.pipelining = False
+        if self.no_pipelining is not None:
+            self.no_pipelining.add(self.notary_address)
+
+    def _reconnect(self):
+        """Send unanswered requests on a new connection"""
+        self._cancel_deadline("pipeline")
+        self.reused_connection = False
+        ssl_dispatcher.abort(self)
+        self.parser = HTTP_response_parser()
+        self.amount_read = 0
+        self.write_buffer = ""
+        self.write_offset = 0
+        self._sent = self._connection_start = len(self.responses)
+        self._open_connection()
+        self._send_requests()
+
+    def get_response(self, index=0):
+        """Return NotaryResponse instance for services[index]
+
+        Raises EOFError if no response received for it."""
+        protocol = self.protocols[index]
+        return protocol.parse_response(self.get_response_data(index))
+
+    def get_response_data(self, index=0):
+        """Return raw response data for services[index] without parsing it
+
+        Raises EOFError if no response received for it, connect_error
+        if that is because we could not connect, socket.timeout if a
+        later deadline was missed, and NotaryUnknownServiceException if
+        the notary knows nothing about the service."""
+        if index >= len(self.responses):
+            if self.connect_error is not None:
+                raise self.connect_error
+            if self.timed_out is not None:
+                raise socket.timeout("%s deadline passed" % self.timed_out)
+            raise EOFError("No response received")
+        response = self.responses[index]
+        data = response.read()
+        self.protocols[index].check_status(response.status)
+        return data
@@ -3,8 +3,11 @@
 import base64
 import struct
 import xml.dom.minidom
+import xml.parsers.expat
 
+from Exceptions import NotaryException
 from Exceptions import NotaryResponseException
+from Exceptions import NotaryUnknownServiceException
 from Exceptions import NotaryResponseBadSignature
 from Fingerprint import Fingerprint
 from NotaryResponse import NotaryResponse
@@ -16,6 +19,16 @@ class Protocol:
 
     _str = "Perspectives"
 
+    # URL scheme used to contact notaries
+    scheme = "http"
+
+    # XML parser used by parse_response(), either "expat" or "minidom"
+    xml_parser = "expat"
+
+    # VerificationCache instance used by verify_response(), None to
+    # always verify signatures.
+    verification_cache = None
+
     def __init__(self, notary, service):
         """Create a protocol instance
 
@@ -34,16 +47,81 @@ class Protocol:
 
     def get_url(self):
         """Return the URL to use to query for the given service"""
-        url = "http://%s:%s/?host=%s&port=%s&service_type=%s" % (
+        url = "%s://%s:%s%s" % (
+            self.scheme,
             self.notary.hostname,
             self.notary.port,
+            self.get_path())
+        return url
+
+    def get_path(self):
+        """Return the path, with query, of the URL for the given service"""
+        path = "/?host=%s&port=%s&service_type=%s" % (
             self.service.hostname,
             self.service.port,
             self.service.type)
-        return url
+        return path
+
+    def get_address(self):
+        """Return (scheme, hostname, port) of the notary"""
+        return (self.scheme, self.notary.hostname, self.notary.port)
+
+    def get_request(self):
+        """Return the HTTP request to query for the given service
+
+        Uses the notary's request template, so is the same as
+        HTTP_dispatcher.build_request() without going through httplib."""
+        return self.notary.get_request_template() % self.get_path()
+
+    def check_status(self, status):
+        """Check HTTP status code of response from notary
+
+        Raise NotaryUnknownServiceException if the notary knows nothing
+        about the service, NotaryException on any other error."""
+        if status == 404:
+            raise NotaryUnknownServiceException(
+                "%s knows nothing about %s" % (self.notary, self.service))
+        elif status != 200:
+            raise NotaryException(
+                "Got bad http response code (%s) from %s for %s" % (
+                    status, self.notary, self.service))
+
+    def parse_response(self, xml_data, verify=True):
+        """Parse response data, returning NotaryResponse instance
+
+        If verify is False, the signature is not verified, for data
+        already known to be good."""
+        if self.xml_parser == "minidom":
+            version, sig_type, sig, keys = self._parse_minidom(xml_data)
+        elif self.xml_parser == "expat":
+            version, sig_type, sig, keys = self._parse_expat(xml_data)
+        else:
+            raise ValueError("Unknown XML parser: %s" % self.xml_parser)
+        response = NotaryResponse(self.notary,
+                                  version,
+                                  keys,
+                                  sig_type,
+                                  sig,
+                                  xml_data)
+        if verify:
+            self.verify_response(response)
+        return response
+
+    def _parse_expat(self, xml_data):
+        """Parse response data with expat.
+
+        Returns (version, sig_type, sig, keys) tuple."""
+        handler = _ExpatResponseHandler()
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = handler.start_element
+        parser.EndElementHandler = handler.end_element
+        parser.Parse(xml_data, True)
+        return (handler.version, handler.sig_type, handler.sig, handler.keys)
 
-    def parse_response(self, xml_data):
-        """Parse response data, returning NotaryResponse instance"""
+    def _parse_minidom(self, xml_data):
+        """Parse response data with xml.dom.minidom.
+
+        Returns (version, sig_type, sig, keys) tuple."""
         dom = xml.dom.minidom.parseString(xml_data)
         doc_element = dom.documentElement
         if doc_element.tagName != "notary_reply":
@@ -55,14 +133,7 @@ class Protocol:
         sig = base64.standard_b64decode(doc_element.getAttribute("sig"))
         keys = doc_element.getElementsByTagName("key")
         keys = [self._parse_key(key) for key in keys]
-        response = NotaryResponse(self.notary,
-                                  version,
-                                  keys,
-                                  sig_type,
-                                  sig,
-                                  xml_data)
-        self.verify_response(response)
-        return response
+        return (version, sig_type, sig, keys)
 
     def _parse_key(self, dom):
         """Create NotaryResponseKey from dom instance"""
@@ -89,10 +160,21 @@ class Protocol:
         data = self._get_verify_data(response)
 
         notary_pub_key = self.notary.public_key
-        notary_pub_key.reset_context(response.sig_type)
-        notary_pub_key.verify_init()
-        notary_pub_key.verify_update(data)
-        result = notary_pub_key.verify_final(response.sig)
+        cache = self.verification_cache
+        result = None
+        if cache is not None:
+            cache_key = cache.make_key(notary_pub_key,
+                                       response.sig_type,
+                                       data,
+                                       response.sig)
+            result = cache.get(cache_key)
+        if result is None:
+            notary_pub_key.reset_context(response.sig_type)
+            notary_pub_key.verify_init()
+            notary_pub_key.verify_update(data)
+            result = notary_pub_key.verify_final(response.sig)
+            if (cache is not None) and (result in (0, 1)):
+                cache.put(cache_key, result)
         if result == 0:
             raise NotaryResponseBadSignature("Signature verification failed")
         elif result != 1:
@@ -113,3 +195,47 @@ class Protocol:
         data.append(struct.pack("B", 0))
         data.extend(response.bytes())
         return data
+
+class _ExpatResponseHandler:
+    """expat handlers building NotaryResponseKeys from a notary reply
+
+    Timestamps are collected straight into the start and end arrays
+    of each key without building a DOM. Elements are interpreted as
+    by Protocol._parse_minidom()."""
+
+    def __init__(self):
+        self.version = None
+        self.sig_type = None
+        self.sig = None
+        self.keys = []
+        self._depth = 0
+        # (depth, key) for each key element we are inside of
+        self._open_keys = []
+
+    def start_element(self, name, attrs):
+        self._depth += 1
+        if self._depth == 1:
+            if name != "notary_reply":
+                raise NotaryResponseException(
+                    "Unrecognized document element: %s" % name)
+            self.version = attrs.get("version", u"")
+            self.sig_type = attrs.get("sig_type", u"")
+            # Convert signature from base64 to raw form
+            self.sig = base64.standard_b64decode(attrs.get("sig", u""))
+        elif name == "key":
+            type = ServiceType.from_string(attrs.get("type", u""))
+            fingerprint = Fingerprint.from_string(attrs.get("fp", u""))
+            key = NotaryResponseKey(type, fingerprint, [])
+            self._open_keys.append((self._depth, key))
+            self.keys.append(key)
+        elif (name == "timestamp") and self._open_keys:
+            start = int(attrs.get("start", u""))
+            end = int(attrs.get("end", u""))
+            for depth, key in self._open_keys:
+                key.starts.append(start)
+                key.ends.append(end)
+
+    def end_element(self, name):
+        if self._open_keys and (self._open_keys[-1][0] == self._depth):
+            self._open_keys.pop()
+        self._depth -= 1
@@ -0,0 +1,149 @@
+"""Resolver: DNS lookups with caching and concurrent resolution"""
+
+import logging
+import Queue
+import socket
+import threading
+import time
+
+class Resolver:
+    """Cache of hostname lookups, able to resolve many names concurrently
+
+    Lookups use socket.getaddrinfo(), which does not report the TTL of
+    the DNS records, so results are cached for a fixed ttl seconds.
+    Failed lookups are cached for negative_ttl seconds, so a notary
+    whose name does not resolve does not cost a lookup per query."""
+
+    def __init__(self, ttl=300, max_threads=16, family=socket.AF_UNSPEC,
+                 negative_ttl=30):
+        """Create a Resolver
+
+        ttl is the time in seconds to cache lookups.
+
+        negative_ttl is the time in seconds to cache failed lookups,
+        0 to not cache them.
+
+        max_threads is the most lookups resolve_many() does at once.
+
+        family is the address family to look up, socket.AF_UNSPEC for
+        all families or e.g. socket.AF_INET for IPv4 only."""
+        self.logger = logging.getLogger("Perspectives.Resolver")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_threads = max_threads
+        self.family = family
+        # (hostname, port) -> (expiration time, addresses, error), with
+        # addresses None and error the socket.error if lookup failed
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, hostname, port):
+        """Return addresses for hostname and port
+
+        Return value is a list of (family, socktype, proto, canonname,
+        sockaddr) tuples as from socket.getaddrinfo(). Uses the cache
+        if possible, otherwise does a blocking lookup.
+
+        Raises socket.gaierror on failure, or a recent failure."""
+        entry = self._get_entry(hostname, port)
+        if entry is None:
+            return self._lookup(hostname, port)
+        addresses, error = entry
+        if error is not None:
+            raise error
+        return addresses
+
+    def get_cached(self, hostname, port):
+        """Return cached addresses for hostname and port, or None"""
+        entry = self._get_entry(hostname, port)
+        return entry[0] if entry is not None else None
+
+    def _get_entry(self, hostname, port):
+        """Return cached (addresses, error) for hostname and port, or None"""
+        with self._lock:
+            entry = self._cache.get((hostname, port))
+            if entry is None:
+                return None
+            expiration, addresses, error = entry
+            if expiration < time.time():
+                del self._cache[(hostname, port)]
+                return None
+            return addresses, error
+
+    def resolve_many(self, addresses, timeout=None):
+        """Resolve and cache many (hostname, port) tuples concurrently
+
+        Addresses already cached, or recently failed, are skipped.
+        Failures are logged but otherwise ignored, resolve() will raise
+        the error when the address is needed.
+
+        timeout, if not None, is the most seconds to wait. Lookups still
+        in progress then finish in the background."""
+        to_resolve = Queue.Queue()
+        for address in set(addresses):
+            if self._get_entry(*address) is None:
+                to_resolve.put(address)
+        num_threads = min(self.max_threads, to_resolve.qsize())
+        if num_threads == 0:
+            return
+        self.logger.debug("Resolving %d addresses with %d threads" % (
+                to_resolve.qsize(), num_threads))
+
+        deadline = time.time() + timeout if timeout is not None else None
+
+        def _worker():
+            while (deadline is None) or (time.time() < deadline):
+                try:
+                    hostname, port = to_resolve.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    self._lookup(hostname, port)
+                except socket.error as e:
+                    self.logger.error("Error resolving %s: %s" % (hostname,
+                                                                  e))
+
+        threads = [threading.Thread(target=_worker)
+                   for i in range(num_threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(0, deadline - time.time()))
+                if thread.is_alive():
+                    self.logger.debug("Timed out resolving addresses")
+                    return
+
+    def prewarm(self, notaries, timeout=None):
+        """Resolve and cache the addresses of all of notaries
+
+        timeout is as for resolve_many()."""
+        self.resolve_many([(notary.hostname, notary.port)
+                           for notary in notaries], timeout)
+
+    def clear(self):
+        """Empty the cache"""
+        with self._lock:
+            self._cache.clear()
+
+    def _lookup(self, hostname, port):
+        """Look up and cache addresses for hostname and port"""
+        try:
+            addresses = socket.getaddrinfo(hostname, port, self.family,
+                                           socket.SOCK_STREAM)
+        except socket.error as e:
+            if self.negative_ttl > 0:
+                with self._lock:
+                    self._cache[(hostname, port)] = (
+                        time.time() + self.negative_ttl, None, e)
+            raise
+        with self._lock:
+            self._cache[(hostname, port)] = (time.time() + self.ttl,
+                                             addresses, None)
+        return addresses
+
+# Resolver used by default by HTTP_dispatcher and Notaries
+default_resolver = Resolver()
@@ -0,0 +1,206 @@
+"""ResponseCache: Cache of verified notary responses"""
+
+import collections
+import threading
+import time
+
+class _CacheEntry:
+    """A response held by ResponseCache"""
+
+    __slots__ = ("response", "size", "expiration", "lifetime", "hits",
+                 "refreshing")
+
+    def __init__(self, response, size, expiration, lifetime):
+        self.response = response
+        self.size = size
+        self.expiration = expiration
+        # Seconds from caching to expiration
+        self.lifetime = lifetime
+        self.hits = 0
+        # Has a refresh been requested by lookup()?
+        self.refreshing = False
+
+class ResponseCache:
+    """Bounded LRU cache of verified NotaryResponse instances
+
+    Responses are keyed by the notary's hostname and port and the
+    service's hostname, port and type.
+
+    A notary's view of a service only changes when it next scans the
+    service, so a response stays fresh until ttl seconds after its
+    newest timestamp, which is when the notary last scanned, but at
+    least min_ttl seconds after it was cached.
+
+    lookup() may also return expired responses that are still within
+    a policy's stale limit, and asks for hot responses to be refreshed
+    shortly before they expire, so they need never be waited for.
+
+    The cache is limited to max_bytes, estimated from the size of the
+    raw replies, with least recently used responses evicted first.
+
+    A backing cache, such as a DiskResponseCache, may be given to be
+    consulted on a miss and written through to on put().
+
+    hits and misses count lookups that did and did not find a fresh
+    response, stale_hits lookups returning an expired response,
+    refreshes the refreshes asked for and evictions responses removed
+    to stay within max_bytes."""
+
+    # Estimated size of a cached response beyond its raw reply
+    ENTRY_OVERHEAD = 512
+
+    def __init__(self, ttl=3600, min_ttl=60, max_bytes=16*1024*1024,
+                 backing=None, refresh_ahead=0.1, hot_hits=3):
+        """Create a ResponseCache
+
+        ttl is how long in seconds after its newest timestamp a
+        response is fresh, normally the notaries' scan interval.
+
+        min_ttl is the least time in seconds a response is fresh
+        after being cached.
+
+        max_bytes is the memory budget for cached responses.
+
+        backing, if given, is a second level cache with get() and put()
+        methods taking the same arguments as ours.
+
+        refresh_ahead is the fraction of a response's time in the
+        cache, counting back from when it expires, during which
+        lookup() asks for it to be refreshed if it has been found at
+        least hot_hits times. 0 disables refreshing ahead."""
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_bytes = max_bytes
+        self.backing = backing
+        self.refresh_ahead = refresh_ahead
+        self.hot_hits = hot_hits
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.size = 0
+        # key -> _CacheEntry, oldest used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(notary, service):
+        """Return cache key for notary's response regarding service"""
+        return (notary.hostname, notary.port,
+                service.hostname, service.port, service.type)
+
+    def get(self, notary, service):
+        """Return fresh cached response of notary regarding service or None"""
+        return self._lookup(notary, service, None, False)[0]
+
+    def lookup(self, notary, service, stale_limit=None):
+        """Return (response, refresh) for notary regarding service
+
+        response is the cached response or None. If stale_limit is not
+        None, an expired response is still returned if its newest
+        timestamp is less than stale_limit seconds old, as a Policy
+        with that stale_limit would still use it.
+
+        refresh is True if the caller should query the notary again
+        and put() the new response, because the response is stale or
+        is hot and about to expire. It is True only once for each
+        response; if the refresh fails, call refresh_failed()."""
+        return self._lookup(notary, service, stale_limit, True)
+
+    def _lookup(self, notary, service, stale_limit, refresh_wanted):
+        key = self.make_key(notary, service)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry.expiration >= now:
+                    self.hits += 1
+                    entry.hits += 1
+                    refresh = refresh_wanted and \
+                        (not entry.refreshing) and \
+                        (self.refresh_ahead > 0) and \
+                        (entry.hits >= self.hot_hits) and \
+                        (entry.expiration - now <
+                         entry.lifetime * self.refresh_ahead)
+                    self._found(key, entry, refresh)
+                    return entry.response, refresh
+                last_timestamp = entry.response.last_timestamp()
+                if (stale_limit is not None) and \
+                        (last_timestamp is not None) and \
+                        (last_timestamp > now - stale_limit):
+                    self.stale_hits += 1
+                    refresh = refresh_wanted and not entry.refreshing
+                    self._found(key, entry, refresh)
+                    return entry.response, refresh
+                self.size -= entry.size
+            self.misses += 1
+        if self.backing is None:
+            return None, False
+        response = self.backing.get(notary, service)
+        if response is not None:
+            self._insert(notary, service, response)
+        return response, False
+
+    def _found(self, key, entry, refresh):
+        """Mark entry as most recently used and maybe being refreshed
+
+        Must be called with lock held."""
+        if refresh:
+            entry.refreshing = True
+            self.refreshes += 1
+        self._entries[key] = entry
+
+    def refresh_failed(self, notary, service):
+        """Allow lookup() to ask for response to be refreshed again"""
+        key = self.make_key(notary, service)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+
+    def put(self, notary, service, response):
+        """Cache response, a verified NotaryResponse, of notary"""
+        self._insert(notary, service, response)
+        if self.backing is not None:
+            self.backing.put(notary, service, response)
+
+    def _insert(self, notary, service, response):
+        """Add response to memory, evicting others if needed"""
+        now = time.time()
+        last_timestamp = response.last_timestamp()
+        expiration = max(now + self.min_ttl,
+                         (last_timestamp or 0) + self.ttl)
+        size = len(response.raw_response or "") + self.ENTRY_OVERHEAD
+        entry = _CacheEntry(response, size, expiration, expiration - now)
+        key = self.make_key(notary, service)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry.size
+            self._entries[key] = entry
+            self.size += size
+            while (self.size > self.max_bytes) and self._entries:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self.size -= old_entry.size
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all cached responses and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.stale_hits = 0
+            self.refreshes = 0
+            self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "ResponseCache: %d responses (%d bytes), %d hits, " \
+            "%d stale hits, %d misses, %d refreshes, %d evictions" % (
+            len(self), self.size, self.hits, self.stale_hits, self.misses,
+            self.refreshes, self.evictions)
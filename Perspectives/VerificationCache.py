@@ -0,0 +1,66 @@
+"""VerificationCache: Cache of notary signature verification results"""
+
+import collections
+import hashlib
+import threading
+
+class VerificationCache:
+    """Bounded LRU cache of signature verification results
+
+    Results are keyed by the notary public key, signature type, a digest
+    of the signed data and the signature, so a notary returning the same
+    signed data again can be checked without an RSA verification.
+
+    hits and misses count lookups that did and did not find a result."""
+
+    def __init__(self, max_size=1024):
+        """Create a VerificationCache holding up to max_size results"""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(public_key, sig_type, data, sig):
+        """Return cache key for verifying sig over data with public_key
+
+        public_key is an M2Crypto.EVP.PKey instance."""
+        return (hashlib.sha1(public_key.as_der()).digest(),
+                sig_type,
+                hashlib.sha256(bytes(data)).digest(),
+                bytes(sig))
+
+    def get(self, key):
+        """Return cached verification result for key or None"""
+        with self._lock:
+            result = self._results.pop(key, None)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Re-insert to mark as most recently used
+            self._results[key] = result
+            return result
+
+    def put(self, key, result):
+        """Cache verification result for key"""
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = result
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached results and reset counters"""
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def __str__(self):
+        return "VerificationCache: %d results, %d hits, %d misses" % (
+            len(self), self.hits, self.misses)
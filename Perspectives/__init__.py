@@ -1,4 +1,5 @@
 # Make these classes available via 'from Perspectives import ...'
+from DiskResponseCache import DiskResponseCache
 from Exceptions import PerspectivesException
 from Exceptions import FingerprintException
 from Exceptions import NotaryException
@@ -6,6 +7,7 @@ from Exceptions import NotaryResponseException
 from Exceptions import NotaryUnknownServiceException
 from Exceptions import NotaryResponseBadSignature
 from Fingerprint import Fingerprint
+from NegativeCache import NegativeCache
 from Notary import Notary
 from Notaries import Notaries
 from NotaryParser import NotaryParser
@@ -15,7 +17,10 @@ from NotaryResponse import NotaryResponseTimeSpan
 from NotaryResponse import ServiceKey
 from NotaryResponses import NotaryResponses
 from Protocol import Protocol
+from Resolver import Resolver
+from ResponseCache import ResponseCache
 from Service import Service, ServiceType
+from VerificationCache import VerificationCache
 
 # Avoid warnings about lack of defined handlers
 # http://docs.python.org/howto/logging.html#library-config
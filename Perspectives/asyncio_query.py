@@ -0,0 +1,177 @@
+"""asyncio transport for Notary queries
+
+An alternative to Notary_dispatcher for use in an asyncio event loop.
+Uses asyncio if available, otherwise trollius (asyncio for Python 2)."""
+
+import logging
+import socket
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from HTTP_dispatcher import HTTP_response_parser
+from NotaryResponses import NotaryResponses
+from ssl_session_cache import default_ssl_sessions
+
+# asyncio.async() was renamed ensure_future()
+_ensure_future = getattr(asyncio, "ensure_future", None) or \
+    getattr(asyncio, "async")
+
+logger = logging.getLogger("Perspectives.asyncio_query")
+
+class HTTP_protocol(asyncio.Protocol):
+    """asyncio Protocol making a single HTTP request
+
+    Sends request once connected, and sets future to the
+    HTTP_response_parser as soon as the response is complete, or when
+    the connection is closed."""
+
+    def __init__(self, request, future):
+        self.request = request
+        self.future = future
+        self.transport = None
+        self.parser = HTTP_response_parser()
+        self.amount_read = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(self.request)
+
+    def data_received(self, data):
+        if self.future.done():
+            return
+        self.amount_read += len(data)
+        try:
+            self.parser.feed(data)
+        except Exception as e:
+            self.future.set_exception(e)
+            self.transport.abort()
+            return
+        if self.parser.complete:
+            self.future.set_result(self.parser)
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        if self.future.done():
+            return
+        if exc is not None:
+            self.future.set_exception(exc)
+        elif self.amount_read == 0:
+            self.future.set_exception(EOFError("Read zero bytes"))
+        else:
+            self.parser.connection_closed()
+            self.future.set_result(self.parser)
+
+def query_notary(notary, service, timeout=10, loop=None, ssl_sessions=None):
+    """Query notary regarding service
+
+    Returns an asyncio Future whose result is a NotaryResponse.
+    If no response is received within timeout seconds, the Future's
+    exception is socket.timeout.
+
+    ssl_sessions is the ssl_session_cache whose SSL context is used
+    for https, default_ssl_sessions if None."""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if ssl_sessions is None:
+        ssl_sessions = default_ssl_sessions
+    protocol = notary.get_protocol(service)
+    scheme, hostname, port = protocol.get_address()
+    request = protocol.get_request()
+    result = asyncio.Future(loop=loop)
+    data = asyncio.Future(loop=loop)
+    http_protocol = HTTP_protocol(request, data)
+    if scheme == "https":
+        connect = loop.create_connection(lambda: http_protocol,
+                                         hostname, port,
+                                         ssl=ssl_sessions.get_ssl_context(),
+                                         server_hostname=hostname)
+    else:
+        connect = loop.create_connection(lambda: http_protocol,
+                                         hostname, port)
+    connect = _ensure_future(connect, loop=loop)
+    logger.debug("Querying %s about %s..." % (notary, service))
+
+    def _fail(error):
+        if not result.done():
+            result.set_exception(error)
+        connect.cancel()
+        if http_protocol.transport is not None:
+            http_protocol.transport.abort()
+
+    def _timed_out():
+        http_protocol.parser.connection_closed()
+        if http_protocol.parser.complete and not data.done():
+            # Response without a length, use whatever has been received
+            data.set_result(http_protocol.parser)
+            http_protocol.transport.abort()
+        else:
+            _fail(socket.timeout("No response from %s in %s seconds" % (
+                        notary, timeout)))
+
+    def _connected(future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            _fail(future.exception())
+
+    def _received(future):
+        if result.done():
+            return
+        if future.exception() is not None:
+            _fail(future.exception())
+            return
+        try:
+            response = future.result()
+            protocol.check_status(response.status)
+            result.set_result(protocol.parse_response(response.read()))
+        except Exception as e:
+            result.set_exception(e)
+
+    def _done(future):
+        deadline.cancel()
+        if future.cancelled():
+            _fail(asyncio.CancelledError())
+
+    deadline = loop.call_later(timeout, _timed_out)
+    connect.add_done_callback(_connected)
+    data.add_done_callback(_received)
+    result.add_done_callback(_done)
+    return result
+
+def query_notaries(notaries, service, get_response, timeout=10, loop=None,
+                   ssl_sessions=None):
+    """Query all of notaries regarding service
+
+    get_response is called as get_response(notary, function) for each
+    notary once all queries are done, where function returns the
+    notary's NotaryResponse or raises its error, and should return
+    the NotaryResponse or None.
+
+    Returns an asyncio Future whose result is a NotaryResponses instance
+    of the values returned by get_response, in the same order as
+    notaries.
+
+    ssl_sessions is as for query_notary()."""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    futures = [query_notary(notary, service, timeout=timeout, loop=loop,
+                            ssl_sessions=ssl_sessions)
+               for notary in notaries]
+    result = asyncio.Future(loop=loop)
+
+    def _done(future):
+        if result.done():
+            return
+        responses = NotaryResponses([get_response(notary, f.result)
+                                     for notary, f in zip(notaries, futures)])
+        result.set_result(responses)
+
+    if futures:
+        gathered = asyncio.gather(*futures, return_exceptions=True)
+        gathered.add_done_callback(_done)
+    else:
+        result.set_result(NotaryResponses())
+    return result
@@ -0,0 +1,110 @@
+"""connection_pool: Pool of idle keep-alive connections for dispatchers"""
+
+import collections
+import logging
+import select
+import socket
+import threading
+import time
+
+class connection_pool:
+    """Pool of idle, connected sockets kept open for reuse
+
+    Sockets are kept per key, normally (scheme, hostname, port), after
+    an HTTP_dispatcher has received a complete response on them, and
+    handed to the next HTTP_dispatcher for the same key, saving the
+    TCP (and SSL) handshakes.
+
+    reused and created count connections taken from the pool and
+    connections that had to be opened because the pool was empty."""
+
+    def __init__(self, max_idle_per_host=4, max_idle=256, idle_timeout=30):
+        """Create a connection_pool
+
+        max_idle_per_host is the most idle sockets to keep for any one
+        key.
+
+        max_idle is the most idle sockets to keep in total.
+
+        idle_timeout is how long in seconds to keep an idle socket."""
+        self.logger = logging.getLogger("Perspectives.connection_pool")
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.reused = 0
+        self.created = 0
+        # key -> deque of (time released, socket), oldest first
+        self._idle = {}
+        self._num_idle = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return an idle socket for key, or None if there are none
+
+        Sockets that have been idle too long, or that the peer has
+        closed, are discarded."""
+        with self._lock:
+            sockets = self._idle.get(key)
+            while sockets:
+                released, sock = sockets.pop()
+                self._num_idle -= 1
+                if (time.time() - released <= self.idle_timeout) and \
+                        self._is_alive(sock):
+                    self.reused += 1
+                    self.logger.debug("Reusing connection to %s" % (key,))
+                    return sock
+                self._close(sock)
+            self.created += 1
+            return None
+
+    def put(self, key, sock):
+        """Add sock, which is idle, to pool for key"""
+        with self._lock:
+            sockets = self._idle.setdefault(key, collections.deque())
+            sockets.append((time.time(), sock))
+            self._num_idle += 1
+            if len(sockets) > self.max_idle_per_host:
+                released, old_sock = sockets.popleft()
+                self._num_idle -= 1
+                self._close(old_sock)
+            if self._num_idle > self.max_idle:
+                self._close_oldest()
+
+    def clear(self):
+        """Close all idle sockets"""
+        with self._lock:
+            for sockets in self._idle.values():
+                for released, sock in sockets:
+                    self._close(sock)
+            self._idle.clear()
+            self._num_idle = 0
+
+    def __len__(self):
+        return self._num_idle
+
+    def _close_oldest(self):
+        """Close the idle socket that has been idle longest"""
+        oldest_key = min([key for key in self._idle if self._idle[key]],
+                         key=lambda key: self._idle[key][0][0])
+        released, sock = self._idle[oldest_key].popleft()
+        self._num_idle -= 1
+        self._close(sock)
+
+    @staticmethod
+    def _is_alive(sock):
+        """Is sock still usable?
+
+        An idle socket that is readable has either been closed by the
+        peer or has unexpected data on it, either way we cannot use it."""
+        try:
+            readable, writable, error = select.select([sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return len(readable) == 0
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.close()
+        except socket.error:
+            pass
@@ -0,0 +1,163 @@
+"""connection_race: Race connections to a host's addresses (happy eyeballs)
+
+Implements the connection attempt part of RFC 8305: addresses are
+tried in turn, alternating between address families, with each
+attempt started when the previous one fails or after a short delay,
+whichever comes first. The first connection to succeed wins."""
+
+import asyncore
+import logging
+import socket
+import sys
+
+def interleave_addresses(addresses):
+    """Return addresses reordered to alternate between address families
+
+    addresses is a list of (family, address) tuples. The family of the
+    first address is kept first, and order within a family is kept."""
+    by_family = []
+    for family, address in addresses:
+        for family_addresses in by_family:
+            if family_addresses[0][0] == family:
+                family_addresses.append((family, address))
+                break
+        else:
+            by_family.append([(family, address)])
+    interleaved = []
+    while by_family:
+        for family_addresses in by_family:
+            interleaved.append(family_addresses.pop(0))
+        by_family = [f for f in by_family if f]
+    return interleaved
+
+class connection_attempt(asyncore.dispatcher):
+    """A single connection attempt made by a connection_race"""
+
+    def __init__(self, race, family, address, map):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.race = race
+        self.address = address
+        self.create_socket(family, socket.SOCK_STREAM)
+        try:
+            self.connect(address)
+        except socket.error:
+            self.close()
+            raise
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return not self.connected
+
+    def handle_connect(self):
+        self.race.attempt_connected(self)
+
+    def handle_write(self):
+        pass
+
+    def handle_close(self):
+        self.race.attempt_failed(self, socket.error("Connection closed"))
+
+    def handle_error(self):
+        value = sys.exc_info()[1]
+        sys.exc_clear()
+        self.race.attempt_failed(self, value)
+
+    def detach(self):
+        """Remove from map and return socket"""
+        sock = self.socket
+        self.del_channel()
+        self.socket = None
+        return sock
+
+class connection_race:
+    """Connect to the first of several addresses to answer
+
+    callback is called once, as callback(sock, error): sock is the
+    connected socket, or None if all attempts failed, in which case
+    error is the last error."""
+
+    def __init__(self, addresses, map, callback, timers=None, delay=0.25):
+        """Create a connection_race
+
+        addresses is a list of (family, address) tuples, attempted in
+        the order given by interleave_addresses().
+
+        map is the asyncore map for the attempts.
+
+        timers is the timed_asyncore.Timers instance of the loop, used
+        to start the next attempt after delay seconds. Without it, the
+        next attempt is only started when one fails."""
+        self.logger = logging.getLogger("Perspectives.connection_race")
+        self.map = map
+        self.callback = callback
+        self.timers = timers
+        self.delay = delay
+        self.error = None
+        self.done = False
+        self._pending = interleave_addresses(addresses)
+        self._attempts = []
+        self._timer = None
+
+    def start(self):
+        """Start first attempt"""
+        self._start_next()
+
+    def cancel(self):
+        """Stop all attempts without calling callback"""
+        self.done = True
+        self._cancel_timer()
+        for attempt in self._attempts:
+            attempt.close()
+        self._attempts = []
+
+    def attempt_connected(self, attempt):
+        """Called by attempt when connected, making it the winner"""
+        if self.done:
+            return
+        self.logger.debug("Connected to %s" % (attempt.address,))
+        if attempt in self._attempts:
+            self._attempts.remove(attempt)
+        sock = attempt.detach()
+        self.cancel()
+        self.callback(sock, None)
+
+    def attempt_failed(self, attempt, error):
+        """Called by attempt on failure, starting the next attempt"""
+        self.logger.debug("Failed to connect to %s: %s" % (attempt.address,
+                                                           error))
+        attempt.close()
+        if attempt in self._attempts:
+            self._attempts.remove(attempt)
+        self.error = error
+        if not self.done:
+            self._start_next()
+
+    def _start_next(self):
+        """Start next attempt, calling callback if there are none left"""
+        self._cancel_timer()
+        while self._pending and not self.done:
+            family, address = self._pending.pop(0)
+            self.logger.debug("Connecting to %s" % (address,))
+            try:
+                attempt = connection_attempt(self, family, address, self.map)
+            except socket.error as e:
+                self.logger.debug("Failed to connect to %s: %s" % (address,
+                                                                   e))
+                self.error = e
+                continue
+            if not self.done:
+                self._attempts.append(attempt)
+                if self._pending and (self.timers is not None):
+                    self._timer = self.timers.add(self.delay,
+                                                  self._start_next)
+            return
+        if (not self.done) and (len(self._attempts) == 0):
+            self.done = True
+            self.callback(None, self.error)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self.timers.cancel(self._timer)
+            self._timer = None
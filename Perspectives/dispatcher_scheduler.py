@@ -0,0 +1,157 @@
+"""dispatcher_scheduler: Run dispatchers with a limit on open connections"""
+
+import collections
+import logging
+import time
+
+import timed_asyncore
+
+class dispatcher_job:
+    """A dispatcher to be run by a dispatcher_scheduler
+
+    dispatcher is None until the job is started. If creating the
+    dispatcher raised an exception, it is stored in error."""
+
+    def __init__(self, factory, host=None, callback=None):
+        self.factory = factory
+        self.host = host
+        self.callback = callback
+        self.dispatcher = None
+        self.error = None
+        # Set when dispatcher has finished or failed to start
+        self.done = False
+
+class dispatcher_scheduler:
+    """Run dispatchers with a limit on how many are open at once
+
+    Dispatchers are created when there is room for them, so at most
+    max_open are open at once, with at most max_open_per_host of those
+    for any one host. Waiting dispatchers are started round-robin by
+    host, so one slow host cannot take all the open slots."""
+
+    def __init__(self, max_open=None, max_open_per_host=None, map=None,
+                 timers=None):
+        """Create a dispatcher_scheduler
+
+        max_open is the most dispatchers to have open at once, None for
+        no limit.
+
+        max_open_per_host is the most dispatchers to have open at once
+        for any one host, None for no limit.
+
+        map is the asyncore map for dispatchers, a new one is created
+        if None.
+
+        timers is the timed_asyncore.Timers instance the loop runs, for
+        dispatchers to use for their deadlines, a new one is created if
+        None."""
+        self.logger = logging.getLogger("Perspectives.dispatcher_scheduler")
+        self.max_open = max_open
+        self.max_open_per_host = max_open_per_host
+        self.map = map if map is not None else {}
+        self.timers = timers if timers is not None \
+            else timed_asyncore.Timers()
+        # Waiting jobs, as host -> deque of jobs
+        self._waiting = collections.OrderedDict()
+        self._num_waiting = 0
+        self._running = []
+        self._open_per_host = collections.defaultdict(int)
+
+    def add(self, factory, host=None, callback=None):
+        """Add a dispatcher to be run, returning a dispatcher_job
+
+        factory is called with the asyncore map to create the dispatcher.
+
+        host identifies the host the dispatcher connects to for the
+        per-host limit.
+
+        callback, if given, is called with the dispatcher_job when the
+        dispatcher finishes or fails to start."""
+        job = dispatcher_job(factory, host, callback)
+        self._waiting.setdefault(host, collections.deque()).append(job)
+        self._num_waiting += 1
+        return job
+
+    def run(self, timeout, until=None):
+        """Run dispatchers until all are finished or timeout seconds pass.
+
+        until, if given, is called once finished dispatchers have been
+        handled, before any waiting ones are started, and the loop stops
+        as soon as it returns True.
+
+        No waiting dispatchers are started once timeout seconds have
+        passed. Dispatchers still open are left open, see abort()."""
+        deadline = time.time() + timeout
+        def _step():
+            self._reap()
+            if (until is not None) and until():
+                return True
+            if time.time() < deadline:
+                self._start_waiting()
+            return (len(self._running) == 0) and (self._num_waiting == 0)
+        timed_asyncore.loop_with_timeout(timeout=timeout, map=self.map,
+                                         until=_step, timers=self.timers)
+
+    def abort(self):
+        """Abort open dispatchers and discard waiting ones."""
+        for job in self._running:
+            job.dispatcher.abort()
+        self._running = []
+        self._open_per_host.clear()
+        self._waiting.clear()
+        self._num_waiting = 0
+
+    def _reap(self):
+        """Handle finished dispatchers"""
+        running = []
+        for job in self._running:
+            if job.dispatcher.finished:
+                self._open_per_host[job.host] -= 1
+                self._finish(job)
+            else:
+                running.append(job)
+        self._running = running
+
+    def _start_waiting(self):
+        """Start waiting dispatchers there is room for"""
+        while (self._num_waiting > 0) and \
+                ((self.max_open is None) or
+                 (len(self._running) < self.max_open)):
+            job = self._next_job()
+            if job is None:
+                break  # All hosts with waiting jobs are at their limit
+            self._start(job)
+
+    def _next_job(self):
+        """Remove and return next job to start, or None if none may start"""
+        for host, jobs in self._waiting.items():
+            if (self.max_open_per_host is not None) and \
+                    (self._open_per_host[host] >= self.max_open_per_host):
+                continue
+            job = jobs.popleft()
+            # Move host to end of the line
+            del self._waiting[host]
+            if jobs:
+                self._waiting[host] = jobs
+            self._num_waiting -= 1
+            return job
+        return None
+
+    def _start(self, job):
+        """Create dispatcher for job"""
+        try:
+            job.dispatcher = job.factory(self.map)
+        except Exception as e:
+            self.logger.error("Error starting dispatcher for %s: %s" % (
+                    job.host, e))
+            job.error = e
+            self._finish(job)
+            return
+        self._running.append(job)
+        self._open_per_host[job.host] += 1
+
+    def _finish(self, job):
+        """Mark job done and call its callback"""
+        job.done = True
+        if job.callback is not None:
+            job.callback(job)
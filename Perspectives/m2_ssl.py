@@ -0,0 +1,130 @@
+"""m2_ssl: M2Crypto SSL connections usable in place of ssl.SSLSocket
+
+Python 2's ssl module cannot offer a session to resume, so
+ssl_session_cache uses these for connections to notaries. Only what
+ssl_dispatcher needs of SSLContext and SSLSocket, in non-blocking mode,
+is provided, with errors raised as the ssl module would."""
+
+import ssl
+
+from M2Crypto import SSL
+from M2Crypto import m2
+from M2Crypto.SSL.Session import Session
+
+class m2_ssl_context:
+    """Stand-in for ssl.SSLContext creating m2_ssl_socket instances
+
+    As with ssl_dispatcher, certificates are not checked, trust comes
+    from the signature on notary responses."""
+
+    def __init__(self):
+        self.context = SSL.Context("tls")
+        self.context.set_verify(SSL.verify_none, 0)
+
+    def wrap_socket(self, sock, do_handshake_on_connect=False,
+                    server_hostname=None, session=None):
+        """Return m2_ssl_socket for client connection over sock
+
+        session, if given, is an M2Crypto Session to resume. The
+        handshake is always left to do_handshake()."""
+        return m2_ssl_socket(self.context, sock, server_hostname, session)
+
+class m2_ssl_socket:
+    """Client SSL connection over a non-blocking socket
+
+    session is the current session, or None, and session_reused is
+    True once a handshake has resumed the session offered."""
+
+    def __init__(self, context, sock, server_hostname=None, session=None):
+        self._sock = sock
+        self._offered = session
+        self.session_reused = False
+        self.connection = SSL.Connection(context, sock)
+        self.connection.setblocking(0)
+        self.connection.setup_ssl()
+        self.connection.set_connect_state()
+        if server_hostname is not None:
+            self.connection.set_tlsext_host_name(server_hostname)
+        if session is not None:
+            self.connection.set_session(session)
+
+    @property
+    def session(self):
+        """Return the current M2Crypto Session, or None"""
+        pointer = m2.ssl_get1_session(self.connection.ssl)
+        if pointer is None:
+            return None
+        return Session(pointer, 1)
+
+    def do_handshake(self):
+        """Continue handshake, raising ssl.SSLError until it is done"""
+        try:
+            result = self.connection.connect_ssl()
+        except SSL.SSLError as e:
+            self._raise_error(e)
+        if result != 1:
+            # M2Crypto returns 0, not -1, when a non-blocking handshake
+            # must wait, so ask OpenSSL whether it can continue
+            error = m2.ssl_get_error(self.connection.ssl, result)
+            if error == m2.ssl_error_want_read:
+                raise ssl.SSLError(ssl.SSL_ERROR_WANT_READ,
+                                   "The operation did not complete")
+            if error == m2.ssl_error_want_write:
+                raise ssl.SSLError(ssl.SSL_ERROR_WANT_WRITE,
+                                   "The operation did not complete")
+            raise ssl.SSLError(ssl.SSL_ERROR_SSL,
+                               "Handshake failed (error %d)" % error)
+        if self._offered is not None:
+            # OpenSSL keeps the session it was given if, and only if,
+            # the server resumed it
+            current = m2.ssl_get_session(self.connection.ssl)
+            self.session_reused = (current is not None) and \
+                (int(current) == int(self._offered._ptr()))
+
+    def send(self, data):
+        """Send data, returning the amount sent, 0 if we need to wait"""
+        try:
+            amount = self.connection.write(str(data))
+        except SSL.SSLError as e:
+            self._raise_error(e)
+        return max(amount, 0)
+
+    def recv(self, size):
+        """Return up to size bytes, '' at end of connection"""
+        try:
+            data = self.connection.read(size)
+        except SSL.SSLError as e:
+            self._raise_error(e)
+        if data is None:
+            raise ssl.SSLError(ssl.SSL_ERROR_WANT_READ,
+                               "The operation did not complete")
+        return data
+
+    def recv_into(self, buffer, nbytes=0):
+        """Read into buffer, returning the number of bytes read"""
+        data = self.recv(nbytes or len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def pending(self):
+        return self.connection.pending()
+
+    def unwrap(self):
+        """Send close_notify, returning the underlying socket"""
+        m2.ssl_shutdown(self.connection.ssl)
+        return self._sock
+
+    def close(self):
+        self._sock.close()
+
+    def __getattr__(self, name):
+        # fileno(), getpeername() etc. of the underlying socket
+        return getattr(self._sock, name)
+
+    @staticmethod
+    def _raise_error(error):
+        """Raise M2Crypto error as ssl module would"""
+        message = str(error)
+        if "unexpected eof" in message.lower():
+            raise ssl.SSLError(ssl.SSL_ERROR_EOF, message)
+        raise ssl.SSLError(ssl.SSL_ERROR_SSL, message)
@@ -32,14 +32,28 @@ class ssl_dispatcher(asyncore.dispatcher):
         self.logger.debug("ssl_dispatcher initializing")
         asyncore.dispatcher.__init__(self, *args, **kwargs)
         
-    def start_ssl(self):
-        """Start SSL connection."""
+    def start_ssl(self, context=None, session=None, server_hostname=None):
+        """Start SSL connection.
+
+        context, if given, is the SSLContext, or an m2_ssl_context, to
+        use, otherwise ssl.wrap_socket() is used with its defaults.
+        session, if given, is a session to resume, which with Python 2
+        needs an m2_ssl_context."""
         if self._state != SSL_STATE.DISCONNECTED:
             raise ValueError(
                 "Tried to start already established SSL connection")
         self.logger.debug("Starting SSL handshake")
-        ssl_socket = ssl.wrap_socket(self.socket,
-                                     do_handshake_on_connect=False)
+        if context is None:
+            ssl_socket = ssl.wrap_socket(self.socket,
+                                         do_handshake_on_connect=False)
+        else:
+            kwargs = {}
+            if session is not None:
+                kwargs["session"] = session
+            ssl_socket = context.wrap_socket(self.socket,
+                                             do_handshake_on_connect=False,
+                                             server_hostname=server_hostname,
+                                             **kwargs)
         self.set_socket(ssl_socket)
         self._state = SSL_STATE.CONNECTING
         self._do_ssl_handshake()  # Kick things off
@@ -82,6 +96,36 @@ class ssl_dispatcher(asyncore.dispatcher):
                 return ''
             raise
 
+    def recv_into(self, buffer, nbytes=0):
+        """Read into buffer, returning the number of bytes read
+
+        As recv(), calls handle_close() if the connection has closed."""
+        try:
+            amount = self.socket.recv_into(buffer, nbytes)
+        except ssl.SSLError as err:
+            if err.args[0] in (ssl.SSL_ERROR_EOF,
+                               ssl.SSL_ERROR_ZERO_RETURN):
+                self.handle_close()
+                return 0
+            if err.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                               ssl.SSL_ERROR_WANT_WRITE):
+                return 0
+            raise
+        except socket.error as why:
+            if why.args[0] in asyncore._DISCONNECTED:
+                self.handle_close()
+                return 0
+            raise
+        if amount == 0:
+            self.handle_close()
+        return amount
+
+    def pending(self):
+        """Return number of bytes already decrypted and ready to read"""
+        if self._state != SSL_STATE.ESTABLISHED:
+            return 0
+        return self.socket.pending()
+
     def close(self):
         # ssl_shutdown will presumably take a few roundtrips here.
         if self._state == SSL_STATE.ESTABLISHED:
@@ -90,6 +134,12 @@ class ssl_dispatcher(asyncore.dispatcher):
         if self._state == SSL_STATE.DISCONNECTED:
             return asyncore.dispatcher.close(self)
     
+    def abort(self):
+        """Close socket immediately, without an SSL shutdown."""
+        self._state = SSL_STATE.DISCONNECTED
+        self._close_on_ssl_shutdown = False
+        asyncore.dispatcher.close(self)
+
     def ssl_shutdown(self):
         """Tear down SSL layer switching back to a clear text connection."""
         if self._state == SSL_STATE.DISCONNECTED:
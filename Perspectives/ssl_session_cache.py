@@ -0,0 +1,99 @@
+"""ssl_session_cache: Shared SSL contexts and sessions for dispatchers"""
+
+import logging
+import ssl
+import threading
+
+from m2_ssl import m2_ssl_context
+
+class ssl_session_cache:
+    """SSL context and most recent SSL session for each host
+
+    Sharing a context between connections to a host, and offering the
+    previous session when connecting, lets the server resume the
+    session instead of doing a full handshake. Python 2's ssl module
+    cannot resume sessions, so the contexts are m2_ssl_context
+    instances using M2Crypto.
+
+    As with ssl_dispatcher, notary certificates are not checked, trust
+    comes from the signature on the response.
+
+    get_ssl_context() provides an ssl.SSLContext with the same settings
+    for transports, such as asyncio, that need one.
+
+    handshakes counts handshakes completed and resumed how many of those
+    resumed a session."""
+
+    def __init__(self):
+        self.logger = logging.getLogger("Perspectives.ssl_session_cache")
+        self.handshakes = 0
+        self.resumed = 0
+        # key -> m2_ssl_context
+        self._contexts = {}
+        # key -> M2Crypto Session
+        self._sessions = {}
+        self._ssl_context = None
+        self._lock = threading.Lock()
+
+    def get_context(self, key):
+        """Return m2_ssl_context for key, normally (hostname, port)"""
+        with self._lock:
+            context = self._contexts.get(key)
+            if context is None:
+                context = m2_ssl_context()
+                self._contexts[key] = context
+            return context
+
+    def get_ssl_context(self):
+        """Return ssl.SSLContext shared by all hosts
+
+        With Python 2 its connections cannot resume sessions."""
+        with self._lock:
+            if self._ssl_context is None:
+                context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+                context.verify_mode = ssl.CERT_NONE
+                self._ssl_context = context
+            return self._ssl_context
+
+    def get_session(self, key):
+        """Return most recent session for key, or None"""
+        with self._lock:
+            return self._sessions.get(key)
+
+    def handshake_done(self, key, sock):
+        """Count completed handshake on sock, an m2_ssl_socket for key"""
+        resumed = getattr(sock, "session_reused", False)
+        with self._lock:
+            self.handshakes += 1
+            if resumed:
+                self.resumed += 1
+        self.logger.debug("%s: %s handshake" % (
+                key, "Resumed" if resumed else "Full"))
+        self.save_session(key, sock)
+
+    def save_session(self, key, sock):
+        """Save session of sock, an m2_ssl_socket for key, if it has one
+
+        With TLS 1.3 the session ticket arrives after the handshake, so
+        this should also be called once the connection has been used."""
+        session = getattr(sock, "session", None)
+        if session is None:
+            return
+        with self._lock:
+            self._sessions[key] = session
+
+    def resumption_rate(self):
+        """Return fraction of handshakes that resumed a session"""
+        if self.handshakes == 0:
+            return 0.0
+        return float(self.resumed) / self.handshakes
+
+    def clear(self):
+        """Forget all contexts and sessions"""
+        with self._lock:
+            self._contexts.clear()
+            self._sessions.clear()
+            self._ssl_context = None
+
+# ssl_session_cache used by default by Notaries
+default_ssl_sessions = ssl_session_cache()
@@ -1,40 +1,234 @@
 """Asyncore loop() with overall timeout"""
 
-from asyncore import poll, poll2, socket_map
+from asyncore import poll, poll2, readwrite, socket_map
 
+import errno
+import heapq
+import itertools
 import select
 import time
 
+# Backend used by loop_with_timeout() if not given, see auto_poller
+default_backend = "auto"
+
+# select() fails with fds at or above this (FD_SETSIZE)
+select_fd_limit = 1024
+
+class Timers:
+    """Heap of timers run by loop_with_timeout()
+
+    Used for deadlines of individual dispatchers, see HTTP_dispatcher.
+    Cancelled timers stay in the heap until they reach the top."""
+
+    def __init__(self):
+        # Heap of [time, sequence number, callback], callback is None
+        # if cancelled
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def add(self, delay, callback):
+        """Call callback with no arguments in delay seconds
+
+        Returns timer that can be passed to cancel()."""
+        timer = [time.time() + delay, next(self._sequence), callback]
+        heapq.heappush(self._heap, timer)
+        return timer
+
+    def cancel(self, timer):
+        """Cancel timer returned by add()"""
+        timer[2] = None
+
+    def next_time(self):
+        """Return time of next timer, or None if there are none"""
+        while self._heap and (self._heap[0][2] is None):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def run(self):
+        """Call callbacks of all expired timers"""
+        now = time.time()
+        while self._heap and (self._heap[0][0] <= now):
+            when, sequence, callback = heapq.heappop(self._heap)
+            if callback is not None:
+                callback()
+
+    def __len__(self):
+        return len([timer for timer in self._heap if timer[2] is not None])
+
+class epoll_poller:
+    """Poll an asyncore map with epoll
+
+    Unlike asyncore.poll() and poll2(), which pass every socket to the
+    kernel on each call, sockets are registered once and only modified
+    when the events their dispatcher is interested in change."""
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        # fd -> (socket, events) for registered fds. The socket is kept
+        # to notice a dispatcher closing and reopening a socket that
+        # gets the same fd, which the kernel will have unregistered.
+        self._registered = {}
+
+    def poll(self, timeout, map):
+        """Poll for up to timeout seconds, handling events for map"""
+        self._update(map)
+        try:
+            events = self._epoll.poll(timeout)
+        except IOError as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        for fd, flags in events:
+            obj = map.get(fd)
+            if obj is None:
+                continue
+            readwrite(obj, flags)
+
+    def close(self):
+        self._epoll.close()
+        self._registered.clear()
+
+    def _update(self, map):
+        """Bring registrations up to date with map"""
+        registered = self._registered
+        matched = 0
+        for fd, obj in map.iteritems():
+            events = 0
+            if obj.readable():
+                events = select.EPOLLIN | select.EPOLLPRI
+            # accepting sockets should not be writable
+            if obj.writable() and not obj.accepting:
+                events |= select.EPOLLOUT
+            entry = registered.get(fd)
+            if entry is not None:
+                if entry[0] is not obj.socket:
+                    self._unregister(fd)
+                elif entry[1] == events:
+                    matched += 1
+                    continue
+                elif events == 0:
+                    self._unregister(fd)
+                    continue
+                else:
+                    self._epoll.modify(fd, events)
+                    registered[fd] = (obj.socket, events)
+                    matched += 1
+                    continue
+            if events != 0:
+                try:
+                    self._epoll.register(fd, events)
+                except IOError as err:
+                    if err.args[0] != errno.EEXIST:
+                        raise
+                    # fd was reused without us seeing it closed
+                    self._epoll.modify(fd, events)
+                registered[fd] = (obj.socket, events)
+                matched += 1
+        if len(registered) > matched:
+            # Some dispatchers have left map
+            for fd in registered.keys():
+                if fd not in map:
+                    self._unregister(fd)
+
+    def _unregister(self, fd):
+        """Unregister fd, which may already be closed"""
+        del self._registered[fd]
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, ValueError):
+            pass  # Closed fds are removed by the kernel
+
+class auto_poller:
+    """Poll an asyncore map with select, or epoll once select cannot
+
+    select is fastest for maps of up to a thousand or so sockets, as
+    every dispatcher is asked for its events on each iteration anyway,
+    but fails once the map has an fd of select_fd_limit or more, as a
+    larger map will. epoll, or poll where there is no epoll, is used
+    while it does."""
+
+    def __init__(self):
+        self._epoll = None
+
+    def poll(self, timeout, map):
+        """Poll for up to timeout seconds, handling events for map"""
+        if (not map) or (max(map) < select_fd_limit):
+            poll(timeout, map)
+        elif hasattr(select, "epoll"):
+            if self._epoll is None:
+                self._epoll = epoll_poller()
+            self._epoll.poll(timeout, map)
+        else:
+            poll2(timeout, map)
+
+    def close(self):
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
+
 def loop_with_timeout(timeout=30.0,
                       use_poll=False,
                       map=None,
-                      count=None):
+                      count=None,
+                      until=None,
+                      timers=None,
+                      backend=None):
     """Modified version of asyncore.loop() where timeout reflects total time allowed.
 
     Instead of being timeout for select, timeout is the total time
     loop will run before returning.
+
+    until, if given, is called with no arguments before each poll and
+    the loop returns as soon as it returns True. It may add channels
+    to map.
+
+    timers, if given, is a Timers instance whose expired timers are run
+    before each poll, and which wake up the poll when they expire.
+
+    backend is "select", "poll", "epoll" or "auto" (see auto_poller),
+    default_backend if None, or "poll" if use_poll is True.
     """
     if map is None:
         map = socket_map
 
-    if use_poll and hasattr(select, 'poll'):
+    if backend is None:
+        backend = "poll" if use_poll else default_backend
+    poller = None
+    if backend == "epoll":
+        poller = epoll_poller()
+        poll_fun = poller.poll
+    elif backend == "auto":
+        poller = auto_poller()
+        poll_fun = poller.poll
+    elif (backend == "poll") and hasattr(select, 'poll'):
         poll_fun = poll2
     else:
         poll_fun = poll
+    try:
+        _loop(poll_fun, timeout, map, count, until, timers)
+    finally:
+        if poller is not None:
+            poller.close()
 
+def _loop(poll_fun, timeout, map, count, until, timers):
+    """Body of loop_with_timeout()"""
     stop_time = time.time() + timeout
 
-    if count is None:
-        while map:
-            timeout = stop_time - time.time()
-            if timeout <= 0.0:
-                break
-            poll_fun(timeout, map)
-
-    else:
-        while map and count > 0:
-            timeout = stop_time - time.time()
-            if timeout <= 0.0:
-                break
-            poll_fun(timeout, map)
+    while (count is None) or (count > 0):
+        if timers is not None:
+            timers.run()
+        if (until is not None) and until():
+            break
+        if not map:
+            break
+        now = time.time()
+        timeout = stop_time - now
+        if timeout <= 0.0:
+            break
+        if timers is not None:
+            next_time = timers.next_time()
+            if next_time is not None:
+                timeout = max(0.0, min(timeout, next_time - now))
+        poll_fun(timeout, map)
+        if count is not None:
             count = count - 1
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Unittests for DiskResponseCache class"""
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import testutils
+
+class TestDiskResponseCache(unittest.TestCase):
+    """Tests for DiskResponseCache class"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "responses.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        """Test DiskResponseCache shared between instances"""
+        from Perspectives import DiskResponseCache
+        from Perspectives import Service, ServiceType
+        response = testutils.create_NotaryResponse()
+        notary = response.notary
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        cache = DiskResponseCache(self.path)
+        self.assertIsNone(cache.get(notary, service))
+        cache.put(notary, service, response)
+        self.assertEqual(len(cache), 1)
+        for verify in (True, False):
+            other = DiskResponseCache(self.path, verify=verify)
+            loaded = other.get(notary, service)
+            self.assertIsNotNone(loaded)
+            self.assertEqual(loaded.raw_response, response.raw_response)
+            self.assertEqual(loaded.last_timestamp(),
+                             response.last_timestamp())
+            self.assertEqual(other.hits, 1)
+            other.close()
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_bad_signature(self):
+        """Test DiskResponseCache dropping response failing verification"""
+        from Perspectives import DiskResponseCache
+        from Perspectives import Service
+        response = testutils.create_NotaryResponse()
+        notary = response.notary
+        # Signature does not cover this service
+        service = Service("www.example.com", 443)
+        cache = DiskResponseCache(self.path)
+        cache.put(notary, service, response, verified=False)
+        self.assertIsNone(cache.get(notary, service))
+        self.assertEqual(len(cache), 0)
+
+    def test_expiry(self):
+        """Test DiskResponseCache expiring responses"""
+        from Perspectives import DiskResponseCache
+        response = testutils.create_NotaryResponse()
+        service = testutils.test_service()
+        cache = DiskResponseCache(self.path, ttl=-1000, min_ttl=-1)
+        cache.put(response.notary, service, response)
+        self.assertIsNone(cache.get(response.notary, service))
+        self.assertEqual(cache.purge(), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_backing(self):
+        """Test DiskResponseCache backing a ResponseCache"""
+        from Perspectives import DiskResponseCache
+        from Perspectives import ResponseCache
+        from Perspectives import Service, ServiceType
+        response = testutils.create_NotaryResponse()
+        notary = response.notary
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        ResponseCache(backing=DiskResponseCache(self.path)).put(
+            notary, service, response)
+        cache = ResponseCache(backing=DiskResponseCache(self.path))
+        self.assertIsNotNone(cache.get(notary, service))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.backing.hits, 1)
+
+    def test_notary_key(self):
+        """Test DiskResponseCache remembering notary key digests"""
+        from Perspectives import DiskResponseCache
+        from Perspectives import Service, ServiceType
+        response = testutils.create_NotaryResponse()
+        notary = response.notary
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        exports = []
+        get_public_key_pem = notary.get_public_key_pem
+        notary.get_public_key_pem = \
+            lambda: exports.append(1) or get_public_key_pem()
+        cache = DiskResponseCache(self.path)
+        cache.put(notary, service, response)
+        for i in range(3):
+            self.assertIsNotNone(cache.get(notary, service))
+        self.assertEqual(len(exports), 1)
+        # A changed key is noticed
+        notary.public_key = [other for other in testutils.test_notaries()
+                             if other.hostname != notary.hostname][0] \
+                             .public_key
+        notary.get_public_key_pem = get_public_key_pem
+        self.assertIsNone(cache.get(notary, service))
+
+    def test_threads(self):
+        """Test DiskResponseCache counting lookups from many threads"""
+        import threading
+        from Perspectives import DiskResponseCache
+        from Perspectives import Service, ServiceType
+        response = testutils.create_NotaryResponse()
+        notary = response.notary
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        cache = DiskResponseCache(self.path, verify=False)
+        cache.put(notary, service, response)
+
+        def _get():
+            for i in range(50):
+                cache.get(notary, service)
+            cache.close()
+
+        threads = [threading.Thread(target=_get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.hits, 400)
+        self.assertEqual(cache.misses, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Unittests for HTTP_response_parser class"""
+
+import httplib
+import unittest
+
+class TestHTTPResponseParser(unittest.TestCase):
+    """Tests for HTTP_response_parser class"""
+
+    def _feed_bytewise(self, parser, data):
+        """Feed data to parser one byte at a time, returning bytes used"""
+        used = 0
+        for c in data:
+            used += parser.feed(c)
+            if parser.complete:
+                break
+        return used
+
+    def test_content_length(self):
+        """Test HTTP_response_parser with Content-Length"""
+        from Perspectives.HTTP_dispatcher import HTTP_response_parser
+        data = "HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello"
+        parser = HTTP_response_parser()
+        self.assertEqual(parser.feed(data[:20]), 20)
+        self.assertIsNone(parser.status)
+        self.assertEqual(parser.feed(data[20:-1]), len(data) - 21)
+        self.assertEqual(parser.status, 200)
+        self.assertFalse(parser.complete)
+        self.assertRaises(httplib.IncompleteRead, parser.read)
+        self.assertEqual(parser.feed(data[-1:] + "extra"), 1)
+        self.assertTrue(parser.complete)
+        self.assertFalse(parser.will_close)
+        self.assertEqual(parser.getheader("content-length"), "5")
+        self.assertEqual(parser.read(), "hello")
+
+    def test_chunked(self):
+        """Test HTTP_response_parser with chunked body"""
+        from Perspectives.HTTP_dispatcher import HTTP_response_parser
+        data = "HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" \
+            "5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\nX-Trailer: a\r\n\r\n"
+        parser = HTTP_response_parser()
+        self.assertEqual(self._feed_bytewise(parser, data + "extra"),
+                         len(data))
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.read(), "hello, world")
+
+    def test_until_close(self):
+        """Test HTTP_response_parser with body ending at close"""
+        from Perspectives.HTTP_dispatcher import HTTP_response_parser
+        parser = HTTP_response_parser()
+        parser.feed("HTTP/1.0 200 OK\r\n\r\nsome ")
+        parser.feed("data")
+        self.assertFalse(parser.complete)
+        parser.connection_closed()
+        self.assertTrue(parser.complete)
+        self.assertTrue(parser.will_close)
+        self.assertEqual(parser.read(), "some data")
+
+    def test_no_body(self):
+        """Test HTTP_response_parser with empty body"""
+        from Perspectives.HTTP_dispatcher import HTTP_response_parser
+        parser = HTTP_response_parser()
+        parser.feed("HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.status, 404)
+        self.assertEqual(parser.read(), "")
+
+    def test_bad_response(self):
+        """Test HTTP_response_parser with malformed responses"""
+        from Perspectives.HTTP_dispatcher import HTTP_response_parser
+        parser = HTTP_response_parser()
+        self.assertRaises(httplib.BadStatusLine,
+                          parser.feed, "garbage\r\n\r\n")
+        self.assertRaises(httplib.BadStatusLine, parser.read)
+        parser = HTTP_response_parser()
+        self.assertRaises(httplib.HTTPException, parser.feed,
+                          "HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked"
+                          "\r\n\r\nzz\r\n")
+
+if __name__ == "__main__":
+    unittest.main()
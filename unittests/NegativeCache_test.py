@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Unittests for NegativeCache class"""
+
+import socket
+import unittest
+
+import testutils
+
+class TestNegativeCache(unittest.TestCase):
+    """Tests for NegativeCache class"""
+
+    def test_get_put(self):
+        """Test NegativeCache scope of each kind of failure"""
+        from Perspectives import NegativeCache
+        from Perspectives import Service
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        other_service = Service("other.example.com", 443)
+        cache = NegativeCache()
+        self.assertIsNone(cache.get(notaries[0], service))
+        cache.put(notaries[0], service, NegativeCache.UNKNOWN_SERVICE)
+        cache.put(notaries[1], service, NegativeCache.UNREACHABLE)
+        self.assertEqual(cache.get(notaries[0], service),
+                         NegativeCache.UNKNOWN_SERVICE)
+        self.assertIsNone(cache.get(notaries[0], other_service))
+        self.assertEqual(cache.get(notaries[1], other_service),
+                         NegativeCache.UNREACHABLE)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertIsNone(cache.get(notaries[1], service))
+
+    def test_expiry(self):
+        """Test NegativeCache expiring failures"""
+        from Perspectives import NegativeCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = NegativeCache(bad_signature_ttl=-1, max_size=2)
+        cache.put(notaries[0], service, NegativeCache.BAD_SIGNATURE)
+        self.assertIsNone(cache.get(notaries[0], service))
+        for notary in notaries[:3]:
+            cache.put(notary, service, NegativeCache.UNKNOWN_SERVICE)
+        self.assertEqual(len(cache), 2)
+
+    def test_failure_for_error(self):
+        """Test NegativeCache.failure_for_error()"""
+        from Perspectives import NegativeCache
+        from Perspectives import NotaryException
+        from Perspectives import NotaryResponseBadSignature
+        from Perspectives import NotaryUnknownServiceException
+        self.assertEqual(
+            NegativeCache.failure_for_error(NotaryUnknownServiceException()),
+            NegativeCache.UNKNOWN_SERVICE)
+        self.assertEqual(
+            NegativeCache.failure_for_error(NotaryResponseBadSignature()),
+            NegativeCache.BAD_SIGNATURE)
+        self.assertEqual(
+            NegativeCache.failure_for_error(socket.error(111, "refused")),
+            NegativeCache.UNREACHABLE)
+        self.assertIsNone(
+            NegativeCache.failure_for_error(socket.timeout()))
+        self.assertIsNone(
+            NegativeCache.failure_for_error(EOFError()))
+        self.assertIsNone(
+            NegativeCache.failure_for_error(NotaryException()))
+
+    def test_query(self):
+        """Test Notaries.query() skipping unreachable notary"""
+        from Perspectives import NegativeCache
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        refused = socket.socket()
+        refused.bind(("127.0.0.1", 0))
+        port = refused.getsockname()[1]
+        refused.close()
+        notaries = Notaries()
+        notaries.append(Notary("127.0.0.1", port,
+                               testutils.test_notaries()[0].public_key))
+        notaries.negative_cache = NegativeCache()
+        service = testutils.test_service()
+        responses = notaries.query(service, timeout=2)
+        self.assertEqual(list(responses), [None])
+        self.assertEqual(notaries.negative_cache.get(notaries[0], service),
+                         NegativeCache.UNREACHABLE)
+        # Notary is now skipped, even when chosen by num
+        self.assertEqual(notaries._select_notaries(1, service), [notaries[0]])
+        dispatchers = []
+        get_dispatcher = notaries[0].get_dispatcher
+        notaries[0].get_dispatcher = \
+            lambda *args, **kwargs: dispatchers.append(args) or \
+            get_dispatcher(*args, **kwargs)
+        responses = notaries.query(service, num=1, timeout=2)
+        self.assertEqual(list(responses), [None])
+        self.assertEqual(dispatchers, [])
+
+    def test_query_timeout(self):
+        """Test Notaries.query() not remembering a query it cut short"""
+        from Perspectives import NegativeCache
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        server = testutils.LocalServer(lambda path: (200, ""), delay=1)
+        try:
+            notaries = Notaries()
+            notaries.append(Notary("127.0.0.1", server.port,
+                                   testutils.test_notaries()[0].public_key))
+            notaries.negative_cache = NegativeCache()
+            service = testutils.test_service()
+            responses = notaries.query(service, timeout=0.2)
+            self.assertEqual(list(responses), [None])
+            self.assertEqual(server.connections, 1)
+            self.assertIsNone(notaries.negative_cache.get(notaries[0],
+                                                          service))
+        finally:
+            server.close()
+
+    def test_query_slow_response(self):
+        """Test Notaries.query() not remembering a missed first byte"""
+        from Perspectives import NegativeCache
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        server = testutils.LocalServer(lambda path: (200, ""), delay=1)
+        try:
+            notaries = Notaries()
+            notaries.first_byte_timeout = 0.2
+            notaries.append(Notary("127.0.0.1", server.port,
+                                   testutils.test_notaries()[0].public_key))
+            notaries.negative_cache = NegativeCache()
+            service = testutils.test_service()
+            responses = notaries.query(service, timeout=5)
+            self.assertEqual(list(responses), [None])
+            self.assertIsNone(notaries.negative_cache.get(notaries[0],
+                                                          service))
+        finally:
+            server.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 """Unittests for Notaries class"""
 
+import multiprocessing
 import os.path
 import unittest
 
+import testutils
+
 class TestNotaries(unittest.TestCase):
     """Tests for Notaries class"""
     
@@ -15,6 +18,8 @@ class TestNotaries(unittest.TestCase):
         from Perspectives import Notaries
         notaries = Notaries()
         self.assertIsNotNone(notaries)
+        # Pipelining failures are remembered per instance
+        self.assertIsNot(notaries.no_pipelining, Notaries().no_pipelining)
 
     def test_default_notaries(self):
         """Test default_notaries()"""
@@ -47,5 +52,388 @@ class TestNotaries(unittest.TestCase):
         notary = notaries.find_notary("does.not.exist")
         self.assertIsNone(notary)
 
+    def test_parse_and_verify(self):
+        """Test parsing and verifying responses with a process pool"""
+        from Perspectives import NotaryParser
+        from Perspectives import NotaryResponse
+        from Perspectives import NotaryResponseBadSignature
+        from Perspectives import Service, ServiceType
+        from Perspectives.Notaries import _parse_and_verify
+        notaries = NotaryParser().parse_file(self.notary_file)
+        notary = notaries.find_notary("cmu.ron.lcs.mit.edu")
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        jobs = [(notary.protocol_class,
+                 notary.hostname,
+                 notary.port,
+                 notary.get_public_key_pem(),
+                 service,
+                 testutils.load_response(filename))
+                for filename in ["response.1", "response-bad.1"]]
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(_parse_and_verify, jobs)
+        finally:
+            pool.close()
+        response, error = results[0]
+        self.assertIsInstance(response, NotaryResponse)
+        self.assertIsNone(error)
+        response, error = results[1]
+        self.assertIsNone(response)
+        self.assertIsInstance(error, NotaryResponseBadSignature)
+
+    def test_query_many_no_notaries(self):
+        """Test query_many() with no notaries"""
+        from Perspectives import Notaries
+        services = [testutils.test_service() for i in range(3)]
+        completed = []
+        results = Notaries().query_many(
+            services, callback=lambda s, r: completed.append(s))
+        self.assertEqual(len(results), 3)
+        for service in services:
+            self.assertEqual(len(results[service]), 0)
+        self.assertEqual(completed, services)
+
+    def _local_notaries(self, count, delay):
+        """Return (Notaries, servers, peaks) for count local notaries
+
+        Each notary's server answers every query with response.1 after
+        delay seconds. peaks records the most dispatchers open at once
+        as "all" and for each notary's port."""
+        import collections
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        response_data = testutils.load_response("response.1")
+        public_key = testutils.test_notaries().find_notary(
+            "cmu.ron.lcs.mit.edu").public_key
+        notaries = Notaries()
+        servers = []
+        peaks = collections.defaultdict(int)
+        for i in range(count):
+            server = testutils.LocalServer(lambda path: (200, response_data),
+                                           delay=delay)
+            servers.append(server)
+            notary = Notary("127.0.0.1", server.port, public_key)
+
+            def _get_dispatcher(service, map, _get=notary.get_dispatcher,
+                                **kwargs):
+                dispatcher = _get(service, map, **kwargs)
+                peaks["all"] = max(peaks["all"], len(map))
+                open_here = len([d for d in map.values()
+                                 if d.port == dispatcher.port])
+                peaks[dispatcher.port] = max(peaks[dispatcher.port],
+                                             open_here)
+                return dispatcher
+
+            notary.get_dispatcher = _get_dispatcher
+            notaries.append(notary)
+        return notaries, servers, peaks
+
+    def test_query_many_limits(self):
+        """Test query_many() limiting queries open at once"""
+        from Perspectives import Service, ServiceType
+        services = [Service("www.citibank.com", 443, ServiceType.SSL),
+                    Service("host1.example.com", 443),
+                    Service("host2.example.com", 443)]
+        notaries, servers, peaks = self._local_notaries(3, 0.2)
+        try:
+            results = notaries.query_many(services, timeout=10,
+                                          max_concurrency=2)
+            self.assertEqual(peaks["all"], 2)
+            self.assertEqual(sum([server.connections for server in servers]),
+                             9)
+            self.assertEqual(len([r for r in results[services[0]]
+                                  if r is not None]), 3)
+            peaks.clear()
+            notaries.query_many(services, timeout=10, max_per_notary=1)
+            self.assertEqual(peaks["all"], 3)
+            for server in servers:
+                self.assertEqual(peaks[server.port], 1)
+        finally:
+            for server in servers:
+                server.close()
+
+    def test_query_many_callback(self):
+        """Test query_many() calling callback once for each service"""
+        from Perspectives import Service, ServiceType
+        services = [Service("www.citibank.com", 443, ServiceType.SSL),
+                    Service("host1.example.com", 443)]
+        notaries, servers, peaks = self._local_notaries(2, 0)
+        completed = []
+
+        def _callback(service, responses):
+            completed.append(service)
+            self.assertEqual(len(responses), len(notaries))
+            if service is services[0]:
+                # Verified responses from every notary
+                for notary, response in zip(notaries, responses):
+                    self.assertIsNotNone(response)
+                    self.assertIs(response.notary, notary)
+            else:
+                # Signed for another service, so failed to verify
+                self.assertEqual(list(responses), [None, None])
+
+        try:
+            results = notaries.query_many(services, timeout=10,
+                                          callback=_callback)
+        finally:
+            for server in servers:
+                server.close()
+        self.assertEqual(sorted(completed), sorted(services))
+        for service in services:
+            self.assertEqual(len(results[service]), 2)
+
+    def test_query_executor(self):
+        """Test query() parsing responses with thread and process pools"""
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures import ThreadPoolExecutor
+        from Perspectives import NotaryResponse
+        from Perspectives import Service, ServiceType
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        notaries, servers, peaks = self._local_notaries(2, 0)
+        try:
+            for executor in [ThreadPoolExecutor(2), ProcessPoolExecutor(2)]:
+                try:
+                    responses = notaries.query(service, timeout=10,
+                                               executor=executor,
+                                               use_cache=False)
+                finally:
+                    executor.shutdown()
+                self.assertEqual(len(responses), 2)
+                for notary, response in zip(notaries, responses):
+                    self.assertIsInstance(response, NotaryResponse)
+                    self.assertIs(response.notary, notary)
+                    # Raises if the signature is bad
+                    notary.get_protocol(service).verify_response(response)
+        finally:
+            for server in servers:
+                server.close()
+
+    def test_query_slow_dns(self):
+        """Test query() not waiting for lookups beyond its timeout"""
+        import socket
+        import time
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        from Perspectives import Resolver
+        from Perspectives import Service, ServiceType
+
+        def _getaddrinfo(hostname, port, *args):
+            if (len(args) == 4) and (args[3] & socket.AI_NUMERICHOST):
+                return getaddrinfo(hostname, port, *args)
+            time.sleep(1)
+            return getaddrinfo("127.0.0.1", port)
+
+        public_key = testutils.test_notaries()[0].public_key
+        notaries = Notaries()
+        notaries.resolver = Resolver()
+        for i in range(5):
+            notaries.append(Notary("slow%d.example.com" % i, 8080,
+                                   public_key))
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = _getaddrinfo
+        try:
+            start = time.time()
+            responses = notaries.query(service, timeout=0.5)
+            self.assertLess(time.time() - start, 0.9)
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        self.assertEqual(list(responses), [None] * 5)
+
+    def test_is_policy_decided(self):
+        """Test _is_policy_decided()"""
+        from Perspectives import Notaries
+        from Perspectives import NotaryResponses
+        from Perspectives.Policy import Policy
+        notaries = Notaries()
+        response = testutils.create_NotaryResponse()
+        fingerprint = response.last_key_seen().fingerprint
+        policy = Policy(2, stale_limit=2**31)
+        responses = NotaryResponses([response, None, None])
+        self.assertFalse(notaries._is_policy_decided(policy, fingerprint,
+                                                     responses, 2))
+        responses = NotaryResponses([response, None, response])
+        self.assertFalse(notaries._is_policy_decided(policy, fingerprint,
+                                                     responses, 1))
+        self.assertTrue(notaries._is_policy_decided(policy, fingerprint,
+                                                    responses, 0))
+        responses = NotaryResponses([None, None, response])
+        self.assertTrue(notaries._is_policy_decided(policy, fingerprint,
+                                                    responses, 0))
+
+    def test_is_policy_decided_satisfied(self):
+        """Test _is_policy_decided() not stopping once policy satisfied"""
+        import time
+        from Perspectives import Fingerprint
+        from Perspectives import Notaries
+        from Perspectives import NotaryResponses
+        from Perspectives.Policy import Policy, PolicyException
+        now = int(time.time())
+        fp = ":".join(["12"] * 16)
+        fingerprint = Fingerprint.from_string(fp)
+        recent = testutils.create_synthetic_NotaryResponse(
+            [(fp, [(now - 1000, now - 10)])])
+        old = testutils.create_synthetic_NotaryResponse(
+            [(fp, [(now - 2000, now - 1500)])])
+        policy = Policy(2, quorum_duration=500)
+        responses = NotaryResponses([recent, recent, None])
+        policy.check(fingerprint, responses)
+        self.assertFalse(Notaries()._is_policy_decided(policy, fingerprint,
+                                                       responses, 1))
+        # The last response shortens the quorum duration
+        responses[2] = old
+        self.assertRaises(PolicyException, policy.check, fingerprint,
+                          responses)
+
+    def test_query_policy_decided_by_cache(self):
+        """Test query() with policy not querying when cache decides it"""
+        from Perspectives import Fingerprint
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        from Perspectives import ResponseCache
+        from Perspectives import Service, ServiceType
+        from Perspectives.Policy import Policy
+        response = testutils.create_NotaryResponse()
+        notaries = Notaries()
+        notaries.append(response.notary)
+        notaries.append(Notary("127.0.0.1", 1, response.notary.public_key))
+        dispatchers = []
+        notaries[1].get_dispatcher = \
+            lambda *args, **kwargs: dispatchers.append(args)
+        notaries.response_cache = ResponseCache(min_ttl=60)
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        notaries.response_cache.put(notaries[0], service, response)
+        # Cached response disagrees, so quorum of 2 cannot be reached
+        fingerprint = Fingerprint.from_string(":".join(["00"] * 16))
+        responses = notaries.query(service, policy=Policy(2),
+                                   fingerprint=fingerprint, timeout=5)
+        self.assertIs(responses[0], response)
+        self.assertIsNone(responses[1])
+        self.assertEqual(dispatchers, [])
+
+    def test_query_coalescing(self):
+        """Test concurrent query() calls sharing one query"""
+        import threading
+        import time
+        from Perspectives import NotaryResponses
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        release = threading.Event()
+        calls = []
+
+        def _query(*args):
+            calls.append(args)
+            release.wait()
+            return NotaryResponses([None] * len(notaries))
+
+        notaries._query = _query
+        results = []
+        threads = [threading.Thread(
+                target=lambda: results.append(notaries.query(service)))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for i in range(100):
+            if notaries.coalesced_queries == 4:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        for responses in results:
+            self.assertEqual(list(responses), [None] * len(notaries))
+        # Nothing left in flight, so a new query is made
+        notaries.query(service)
+        self.assertEqual(len(calls), 2)
+
+    def test_query_coalescing_error(self):
+        """Test coalesced query() calls getting the leader's error"""
+        import threading
+        import time
+        import traceback
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        release = threading.Event()
+
+        def _query(*args):
+            release.wait()
+            raise ValueError("query failed")
+
+        notaries._query = _query
+        tracebacks = []
+
+        def _call():
+            try:
+                notaries.query(service)
+            except ValueError:
+                tracebacks.append(traceback.format_exc())
+
+        threads = [threading.Thread(target=_call) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for i in range(100):
+            if notaries.coalesced_queries == 1:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(tracebacks), 2)
+        for tb in tracebacks:
+            self.assertIn("in _query", tb)
+
+    def test_query_coalescing_server(self):
+        """Test concurrent query() calls sharing one connection"""
+        import threading
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        from Perspectives import Service, ServiceType
+        response_data = testutils.load_response("response.1")
+        server = testutils.LocalServer(lambda path: (200, response_data),
+                                       delay=0.5)
+        notaries = Notaries()
+        notaries.append(Notary(
+                "127.0.0.1", server.port,
+                testutils.test_notaries().find_notary(
+                    "cmu.ron.lcs.mit.edu").public_key))
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        results = []
+        threads = [threading.Thread(
+                target=lambda: results.append(notaries.query(service,
+                                                             timeout=5)))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        server.close()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(notaries.coalesced_queries, 1)
+        self.assertEqual(len(results), 2)
+        self.assertIsNotNone(results[0][0])
+        self.assertIs(results[0][0], results[1][0])
+
+    def test_query_key(self):
+        """Test _query_key() distinguishing queries"""
+        from Perspectives import Notaries
+        from Perspectives import Service
+        from Perspectives.Policy import Policy
+        service = testutils.test_service()
+        key = Notaries._query_key(service, 0, None, None, True)
+        self.assertEqual(Notaries._query_key(testutils.test_service(), 0,
+                                             None, None, True), key)
+        self.assertNotEqual(Notaries._query_key(
+                Service("other.example.com", 443), 0, None, None, True), key)
+        self.assertNotEqual(Notaries._query_key(service, 3, None, None,
+                                                True), key)
+        self.assertNotEqual(Notaries._query_key(service, 0, None, None,
+                                                False), key)
+        fingerprint = testutils.create_NotaryResponse().last_key_seen() \
+            .fingerprint
+        self.assertNotEqual(Notaries._query_key(service, 0, Policy(2),
+                                                fingerprint, True), key)
+
 if __name__ == "__main__":
     unittest.main()
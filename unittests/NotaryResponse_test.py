@@ -2,6 +2,7 @@
 """Unittests for NotaryResponse class"""
 
 import os.path
+import random
 import unittest
 
 import testutils
@@ -29,5 +30,57 @@ class TestNotaryResponse(unittest.TestCase):
         self.assertEqual(key, expected_key,
                          "%s != %s" % (key, expected_key))
 
+    def test_key_timespans(self):
+        """Test timespans of NotaryResponseKey"""
+        response = testutils.create_NotaryResponse()
+        for key in response.keys:
+            self.assertEqual(len(key.timespans), len(key.starts))
+            self.assertEqual([t.start for t in key.timespans],
+                             list(key.starts))
+            self.assertEqual([t.end for t in key.timespans],
+                             list(key.ends))
+            span_bytes = b"".join([t.bytes() for t in key.timespans])
+            self.assertTrue(key.bytes().endswith(span_bytes))
+
+    def test_set_key_timespans(self):
+        """Test assigning timespans of NotaryResponseKey"""
+        from Perspectives import NotaryResponseTimeSpan
+        response = testutils.create_NotaryResponse()
+        key = response.keys[0]
+        self.assertIsNone(response.key_at_time(150))
+        key.timespans = [NotaryResponseTimeSpan(100, 200),
+                         NotaryResponseTimeSpan(300, 400)]
+        self.assertEqual(list(key.starts), [100, 300])
+        self.assertEqual(list(key.ends), [200, 400])
+        self.assertEqual(key.last_timestamp(), 400)
+        self.assertEqual(len(key.timespans), 2)
+        self.assertTrue(key.bytes().endswith(
+                NotaryResponseTimeSpan(300, 400).bytes()))
+        # Response's index follows the new timespans
+        self.assertIs(response.key_at_time(150), key)
+        self.assertIsNone(response.key_at_time(250))
+
+    def test_key_at_time(self):
+        """Test key_at_time() against a linear scan of keys"""
+        fingerprints = [
+            "00:11:22:33:44:55:66:77:88:99:aa:bb:cc:dd:ee:ff",
+            "ff:ee:dd:cc:bb:aa:99:88:77:66:55:44:33:22:11:00",
+            ]
+        rand = random.Random(42)
+        for i in range(100):
+            keys = [(fp, [(start, start + rand.randint(0, 50))
+                          for start in [rand.randint(0, 500)
+                                        for s in range(rand.randint(1, 5))]])
+                    for fp in fingerprints[:rand.randint(1, 2)]]
+            response = testutils.create_synthetic_NotaryResponse(keys)
+            for t in [n / 2.0 for n in range(-2, 1200)]:
+                expected = None
+                for key in response.keys:
+                    if [span for span in key.timespans
+                        if span.start <= t <= span.end]:
+                        expected = key
+                        break
+                self.assertIs(response.key_at_time(t), expected)
+
 if __name__ == "__main__":
     unittest.main()
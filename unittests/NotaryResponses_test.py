@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Unittests for NotaryResponses class"""
+
+import random
+import unittest
+
+import testutils
+
+class TestNotaryResponses(unittest.TestCase):
+    """Tests for NotaryResponses class"""
+
+    fingerprints = [
+        "00:11:22:33:44:55:66:77:88:99:aa:bb:cc:dd:ee:ff",
+        "ff:ee:dd:cc:bb:aa:99:88:77:66:55:44:33:22:11:00",
+        "87:71:5c:d4:7b:66:fd:9f:96:79:ba:0f:3e:15:b7:e3",
+        ]
+
+    def _random_responses(self, rand):
+        """Return NotaryResponses with random, possibly overlapping, keys"""
+        from Perspectives import NotaryResponses
+        responses = NotaryResponses()
+        for n in range(rand.randint(1, 6)):
+            if rand.random() < 0.1:
+                responses.append(None)
+                continue
+            keys = []
+            for fp in rand.sample(self.fingerprints, rand.randint(1, 3)):
+                spans = []
+                for s in range(rand.randint(1, 5)):
+                    start = rand.randint(0, 1000)
+                    spans.append((start, start + rand.randint(0, 200)))
+                keys.append((fp, spans))
+            responses.append(testutils.create_synthetic_NotaryResponse(keys))
+        return responses
+
+    def test_key_agreement_sweep(self):
+        """Test _key_agreement_sweep() matches key_agreement_count()"""
+        from Perspectives import Fingerprint
+        rand = random.Random(42)
+        for i in range(200):
+            responses = self._random_responses(rand)
+            fp = Fingerprint.from_string(rand.choice(self.fingerprints))
+            times = set(rand.randint(-10, 1300) for n in range(50))
+            for r in responses:
+                if r is not None:
+                    times.update(r.key_change_times())
+            for t, count in responses._key_agreement_sweep(fp, times):
+                self.assertEqual(count, responses.key_agreement_count(fp, t),
+                                 "Count mismatch at time %s" % t)
+
+    def test_quorum_duration(self):
+        """Test quorum_duration()"""
+        from Perspectives import NotaryResponses
+        response = testutils.create_NotaryResponse()
+        responses = NotaryResponses([response])
+        key = response.last_key_seen()
+        # Response is old, so with no stale limit there is no quorum
+        self.assertEqual(
+            responses.quorum_duration(key.fingerprint, 1, 24*3600), 0)
+        duration = responses.quorum_duration(key.fingerprint, 1, 2**31)
+        self.assertTrue(duration > 0)
+        self.assertEqual(
+            responses.quorum_duration(key.fingerprint, 2, 2**31), 0)
+
+if __name__ == "__main__":
+    unittest.main()
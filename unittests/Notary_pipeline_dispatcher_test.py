@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""Unittests for Notary_pipeline_dispatcher class"""
+
+import socket
+import threading
+import unittest
+
+import testutils
+
+def serve(listener, keep_alive, discard_pipelined=False):
+    """Answer requests on listener, replying with the request path
+
+    If keep_alive is False, the connection is closed after the first
+    response, as a server not supporting pipelining might. If
+    discard_pipelined is True, requests following another in the same
+    read are ignored, as another such server might."""
+    while True:
+        try:
+            conn, address = listener.accept()
+        except socket.error:
+            return
+        data = ""
+        while True:
+            chunk = conn.recv(8192)
+            if not chunk:
+                break
+            data += chunk
+            while "\r\n\r\n" in data:
+                request, data = data.split("\r\n\r\n", 1)
+                path = request.split(" ")[1]
+                conn.sendall("HTTP/1.1 200 OK\r\n"
+                             "Content-Length: %d\r\n\r\n%s" % (len(path),
+                                                               path))
+                if not keep_alive:
+                    break
+                if discard_pipelined:
+                    data = ""
+            if not keep_alive:
+                break
+        conn.close()
+
+class TestNotaryPipelineDispatcher(unittest.TestCase):
+    """Tests for Notary_pipeline_dispatcher class"""
+
+    def _query(self, keep_alive, discard_pipelined=False, **kwargs):
+        """Query a local server about several services
+
+        Keyword arguments are passed to the dispatcher.
+        Returns (dispatcher, services)."""
+        from Perspectives import Notary, Service
+        from Perspectives.Notary_pipeline_dispatcher \
+            import Notary_pipeline_dispatcher
+        from Perspectives.timed_asyncore import Timers, loop_with_timeout
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+        thread = threading.Thread(target=serve, args=(listener, keep_alive,
+                                                      discard_pipelined))
+        thread.daemon = True
+        thread.start()
+        port = listener.getsockname()[1]
+        public_key = testutils.test_notaries()[0].public_key
+        notary = Notary("127.0.0.1", port, public_key)
+        services = [Service("host%d.example.com" % i, 443)
+                    for i in range(5)]
+        map = {}
+        timers = Timers()
+        dispatcher = Notary_pipeline_dispatcher(notary, services, map,
+                                                timers=timers, **kwargs)
+        loop_with_timeout(timeout=5, map=map, timers=timers)
+        listener.close()
+        return dispatcher, services
+
+    def test_pipelining(self):
+        """Test Notary_pipeline_dispatcher with pipelining server"""
+        dispatcher, services = self._query(keep_alive=True)
+        self.assertTrue(dispatcher.finished)
+        self.assertTrue(dispatcher.pipelining)
+        for index, service in enumerate(services):
+            self.assertIn("host=%s&" % service.hostname,
+                          dispatcher.get_response_data(index))
+
+    def test_small_reads(self):
+        """Test Notary_pipeline_dispatcher with responses split across reads"""
+        dispatcher, services = self._query(keep_alive=True, read_size=7)
+        self.assertTrue(dispatcher.finished)
+        for index, service in enumerate(services):
+            self.assertIn("host=%s&" % service.hostname,
+                          dispatcher.get_response_data(index))
+
+    def test_fallback(self):
+        """Test Notary_pipeline_dispatcher falling back without pipelining"""
+        from Perspectives.Notary_pipeline_dispatcher import no_pipelining_set
+        no_pipelining = no_pipelining_set()
+        dispatcher, services = self._query(keep_alive=False,
+                                           no_pipelining=no_pipelining)
+        self.assertTrue(dispatcher.finished)
+        self.assertFalse(dispatcher.pipelining)
+        self.assertIn(dispatcher.notary_address, no_pipelining)
+        for index, service in enumerate(services):
+            self.assertIn("host=%s&" % service.hostname,
+                          dispatcher.get_response_data(index))
+
+    def test_pipeline_timeout(self):
+        """Test Notary_pipeline_dispatcher with server ignoring pipelining"""
+        import time
+        from Perspectives.Notary_pipeline_dispatcher import no_pipelining_set
+        no_pipelining = no_pipelining_set()
+        start = time.time()
+        dispatcher, services = self._query(keep_alive=True,
+                                           discard_pipelined=True,
+                                           no_pipelining=no_pipelining,
+                                           pipeline_timeout=0.2)
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(dispatcher.finished)
+        self.assertFalse(dispatcher.pipelining)
+        self.assertIsNone(dispatcher.timed_out)
+        self.assertIn(dispatcher.notary_address, no_pipelining)
+        for index, service in enumerate(services):
+            self.assertIn("host=%s&" % service.hostname,
+                          dispatcher.get_response_data(index))
+
+    def test_no_pipelining_set(self):
+        """Test no_pipelining_set forgetting notaries after ttl"""
+        from Perspectives.Notary_pipeline_dispatcher import no_pipelining_set
+        no_pipelining = no_pipelining_set()
+        no_pipelining.add(("a", 80))
+        self.assertIn(("a", 80), no_pipelining)
+        self.assertNotIn(("b", 80), no_pipelining)
+        expired = no_pipelining_set(ttl=-1)
+        expired.add(("a", 80))
+        self.assertNotIn(("a", 80), expired)
+        self.assertEqual(len(expired), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,6 +24,16 @@ class TestProtocol(unittest.TestCase):
         protocol = Protocol(notaries[0], service)
         self.assertIsNotNone(protocol)
 
+    def test_get_request(self):
+        """Test Protocol.get_request() matches request built by httplib"""
+        from Perspectives.HTTP_dispatcher import build_request
+        from Perspectives.HTTP_dispatcher import parse_url
+        protocol = self._create_procotol()
+        scheme, hostname, port, path = parse_url(protocol.get_url())
+        self.assertEqual(protocol.get_address(), (scheme, hostname, port))
+        self.assertEqual(protocol.get_request(),
+                         build_request(hostname, "GET", path))
+
     def test_response_verify(self):
         """Test verification of response"""
         from Perspectives import NotaryResponse
@@ -55,6 +65,37 @@ class TestProtocol(unittest.TestCase):
         response_string = testutils.load_response("response-bad.1")
         with self.assertRaises(NotaryResponseBadSignature):
             protocol.parse_response(response_string)
+
+    def test_check_status(self):
+        """Test Protocol.check_status()"""
+        from Perspectives import NotaryException
+        from Perspectives import NotaryUnknownServiceException
+        protocol = self._create_procotol()
+        protocol.check_status(200)
+        with self.assertRaises(NotaryUnknownServiceException):
+            protocol.check_status(404)
+        with self.assertRaises(NotaryException):
+            protocol.check_status(500)
+
+    def test_xml_parsers(self):
+        """Test expat and minidom parsers return the same results"""
+        protocol = self._create_procotol()
+        for response_string in testutils.test_responses():
+            expat = protocol._parse_expat(response_string)
+            minidom = protocol._parse_minidom(response_string)
+            self.assertEqual(expat[0:3], minidom[0:3])
+            self.assertEqual(len(expat[3]), len(minidom[3]))
+            for expat_key, minidom_key in zip(expat[3], minidom[3]):
+                self.assertEqual(expat_key, minidom_key)
+                self.assertEqual(expat_key.bytes(), minidom_key.bytes())
+
+    def test_xml_parser_bad_document(self):
+        """Test parsing of reply with unrecognized document element"""
+        from Perspectives import NotaryResponseException
+        protocol = self._create_procotol()
+        for parser in [protocol._parse_expat, protocol._parse_minidom]:
+            with self.assertRaises(NotaryResponseException):
+                parser("<notary_response/>")
         
 if __name__ == "__main__":
     unittest.main()
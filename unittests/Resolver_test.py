@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Unittests for Resolver class"""
+
+import socket
+import unittest
+
+class TestResolver(unittest.TestCase):
+    """Tests for Resolver class"""
+
+    def test_resolve(self):
+        """Test Resolver.resolve() and caching"""
+        from Perspectives.Resolver import Resolver
+        resolver = Resolver()
+        self.assertIsNone(resolver.get_cached("127.0.0.1", 80))
+        addresses = resolver.resolve("127.0.0.1", 80)
+        self.assertEqual(addresses[0][4], ("127.0.0.1", 80))
+        self.assertEqual(resolver.get_cached("127.0.0.1", 80), addresses)
+        resolver.clear()
+        self.assertIsNone(resolver.get_cached("127.0.0.1", 80))
+
+    def test_ttl(self):
+        """Test Resolver cache expiration"""
+        from Perspectives.Resolver import Resolver
+        resolver = Resolver(ttl=-1)
+        resolver.resolve("127.0.0.1", 80)
+        self.assertIsNone(resolver.get_cached("127.0.0.1", 80))
+
+    def test_resolve_many(self):
+        """Test Resolver.resolve_many()"""
+        from Perspectives.Resolver import Resolver
+        resolver = Resolver(max_threads=2)
+        addresses = [("127.0.0.1", port) for port in range(80, 85)]
+        resolver.resolve_many(addresses + [("does.not.exist.invalid", 80)])
+        for address in addresses:
+            self.assertIsNotNone(resolver.get_cached(*address))
+        self.assertIsNone(resolver.get_cached("does.not.exist.invalid", 80))
+        with self.assertRaises(socket.gaierror):
+            resolver.resolve("does.not.exist.invalid", 80)
+
+    def test_negative_ttl(self):
+        """Test Resolver caching failed lookups"""
+        from Perspectives.Resolver import Resolver
+        lookups = []
+
+        def _getaddrinfo(*args):
+            lookups.append(args)
+            raise socket.gaierror(socket.EAI_NONAME, "Name not known")
+
+        getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = _getaddrinfo
+        try:
+            resolver = Resolver(negative_ttl=60)
+            for i in range(2):
+                with self.assertRaises(socket.gaierror):
+                    resolver.resolve("example.invalid", 80)
+            resolver.resolve_many([("example.invalid", 80)])
+            self.assertEqual(len(lookups), 1)
+            self.assertIsNone(resolver.get_cached("example.invalid", 80))
+            resolver = Resolver(negative_ttl=0)
+            for i in range(2):
+                with self.assertRaises(socket.gaierror):
+                    resolver.resolve("example.invalid", 80)
+            self.assertEqual(len(lookups), 3)
+        finally:
+            socket.getaddrinfo = getaddrinfo
+
+    def test_resolve_many_timeout(self):
+        """Test Resolver.resolve_many() giving up after timeout"""
+        import time
+        from Perspectives.Resolver import Resolver
+
+        def _getaddrinfo(*args):
+            time.sleep(1)
+            return getaddrinfo("127.0.0.1", 80)
+
+        getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = _getaddrinfo
+        try:
+            resolver = Resolver()
+            start = time.time()
+            resolver.resolve_many([("slow.example.com", 80)], timeout=0.1)
+            self.assertLess(time.time() - start, 0.5)
+            self.assertIsNone(resolver.get_cached("slow.example.com", 80))
+        finally:
+            socket.getaddrinfo = getaddrinfo
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Unittests for ResponseCache class"""
+
+import time
+import unittest
+
+import testutils
+
+class TestResponseCache(unittest.TestCase):
+    """Tests for ResponseCache class"""
+
+    def _response(self, age=0):
+        """Return synthetic NotaryResponse last seen age seconds ago"""
+        now = int(time.time()) - age
+        return testutils.create_synthetic_NotaryResponse(
+            [("00:" * 15 + "00", [(now - 100, now)])])
+
+    def test_get_put(self):
+        """Test basic ResponseCache operation"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache()
+        response = self._response()
+        self.assertIsNone(cache.get(notaries[0], service))
+        cache.put(notaries[0], service, response)
+        self.assertIs(cache.get(notaries[0], service), response)
+        self.assertIsNone(cache.get(notaries[1], service))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+        self.assertIsNotNone(str(cache))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get(notaries[0], service))
+
+    def test_expiry(self):
+        """Test ResponseCache expiring responses"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache(ttl=-1000, min_ttl=-1)
+        cache.put(notaries[0], service, self._response())
+        self.assertIsNone(cache.get(notaries[0], service))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_eviction(self):
+        """Test ResponseCache evicting least recently used responses"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache(max_bytes=2 * ResponseCache.ENTRY_OVERHEAD)
+        for notary in notaries[:2]:
+            cache.put(notary, service, self._response())
+        # Use first, so second is least recently used
+        self.assertIsNotNone(cache.get(notaries[0], service))
+        cache.put(notaries[2], service, self._response())
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNotNone(cache.get(notaries[0], service))
+        self.assertIsNone(cache.get(notaries[1], service))
+        self.assertIsNotNone(cache.get(notaries[2], service))
+
+    def test_stale(self):
+        """Test ResponseCache returning stale responses for refresh"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache(ttl=-1000, min_ttl=-1)
+        response = self._response(age=100)
+        cache.put(notaries[0], service, response)
+        self.assertEqual(cache.lookup(notaries[0], service, 3600),
+                         (response, True))
+        # Refresh only asked for once
+        self.assertEqual(cache.lookup(notaries[0], service, 3600),
+                         (response, False))
+        cache.refresh_failed(notaries[0], service)
+        self.assertEqual(cache.lookup(notaries[0], service, 3600),
+                         (response, True))
+        self.assertEqual(cache.stale_hits, 3)
+        self.assertEqual(cache.refreshes, 2)
+        # Response older than stale limit
+        self.assertEqual(cache.lookup(notaries[0], service, 10),
+                         (None, False))
+        self.assertEqual(len(cache), 0)
+
+    def test_refresh_ahead(self):
+        """Test ResponseCache asking for hot responses to be refreshed"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache(ttl=10, min_ttl=0, refresh_ahead=1.0,
+                              hot_hits=2)
+        response = self._response()
+        cache.put(notaries[0], service, response)
+        self.assertEqual(cache.lookup(notaries[0], service),
+                         (response, False))
+        self.assertEqual(cache.lookup(notaries[0], service),
+                         (response, True))
+        self.assertEqual(cache.lookup(notaries[0], service),
+                         (response, False))
+        # A new response starts cold
+        cache.put(notaries[0], service, response)
+        self.assertEqual(cache.lookup(notaries[0], service),
+                         (response, False))
+        cache = ResponseCache(refresh_ahead=0.1, hot_hits=1)
+        cache.put(notaries[0], service, response)
+        self.assertEqual(cache.lookup(notaries[0], service),
+                         (response, False))
+
+    def test_query_stale(self):
+        """Test Notaries.query() returning stale responses"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache(ttl=-1000, min_ttl=-1)
+        notaries.response_cache = cache
+        refreshed = []
+        notaries._refresh_in_background = \
+            lambda service, notaries, timeout: refreshed.extend(notaries)
+        response = self._response()
+        for notary in notaries:
+            cache.put(notary, service, response)
+        notaries.stale_limit = 3600
+        responses = notaries.query(service, timeout=0.1)
+        for r in responses:
+            self.assertIs(r, response)
+        self.assertEqual(refreshed, list(notaries))
+
+    def test_refresh_in_background(self):
+        """Test failed background refresh can be asked for again"""
+        import socket
+        from Perspectives import Notaries
+        from Perspectives import Notary
+        from Perspectives import ResponseCache
+        refused = socket.socket()
+        refused.bind(("127.0.0.1", 0))
+        port = refused.getsockname()[1]
+        refused.close()
+        notaries = Notaries()
+        notaries.append(Notary("127.0.0.1", port,
+                               testutils.test_notaries()[0].public_key))
+        service = testutils.test_service()
+        cache = ResponseCache(ttl=-1000, min_ttl=-1)
+        notaries.response_cache = cache
+        response = self._response()
+        cache.put(notaries[0], service, response)
+        self.assertEqual(cache.lookup(notaries[0], service, 3600),
+                         (response, True))
+        thread = notaries._refresh_in_background(service, notaries, 2)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(cache.lookup(notaries[0], service, 3600),
+                         (response, True))
+
+    def test_query(self):
+        """Test Notaries.query() using ResponseCache"""
+        from Perspectives import ResponseCache
+        notaries = testutils.test_notaries()
+        service = testutils.test_service()
+        cache = ResponseCache()
+        notaries.response_cache = cache
+        response = self._response()
+        for notary in notaries:
+            cache.put(notary, service, response)
+        responses = notaries.query(service, timeout=0.1)
+        self.assertEqual(len(responses), len(notaries))
+        for r in responses:
+            self.assertIs(r, response)
+        self.assertEqual(cache.hits, len(notaries))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Unittests for VerificationCache class"""
+
+import unittest
+
+import testutils
+
+class TestVerificationCache(unittest.TestCase):
+    """Tests for VerificationCache class"""
+
+    def test_lru(self):
+        """Test VerificationCache eviction and counters"""
+        from Perspectives import VerificationCache
+        cache = VerificationCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 1)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 0)  # Evicts "b", least recently used
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 0)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 1)
+
+    def test_verify_response(self):
+        """Test Protocol.verify_response() with a VerificationCache"""
+        from Perspectives import NotaryResponseBadSignature
+        from Perspectives import Protocol
+        from Perspectives import Service, ServiceType
+        from Perspectives import VerificationCache
+        notaries = testutils.test_notaries()
+        notary = notaries.find_notary("cmu.ron.lcs.mit.edu")
+        service = Service("www.citibank.com", 443, ServiceType.SSL)
+        protocol = Protocol(notary, service)
+        cache = VerificationCache()
+        protocol.verification_cache = cache
+        for i in range(3):
+            protocol.parse_response(testutils.load_response("response.1"))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+        for i in range(2):
+            with self.assertRaises(NotaryResponseBadSignature):
+                protocol.parse_response(
+                    testutils.load_response("response-bad.1"))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 3)
+
+if __name__ == "__main__":
+    unittest.main()
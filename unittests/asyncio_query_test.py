@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Unittests for asyncio_query module"""
+
+import socket
+import unittest
+
+import testutils
+
+class TestAsyncioQuery(unittest.TestCase):
+    """Tests for asyncio_query module"""
+
+    def setUp(self):
+        from Perspectives.asyncio_query import asyncio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _notary(self, port):
+        """Return Notary at port on localhost with key of response.1"""
+        from Perspectives import Notary
+        return Notary("127.0.0.1", port,
+                      testutils.test_notaries().find_notary(
+                          "cmu.ron.lcs.mit.edu").public_key)
+
+    def _service(self):
+        from Perspectives import Service, ServiceType
+        return Service("www.citibank.com", 443, ServiceType.SSL)
+
+    def test_query_notary(self):
+        """Test query_notary() getting a response"""
+        from Perspectives import NotaryResponse
+        from Perspectives.asyncio_query import query_notary
+        response_data = testutils.load_response("response.1")
+        server = testutils.LocalServer(lambda path: (200, response_data))
+        try:
+            notary = self._notary(server.port)
+            response = self.loop.run_until_complete(
+                query_notary(notary, self._service(), timeout=5,
+                             loop=self.loop))
+        finally:
+            server.close()
+        self.assertIsInstance(response, NotaryResponse)
+        self.assertIs(response.notary, notary)
+
+    def test_unknown_service(self):
+        """Test query_notary() with notary not knowing the service"""
+        from Perspectives import NotaryUnknownServiceException
+        from Perspectives.asyncio_query import query_notary
+        server = testutils.LocalServer(lambda path: (404, ""))
+        try:
+            future = query_notary(self._notary(server.port), self._service(),
+                                  timeout=5, loop=self.loop)
+            self.assertRaises(NotaryUnknownServiceException,
+                              self.loop.run_until_complete, future)
+        finally:
+            server.close()
+
+    def test_timeout(self):
+        """Test query_notary() with notary not responding in time"""
+        from Perspectives.asyncio_query import query_notary
+        server = testutils.LocalServer(lambda path: (200, ""), delay=1)
+        try:
+            future = query_notary(self._notary(server.port), self._service(),
+                                  timeout=0.2, loop=self.loop)
+            self.assertRaises(socket.timeout,
+                              self.loop.run_until_complete, future)
+        finally:
+            server.close()
+
+    def test_connection_refused(self):
+        """Test query_notary() with notary refusing connections"""
+        from Perspectives.asyncio_query import query_notary
+        refused = socket.socket()
+        refused.bind(("127.0.0.1", 0))
+        port = refused.getsockname()[1]
+        refused.close()
+        future = query_notary(self._notary(port), self._service(),
+                              timeout=5, loop=self.loop)
+        # trollius raises OSError subclasses, as Python 3 does
+        self.assertRaises((socket.error, OSError),
+                          self.loop.run_until_complete, future)
+
+    def test_ssl(self):
+        """Test query_notary() using SSL context of ssl_sessions"""
+        from Perspectives import Notary
+        from Perspectives import Protocol
+        from Perspectives.asyncio_query import query_notary
+        from Perspectives.ssl_session_cache import ssl_session_cache
+
+        class https_protocol(Protocol):
+            scheme = "https"
+
+        response_data = testutils.load_response("response.1")
+        server = testutils.LocalServer(
+            lambda path: (200, response_data),
+            ssl_context=testutils.LocalServer.ssl_server_context())
+        ssl_sessions = ssl_session_cache()
+        try:
+            notary = Notary("127.0.0.1", server.port,
+                            self._notary(server.port).public_key,
+                            protocol_class=https_protocol)
+            response = self.loop.run_until_complete(
+                query_notary(notary, self._service(), timeout=5,
+                             loop=self.loop, ssl_sessions=ssl_sessions))
+        finally:
+            server.close()
+        self.assertIsNotNone(response)
+        self.assertIsNotNone(ssl_sessions._ssl_context)
+
+    def test_async_query(self):
+        """Test Notaries.async_query()"""
+        from Perspectives import Notaries
+        response_data = testutils.load_response("response.1")
+        server = testutils.LocalServer(lambda path: (200, response_data))
+        try:
+            notaries = Notaries()
+            notaries.append(self._notary(server.port))
+            responses = self.loop.run_until_complete(
+                notaries.async_query(self._service(), timeout=5,
+                                     loop=self.loop))
+        finally:
+            server.close()
+        self.assertEqual(len(responses), 1)
+        self.assertIsNotNone(responses[0])
+
+if __name__ == "__main__":
+    unittest.main()
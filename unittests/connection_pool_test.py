@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Unittests for connection_pool class"""
+
+import socket
+import unittest
+
+class TestConnectionPool(unittest.TestCase):
+    """Tests for connection_pool class"""
+
+    def test_get_put(self):
+        """Test connection_pool get() and put()"""
+        from Perspectives.connection_pool import connection_pool
+        pool = connection_pool()
+        self.assertIsNone(pool.get("a"))
+        sock, peer = socket.socketpair()
+        pool.put("a", sock)
+        self.assertEqual(len(pool), 1)
+        self.assertIsNone(pool.get("b"))
+        self.assertIs(pool.get("a"), sock)
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.reused, 1)
+        self.assertEqual(pool.created, 2)
+
+    def test_closed_by_peer(self):
+        """Test connection_pool discarding sockets closed by peer"""
+        from Perspectives.connection_pool import connection_pool
+        pool = connection_pool()
+        sock, peer = socket.socketpair()
+        pool.put("a", sock)
+        peer.close()
+        self.assertIsNone(pool.get("a"))
+
+    def test_idle_timeout(self):
+        """Test connection_pool idle timeout"""
+        from Perspectives.connection_pool import connection_pool
+        pool = connection_pool(idle_timeout=-1)
+        sock, peer = socket.socketpair()
+        pool.put("a", sock)
+        self.assertIsNone(pool.get("a"))
+
+    def test_limits(self):
+        """Test connection_pool size limits"""
+        from Perspectives.connection_pool import connection_pool
+        pool = connection_pool(max_idle_per_host=2, max_idle=3)
+        pairs = [socket.socketpair() for i in range(4)]
+        for sock, peer in pairs[:3]:
+            pool.put("a", sock)
+        self.assertEqual(len(pool), 2)
+        pool.put("b", pairs[3][0])
+        self.assertEqual(len(pool), 3)
+        pool.put("b", socket.socketpair()[0])
+        self.assertEqual(len(pool), 3)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Unittests for connection_race class"""
+
+import socket
+import time
+import unittest
+
+def listener(backlog=5):
+    """Return listening socket on localhost"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(backlog)
+    return sock
+
+class TestConnectionRace(unittest.TestCase):
+    """Tests for connection_race class"""
+
+    def _race(self, addresses, timers=None):
+        """Run connection_race, returning (sock, error, seconds)"""
+        from Perspectives.connection_race import connection_race
+        from Perspectives.timed_asyncore import loop_with_timeout
+        results = []
+        map = {}
+        race = connection_race(addresses, map,
+                               lambda sock, error: results.append(
+                (sock, error)),
+                               timers=timers, delay=0.05)
+        start = time.time()
+        race.start()
+        loop_with_timeout(timeout=5, map=map, timers=timers,
+                          until=lambda: len(results) > 0)
+        self.assertEqual(len(map), 0)
+        self.assertEqual(len(results), 1)
+        sock, error = results[0]
+        return sock, error, time.time() - start
+
+    def test_interleave(self):
+        """Test interleave_addresses()"""
+        from Perspectives.connection_race import interleave_addresses
+        addresses = [(6, "a"), (6, "b"), (6, "c"), (4, "d"), (4, "e")]
+        self.assertEqual(interleave_addresses(addresses),
+                         [(6, "a"), (4, "d"), (6, "b"), (4, "e"), (6, "c")])
+
+    def test_failover(self):
+        """Test connection_race moving on from refused connection"""
+        refused = listener()
+        refused_address = refused.getsockname()
+        refused.close()
+        good = listener()
+        sock, error, seconds = self._race(
+            [(socket.AF_INET, refused_address),
+             (socket.AF_INET, good.getsockname())])
+        self.assertIsNotNone(sock)
+        self.assertEqual(sock.getpeername(), good.getsockname())
+        sock.close()
+        good.close()
+
+    def test_all_fail(self):
+        """Test connection_race with all connections refused"""
+        refused = listener()
+        refused_address = refused.getsockname()
+        refused.close()
+        sock, error, seconds = self._race([(socket.AF_INET, refused_address),
+                                           (socket.AF_INET, refused_address)])
+        self.assertIsNone(sock)
+        self.assertIsInstance(error, socket.error)
+
+    def test_staggered(self):
+        """Test connection_race starting next attempt after delay"""
+        from Perspectives.timed_asyncore import Timers
+        # Listener with full backlog, so connections to it hang
+        blackhole = listener(backlog=0)
+        filler = socket.socket()
+        filler.connect(blackhole.getsockname())
+        good = listener()
+        sock, error, seconds = self._race(
+            [(socket.AF_INET, blackhole.getsockname()),
+             (socket.AF_INET, good.getsockname())], timers=Timers())
+        self.assertIsNotNone(sock)
+        self.assertEqual(sock.getpeername(), good.getsockname())
+        self.assertLess(seconds, 1)
+        for s in (sock, good, filler, blackhole):
+            s.close()
+
+if __name__ == "__main__":
+    unittest.main()
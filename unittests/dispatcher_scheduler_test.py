@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Unittests for dispatcher_scheduler class"""
+
+import unittest
+
+class FakeDispatcher:
+    """Stand-in for a dispatcher"""
+    def __init__(self, map):
+        self.finished = False
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+class TestDispatcherScheduler(unittest.TestCase):
+    """Tests for dispatcher_scheduler class"""
+
+    def test_limits(self):
+        """Test dispatcher_scheduler open limits"""
+        from Perspectives.dispatcher_scheduler import dispatcher_scheduler
+        scheduler = dispatcher_scheduler(max_open=3, max_open_per_host=2)
+        done = []
+        jobs = [scheduler.add(FakeDispatcher, host=host,
+                              callback=done.append)
+                for host in ["a"] * 4 + ["b"]]
+        scheduler._reap()
+        scheduler._start_waiting()
+        # Two from host a and one from host b
+        started = [job for job in jobs if job.dispatcher is not None]
+        self.assertEqual(len(started), 3)
+        self.assertEqual(len([job for job in started if job.host == "a"]), 2)
+        self.assertIsNotNone(jobs[4].dispatcher)
+        # Finishing b does not allow a third from host a
+        jobs[4].dispatcher.finished = True
+        scheduler._reap()
+        scheduler._start_waiting()
+        self.assertEqual(done, [jobs[4]])
+        self.assertEqual(len([job for job in jobs
+                              if job.dispatcher is not None]), 3)
+        # Finishing an a does
+        jobs[0].dispatcher.finished = True
+        scheduler._reap()
+        scheduler._start_waiting()
+        self.assertEqual(done, [jobs[4], jobs[0]])
+        self.assertIsNotNone(jobs[2].dispatcher)
+        self.assertIsNone(jobs[3].dispatcher)
+        scheduler.abort()
+        self.assertTrue(jobs[1].dispatcher.aborted)
+        self.assertTrue(jobs[2].dispatcher.aborted)
+        self.assertFalse(jobs[3].done)
+
+    def test_start_error(self):
+        """Test dispatcher_scheduler with dispatcher failing to start"""
+        from Perspectives.dispatcher_scheduler import dispatcher_scheduler
+        def factory(map):
+            raise IOError("Failed")
+        scheduler = dispatcher_scheduler(max_open=1)
+        job = scheduler.add(factory)
+        scheduler.run(timeout=1)
+        self.assertTrue(job.done)
+        self.assertIsInstance(job.error, IOError)
+
+    def test_until(self):
+        """Test dispatcher_scheduler checking until before starting jobs"""
+        from Perspectives.dispatcher_scheduler import dispatcher_scheduler
+        scheduler = dispatcher_scheduler()
+        job = scheduler.add(FakeDispatcher)
+        scheduler.run(timeout=1, until=lambda: True)
+        self.assertIsNone(job.dispatcher)
+        scheduler.abort()
+        self.assertFalse(job.done)
+
+    def test_timers(self):
+        """Test dispatcher_scheduler using given Timers"""
+        from Perspectives.dispatcher_scheduler import dispatcher_scheduler
+        from Perspectives.timed_asyncore import Timers
+        timers = Timers()
+        self.assertIs(dispatcher_scheduler(timers=timers).timers, timers)
+        self.assertIsInstance(dispatcher_scheduler().timers, Timers)
+
+if __name__ == "__main__":
+    unittest.main()
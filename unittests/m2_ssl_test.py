@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Unittests for m2_ssl module"""
+
+import socket
+import ssl
+import unittest
+
+class TestM2SSL(unittest.TestCase):
+    """Tests for m2_ssl module"""
+
+    def _connection(self):
+        """Return (m2_ssl_socket, peer socket) over a socket pair"""
+        from Perspectives.m2_ssl import m2_ssl_context
+        sock, peer = socket.socketpair()
+        sock.setblocking(0)
+        return m2_ssl_context().wrap_socket(sock), peer
+
+    def test_handshake_want_read(self):
+        """Test do_handshake() waiting for the server"""
+        conn, peer = self._connection()
+        try:
+            with self.assertRaises(ssl.SSLError) as cm:
+                conn.do_handshake()
+            self.assertEqual(cm.exception.args[0], ssl.SSL_ERROR_WANT_READ)
+        finally:
+            conn.close()
+            peer.close()
+
+    def test_handshake_not_tls(self):
+        """Test do_handshake() failing against a server not speaking TLS"""
+        conn, peer = self._connection()
+        try:
+            self.assertRaises(ssl.SSLError, conn.do_handshake)
+            peer.sendall("HTTP/1.0 400 Bad Request\r\n\r\n")
+            with self.assertRaises(ssl.SSLError) as cm:
+                conn.do_handshake()
+            self.assertEqual(cm.exception.args[0], ssl.SSL_ERROR_SSL)
+        finally:
+            conn.close()
+            peer.close()
+
+    def test_handshake_failed(self):
+        """Test do_handshake() failing when it cannot continue"""
+        conn, peer = self._connection()
+        # Handshake not started, so OpenSSL has nothing to wait for
+        conn.connection.connect_ssl = lambda: 0
+        try:
+            with self.assertRaises(ssl.SSLError) as cm:
+                conn.do_handshake()
+            self.assertEqual(cm.exception.args[0], ssl.SSL_ERROR_SSL)
+        finally:
+            conn.close()
+            peer.close()
+
+if __name__ == "__main__":
+    unittest.main()
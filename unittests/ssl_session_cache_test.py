@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Unittests for ssl_session_cache class"""
+
+import unittest
+
+import testutils
+
+class fake_ssl_socket:
+    """Stand-in for SSLSocket with the session API"""
+
+    def __init__(self, session, session_reused):
+        self.session = session
+        self.session_reused = session_reused
+
+class TestSSLSessionCache(unittest.TestCase):
+    """Tests for ssl_session_cache class"""
+
+    def test_contexts(self):
+        """Test ssl_session_cache sharing contexts per key"""
+        from Perspectives.ssl_session_cache import ssl_session_cache
+        cache = ssl_session_cache()
+        context = cache.get_context(("a", 443))
+        self.assertIs(cache.get_context(("a", 443)), context)
+        self.assertIsNot(cache.get_context(("b", 443)), context)
+        ssl_context = cache.get_ssl_context()
+        self.assertIs(cache.get_ssl_context(), ssl_context)
+        cache.clear()
+        self.assertIsNot(cache.get_ssl_context(), ssl_context)
+
+    def test_handshakes(self):
+        """Test ssl_session_cache session saving and statistics"""
+        from Perspectives.ssl_session_cache import ssl_session_cache
+        cache = ssl_session_cache()
+        self.assertEqual(cache.resumption_rate(), 0.0)
+        self.assertIsNone(cache.get_session(("a", 443)))
+        cache.handshake_done(("a", 443), fake_ssl_socket("s1", False))
+        self.assertEqual(cache.get_session(("a", 443)), "s1")
+        cache.handshake_done(("a", 443), fake_ssl_socket("s2", True))
+        self.assertEqual(cache.get_session(("a", 443)), "s2")
+        self.assertEqual(cache.handshakes, 2)
+        self.assertEqual(cache.resumed, 1)
+        self.assertEqual(cache.resumption_rate(), 0.5)
+        cache.clear()
+        self.assertIsNone(cache.get_session(("a", 443)))
+
+    def test_resumption(self):
+        """Test second connection to a local SSL server resuming session"""
+        from Perspectives.HTTP_dispatcher import HTTP_dispatcher
+        from Perspectives.ssl_session_cache import ssl_session_cache
+        from Perspectives.timed_asyncore import loop_with_timeout
+        server = testutils.LocalServer(
+            lambda path: (200, "hello"),
+            ssl_context=testutils.LocalServer.ssl_server_context())
+        cache = ssl_session_cache()
+        for i in range(2):
+            map = {}
+            dispatcher = HTTP_dispatcher(("https", "127.0.0.1", server.port),
+                                         map=map,
+                                         request="GET / HTTP/1.1\r\n"
+                                         "Host: 127.0.0.1\r\n\r\n",
+                                         ssl_sessions=cache)
+            loop_with_timeout(timeout=5, map=map)
+            self.assertEqual(dispatcher.get_response().read(), "hello")
+        server.close()
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(cache.handshakes, 2)
+        self.assertEqual(cache.resumed, 1)
+        self.assertEqual(cache.resumption_rate(), 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
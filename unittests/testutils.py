@@ -51,3 +51,117 @@ def create_NotaryResponse():
     response_string = load_response("response.1")
     response = protocol.parse_response(response_string)
     return response
+
+def create_synthetic_NotaryResponse(keys):
+    """Return an unsigned NotaryResponse with the given keys.
+
+    keys is a list of (fingerprint string, [(start, end), ...])"""
+    from Perspectives import NotaryResponse
+    from Perspectives import NotaryResponseKey
+    from Perspectives import NotaryResponseTimeSpan
+    from Perspectives import Fingerprint
+    from Perspectives import ServiceType
+    response_keys = [
+        NotaryResponseKey(ServiceType.SSL,
+                          Fingerprint.from_string(fp),
+                          [NotaryResponseTimeSpan(start, end)
+                           for start, end in spans])
+        for fp, spans in keys]
+    return NotaryResponse(None, "1", response_keys, u"rsa-md5", "", "")
+
+class LocalServer:
+    """HTTP/1.1 server on localhost, handling each connection in a thread
+
+    respond is called as respond(path) for each request and returns
+    (status, body). delay is seconds to wait before each response.
+    If ssl_context is given, connections use SSL.
+
+    connections counts connections accepted and max_open the most
+    open at once."""
+
+    def __init__(self, respond, delay=0, ssl_context=None):
+        import socket
+        import threading
+        self.respond = respond
+        self.delay = delay
+        self.ssl_context = ssl_context
+        self.connections = 0
+        self.open = 0
+        self.max_open = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(50)
+        self.listener.settimeout(0.1)
+        self.port = self.listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def ssl_server_context():
+        """Return ssl.SSLContext for a server using our test certificate"""
+        import ssl
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(os.path.join(my_path, "ca-cert.pem"),
+                                os.path.join(my_path, "ca-key.pem"))
+        return context
+
+    def close(self):
+        import socket
+        self._closed = True
+        # Wake up accept() so the thread has exited when we return
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._thread.join()
+        self.listener.close()
+
+    def _accept(self):
+        import socket
+        import threading
+        while not self._closed:
+            try:
+                conn, address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self._closed:
+                    return
+                raise
+            with self._lock:
+                self.connections += 1
+                self.open += 1
+                self.max_open = max(self.max_open, self.open)
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, conn):
+        import socket
+        import time
+        try:
+            conn.settimeout(None)
+            if self.ssl_context is not None:
+                conn = self.ssl_context.wrap_socket(conn, server_side=True)
+            data = ""
+            while True:
+                chunk = conn.recv(8192)
+                if not chunk:
+                    break
+                data += chunk
+                while "\r\n\r\n" in data:
+                    request, data = data.split("\r\n\r\n", 1)
+                    status, body = self.respond(request.split(" ")[1])
+                    time.sleep(self.delay)
+                    conn.sendall("HTTP/1.1 %d X\r\n"
+                                 "Content-Length: %d\r\n\r\n%s" % (
+                            status, len(body), body))
+        except (socket.error, IOError):
+            pass
+        finally:
+            with self._lock:
+                self.open -= 1
+            conn.close()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Unittests for timed_asyncore module"""
+
+import asyncore
+import socket
+import time
+import unittest
+
+class echo_dispatcher(asyncore.dispatcher):
+    """Send data, then read what is echoed back until peer closes"""
+
+    def __init__(self, sock, data, map):
+        asyncore.dispatcher.__init__(self, sock, map=map)
+        self.write_buffer = data
+        self.read = ""
+
+    def writable(self):
+        return len(self.write_buffer) > 0
+
+    def handle_write(self):
+        sent = self.send(self.write_buffer)
+        self.write_buffer = self.write_buffer[sent:]
+
+    def handle_read(self):
+        self.read += self.recv(8192)
+
+    def handle_close(self):
+        self.close()
+
+class TestTimedAsyncore(unittest.TestCase):
+    """Tests for timed_asyncore module"""
+
+    def test_timers(self):
+        """Test Timers"""
+        from Perspectives.timed_asyncore import Timers
+        timers = Timers()
+        self.assertIsNone(timers.next_time())
+        called = []
+        timers.add(0, lambda: called.append(1))
+        cancelled = timers.add(0, lambda: called.append(2))
+        timers.add(60, lambda: called.append(3))
+        timers.cancel(cancelled)
+        self.assertEqual(len(timers), 2)
+        timers.run()
+        self.assertEqual(called, [1])
+        self.assertEqual(len(timers), 1)
+        self.assertGreater(timers.next_time(), time.time())
+
+    def test_backends(self):
+        """Test loop_with_timeout() with each backend"""
+        import select
+        from Perspectives.timed_asyncore import loop_with_timeout
+        backends = ["select", "poll", "auto"]
+        if hasattr(select, "epoll"):
+            backends.append("epoll")
+        for backend in backends:
+            map = {}
+            pairs = [socket.socketpair() for i in range(10)]
+            dispatchers = [echo_dispatcher(sock, "hello %d" % i, map)
+                           for i, (sock, peer) in enumerate(pairs)]
+            peers = dict([(peer.fileno(), peer) for sock, peer in pairs])
+
+            def _echo():
+                """Echo data back from peers, closing them once done"""
+                for fd, peer in peers.items():
+                    peer.setblocking(0)
+                    try:
+                        peer.sendall(peer.recv(8192))
+                    except socket.error:
+                        continue
+                    peer.close()
+                    del peers[fd]
+                return False
+
+            loop_with_timeout(timeout=5, map=map, until=_echo,
+                              backend=backend)
+            self.assertEqual(len(map), 0, backend)
+            for i, dispatcher in enumerate(dispatchers):
+                self.assertEqual(dispatcher.read, "hello %d" % i)
+
+    def test_auto_poller(self):
+        """Test auto_poller using select only for low fds"""
+        import select
+        from Perspectives import timed_asyncore
+        map = {}
+        sock, peer = socket.socketpair()
+        dispatcher = echo_dispatcher(sock, "hello", map)
+        poller = timed_asyncore.auto_poller()
+        poller.poll(0, map)
+        self.assertIsNone(poller._epoll)
+        self.assertEqual(dispatcher.write_buffer, "")
+        limit = timed_asyncore.select_fd_limit
+        timed_asyncore.select_fd_limit = sock.fileno()
+        try:
+            peer.sendall("x")
+            poller.poll(1, map)
+        finally:
+            timed_asyncore.select_fd_limit = limit
+        self.assertEqual(dispatcher.read, "x")
+        self.assertEqual(poller._epoll is not None, hasattr(select, "epoll"))
+        poller.close()
+        dispatcher.close()
+        peer.close()
+
+    def test_first_byte_deadline(self):
+        """Test HTTP_dispatcher missing first byte deadline"""
+        from Perspectives.HTTP_dispatcher import HTTP_dispatcher
+        from Perspectives.timed_asyncore import Timers, loop_with_timeout
+        # Server that accepts connections but never responds
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+        url = "http://127.0.0.1:%d/" % listener.getsockname()[1]
+        map = {}
+        timers = Timers()
+        dispatcher = HTTP_dispatcher(url, map=map, timers=timers,
+                                     connect_timeout=5,
+                                     first_byte_timeout=0.1)
+        start = time.time()
+        loop_with_timeout(timeout=5, map=map, timers=timers)
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(dispatcher.finished)
+        self.assertEqual(dispatcher.timed_out, "first_byte")
+        self.assertEqual(len(timers), 0)
+        self.assertRaises(socket.timeout, dispatcher.get_response)
+        listener.close()
+
+    def test_connect_deadline(self):
+        """Test HTTP_dispatcher missing connect deadline"""
+        import errno
+        from Perspectives.HTTP_dispatcher import HTTP_dispatcher
+        from Perspectives.timed_asyncore import Timers, loop_with_timeout
+        # Server that accepts connections but never does an SSL handshake
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+        url = "https://127.0.0.1:%d/" % listener.getsockname()[1]
+        map = {}
+        timers = Timers()
+        dispatcher = HTTP_dispatcher(url, map=map, timers=timers,
+                                     connect_timeout=0.1)
+        loop_with_timeout(timeout=5, map=map, timers=timers)
+        self.assertTrue(dispatcher.finished)
+        self.assertEqual(dispatcher.timed_out, "connect")
+        try:
+            dispatcher.get_response()
+        except socket.timeout:
+            self.fail("Missed connect deadline raised socket.timeout")
+        except socket.error as e:
+            self.assertEqual(e.errno, errno.ETIMEDOUT)
+        else:
+            self.fail("No error for missed connect deadline")
+        listener.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Compare Perspectives notary reply XML parsers
+
+Times Protocol's expat and minidom parsers over the response.*
+fixtures in unittests/ (or the given files). Signatures are not
+verified, so only parsing is measured."""
+
+import argparse
+import glob
+import os.path
+import sys
+import timeit
+
+import Perspectives
+
+def main(argv=None):
+    # Do argv default this way, as doing it in the functional
+    # declaration sets it at compile time.
+    if argv is None:
+        argv = sys.argv
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "unittests", "response.[0-9]*")
+
+    # Argument parsing
+    parser = argparse.ArgumentParser(
+        description=__doc__, # printed with -h/--help
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        )
+    parser.add_argument("-n", "--number",
+                        type=int, default=1000,
+                        help="number of times to parse each reply",
+                        metavar="num")
+    parser.add_argument('files', metavar='files',
+                        type=str, nargs='*',
+                        help='replies to parse (default is unittests fixtures)')
+    args = parser.parse_args(argv[1:])
+
+    filenames = args.files if len(args.files) != 0 else sorted(glob.glob(fixtures))
+    service = Perspectives.Service("www.citibank.com", 443)
+    protocol = Perspectives.Protocol(None, service)
+    for filename in filenames:
+        with open(filename) as f:
+            data = f.read()
+        print "%s (%d bytes):" % (os.path.basename(filename), len(data))
+        for name, func in [("expat", protocol._parse_expat),
+                           ("minidom", protocol._parse_minidom)]:
+            seconds = timeit.timeit(lambda: func(data), number=args.number)
+            print "\t%-8s %8.1f usec/reply" % (name,
+                                               seconds * 1e6 / args.number)
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())
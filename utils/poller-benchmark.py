@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Compare timed_asyncore loop backends with many open sockets
+
+Opens the given numbers of idle UDP sockets, each with a dispatcher,
+and times rounds in which a few of them receive a datagram, as when
+most notary queries are waiting on the network. select is skipped
+when sockets would exceed timed_asyncore.select_fd_limit."""
+
+import argparse
+import asyncore
+import random
+import resource
+import select
+import socket
+import sys
+import time
+
+from Perspectives import timed_asyncore
+
+class udp_dispatcher(asyncore.dispatcher):
+    """Read and count datagrams"""
+
+    counter = [0]
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(1024)
+        self.counter[0] += 1
+
+def time_backend(backend, dispatchers, map, rounds, active):
+    """Return average seconds per round for backend
+
+    All rounds run in one loop, as in dispatcher_scheduler.run()."""
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addresses = [dispatcher.socket.getsockname()
+                 for dispatcher in dispatchers]
+    remaining = [rounds]
+
+    def _next_round():
+        if udp_dispatcher.counter[0] < active:
+            return False
+        if remaining[0] == 0:
+            return True
+        remaining[0] -= 1
+        udp_dispatcher.counter[0] = 0
+        for address in random.sample(addresses, active):
+            sender.sendto("x", address)
+        return False
+
+    udp_dispatcher.counter[0] = active
+    start = time.time()
+    timed_asyncore.loop_with_timeout(timeout=60, map=map, backend=backend,
+                                     until=_next_round)
+    sender.close()
+    return (time.time() - start) / rounds
+
+def main(argv=None):
+    # Do argv default this way, as doing it in the functional
+    # declaration sets it at compile time.
+    if argv is None:
+        argv = sys.argv
+
+    # Argument parsing
+    parser = argparse.ArgumentParser(
+        description=__doc__, # printed with -h/--help
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        )
+    parser.add_argument("-r", "--rounds",
+                        type=int, default=100,
+                        help="number of rounds to time",
+                        metavar="num")
+    parser.add_argument("-a", "--active",
+                        type=int, default=10,
+                        help="sockets receiving data each round",
+                        metavar="num")
+    parser.add_argument('sizes', metavar='sizes',
+                        type=int, nargs='*',
+                        help='numbers of sockets (default 100 1000 10000)')
+    args = parser.parse_args(argv[1:])
+
+    sizes = args.sizes if len(args.sizes) != 0 else [100, 1000, 10000]
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    backends = ["select", "poll"]
+    if hasattr(select, "epoll"):
+        backends.append("epoll")
+    backends.append("auto")
+    for size in sizes:
+        map = {}
+        dispatchers = []
+        for i in range(size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            dispatchers.append(udp_dispatcher(sock, map=map))
+        print "%d sockets:" % size
+        max_fd = max(map.keys())
+        for backend in backends:
+            if (backend == "select") and \
+                    (max_fd >= timed_asyncore.select_fd_limit):
+                print "\t%-8s %10s" % (backend, "n/a")
+                continue
+            seconds = time_backend(backend, dispatchers, map,
+                                   args.rounds, min(args.active, size))
+            print "\t%-8s %10.1f usec/round" % (backend, seconds * 1e6)
+        for dispatcher in dispatchers:
+            dispatcher.close()
+    return(0)
+
+if __name__ == "__main__":
+    sys.exit(main())